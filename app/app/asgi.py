@@ -9,8 +9,20 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
+os.environ.setdefault('DJANGO_URLCONF', 'app.asgi_urls')
 
-application = get_asgi_application()
+# same as django.core.asgi.get_asgi_application, with streaming
+# responses read off the event loop; the app modules below need settings
+# and loaded apps
+django.setup(set_prefix=False)
+
+from app.async_views import StreamingASGIHandler  # noqa: E402
+from core.health import warm_urls  # noqa: E402
+
+application = StreamingASGIHandler()
+
+# load the views now so preforked workers share them and serve at once
+warm_urls()
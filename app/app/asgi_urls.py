@@ -0,0 +1,55 @@
+"""
+URL configuration used when serving over ASGI
+
+Same routes and names as app.urls, with the recipe and user API views
+wrapped by app.async_views.
+"""
+from django.urls import include, path
+from django.urls.resolvers import URLPattern
+
+from app import urls
+from app.async_views import (offload_reads, offload_to, PASSWORD_EXECUTOR)
+from recipe.urls import router
+from user import urls as user_urls
+
+
+def wrap_patterns(patterns, wrap):
+    # return copies of url patterns with wrapped views
+    return [
+        URLPattern(
+            pattern.pattern,
+            wrap(pattern),
+            pattern.default_args,
+            pattern.name,
+        )
+        for pattern in patterns
+    ]
+
+
+def wrap_user_view(pattern):
+    # password checks get their own pool
+    if pattern.name == 'token':
+        return offload_to(PASSWORD_EXECUTOR)(pattern.callback)
+
+    return offload_reads(pattern.callback)
+
+
+def wrap_recipe_view(pattern):
+    return offload_reads(pattern.callback)
+
+
+API_PREFIXES = ('api/user/', 'api/recipe/')
+
+urlpatterns = [
+    pattern for pattern in urls.urlpatterns
+    if str(pattern.pattern) not in API_PREFIXES
+] + [
+    path('api/user/', include((
+        wrap_patterns(user_urls.urlpatterns, wrap_user_view),
+        user_urls.app_name,
+    ))),
+    path('api/recipe/', include((
+        wrap_patterns(router.urls, wrap_recipe_view),
+        'recipe',
+    ))),
+]
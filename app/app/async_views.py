@@ -0,0 +1,132 @@
+"""
+Async wrappers used when serving the APIs over ASGI
+
+Django 3.2 has no async ORM and runs sync views on a single thread under
+ASGI, so view work is moved to bounded thread pools instead.
+"""
+import asyncio
+import contextvars
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIHandler
+from django.db import close_old_connections
+
+from core.profiling import sample_current_thread
+
+
+READ_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('ASGI_READ_THREADS', 8)),
+    thread_name_prefix='asgi-read',
+)
+PASSWORD_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('ASGI_PASSWORD_THREADS', 2)),
+    thread_name_prefix='asgi-password',
+)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# marks the end of a streaming response iterator
+STREAM_END = object()
+
+
+def _call_view(view, request, *args, **kwargs):
+    # request signals only reach Django's own thread, so manage the
+    # pool thread's database connection here
+    close_old_connections()
+    sample_current_thread()
+    try:
+        response = view(request, *args, **kwargs)
+        if hasattr(response, 'render') and callable(response.render):
+            response = response.render()
+        return response
+    finally:
+        close_old_connections()
+
+
+def _sampled_view(view, request, *args, **kwargs):
+    sample_current_thread()
+    return view(request, *args, **kwargs)
+
+
+async def run_in_pool(executor, view, request, *args, **kwargs):
+    # run a sync view on a pool thread with the current context
+    context = contextvars.copy_context()
+    call = functools.partial(
+        context.run, _call_view, view, request, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(executor, call)
+
+
+def offload_reads(view):
+    # serve safe methods from the read pool, anything else as Django would
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method in SAFE_METHODS:
+            return await run_in_pool(
+                READ_EXECUTOR, view, request, *args, **kwargs)
+
+        return await sync_to_async(_sampled_view, thread_sensitive=True)(
+            view, request, *args, **kwargs)
+
+    return wrapper
+
+
+def offload_to(executor):
+    # serve every request of a view from the given pool
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            return await run_in_pool(executor, view, request, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _next_part(iterator):
+    # stream generators query the database between parts, which the
+    # event loop thread refuses, so each part is read on a pool thread
+    close_old_connections()
+    try:
+        return next(iterator, STREAM_END)
+    finally:
+        close_old_connections()
+
+
+class StreamingASGIHandler(ASGIHandler):
+    # Django 3.2 iterates streaming responses on the event loop; read
+    # their parts on the read pool and send them from here instead
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+
+        headers = [
+            (header.encode('ascii'), value.encode('latin1'))
+            for header, value in response.items()
+        ] + [
+            (b'Set-Cookie', c.output(header='').encode('ascii').strip())
+            for c in response.cookies.values()
+        ]
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': headers,
+        })
+        iterator = iter(response)
+        loop = asyncio.get_running_loop()
+        while True:
+            context = contextvars.copy_context()
+            part = await loop.run_in_executor(
+                READ_EXECUTOR, context.run, _next_part, iterator)
+            if part is STREAM_END:
+                break
+            for chunk, _ in self.chunk_bytes(part):
+                await send({
+                    'type': 'http.response.body',
+                    'body': chunk,
+                    'more_body': True,
+                })
+        await send({'type': 'http.response.body'})
+        await sync_to_async(response.close, thread_sensitive=True)()
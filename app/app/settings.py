@@ -51,16 +51,23 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # answers /healthz and /readyz before sessions, auth and host checks
+    'core.health.HealthCheckMiddleware',
+    # times everything below it and answers /metrics
+    'core.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # removed from the stack at startup unless PROFILING is on
+    'core.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
-ROOT_URLCONF = 'app.urls'
+# app.asgi switches this to app.asgi_urls
+ROOT_URLCONF = os.environ.get('DJANGO_URLCONF', 'app.urls')
 
 TEMPLATES = [
     {
@@ -84,16 +91,107 @@ WSGI_APPLICATION = 'app.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
+# core.backends.postgresql adds CONN_HEALTH_CHECKS and POOL, see its
+# module docstring
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'core.backends.postgresql',
         'HOST': os.environ.get('DB_HOST'),
         'NAME': os.environ.get('DB_NAME'),
         'USER': os.environ.get('DB_USER'),
         'PASSWORD': os.environ.get('DB_PASS'),
+        # seconds a connection is reused across requests, 0 to close it
+        # after every request
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': bool(
+            int(os.environ.get('DB_CONN_HEALTH_CHECKS', 1))),
     }
 }
 
+# a pool shares connections between threads, for ASGI or threaded
+# servers; each request returns its connection to the pool when it ends
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 0))
+if DB_POOL_SIZE:
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': 0,
+        'POOL': {
+            'MAX_SIZE': DB_POOL_SIZE,
+            'TIMEOUT': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+            # pooled connections idle this long are pinged before reuse
+            'CHECK_IDLE_SECONDS': float(
+                os.environ.get('DB_POOL_CHECK_IDLE_SECONDS', 30)),
+        },
+    })
+
+# read replicas of the primary, e.g. DB_REPLICA_HOSTS=replica1,replica2;
+# safe requests to the recipe APIs read from one of them
+DATABASE_REPLICAS = []
+for index, host in enumerate(
+    filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(','))
+):
+    DATABASES[f'replica_{index}'] = dict(
+        DATABASES['default'], HOST=host, TEST={'MIRROR': 'default'})
+    DATABASE_REPLICAS.append(f'replica_{index}')
+
+DATABASE_ROUTERS = ['core.routers.ReplicaRouter']
+
+# seconds a user's reads stay on the primary after they write, so they
+# read their own writes; keep it above the worst replica lag
+REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS', 5))
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# the auth cache holds token key hashes and the users' fields other than
+# the password, so a warm token authenticates without a query. It is per
+# process by default, which is fine for tests and runserver; deployments
+# must point it at a shared in-memory backend (docker-compose-deploy.yml
+# runs memcached) so revocations and data version bumps reach every worker
+# immediately instead of after AUTH_CACHE_TIMEOUT seconds
+
+AUTH_CACHE_BACKEND = os.environ.get(
+    'AUTH_CACHE_BACKEND',
+    'django.core.cache.backends.locmem.LocMemCache',
+)
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'auth': {
+        'BACKEND': AUTH_CACHE_BACKEND,
+        'LOCATION': os.environ.get('AUTH_CACHE_LOCATION', 'auth'),
+        'TIMEOUT': int(os.environ.get('AUTH_CACHE_TIMEOUT', 60)),
+    },
+}
+
+# memcached clients take their own options, the entry limit is locmem's
+if AUTH_CACHE_BACKEND.endswith('.LocMemCache'):
+    CACHES['auth']['OPTIONS'] = {
+        'MAX_ENTRIES': int(os.environ.get('AUTH_CACHE_MAX_ENTRIES', 10000)),
+    }
+
+
+# seconds a /readyz result is reused before the checks run again
+HEALTH_CHECK_CACHE_SECONDS = float(
+    os.environ.get('HEALTH_CHECK_CACHE_SECONDS', 2))
+
+
+# sampling request profiler, see core.profiling; staff can also ask for a
+# profile of one request with an X-Profile header
+PROFILING = bool(int(os.environ.get('PROFILING', 0)))
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', 0.005))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '/tmp/profiles')
+# profiles kept per route; older ones are deleted
+PROFILE_RING_SIZE = int(os.environ.get('PROFILE_RING_SIZE', 50))
+
+
+# raise instead of logging when a view runs more queries than its
+# query_budget allows, see core.query_budget; always on in tests
+QUERY_BUDGET_STRICT = bool(int(os.environ.get('QUERY_BUDGET_STRICT', 0)))
+TEST_RUNNER = 'core.test_runner.TestRunner'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -135,7 +233,13 @@ STATIC_URL = '/static/static/'
 MEDIA_URL = '/static/media/'
 
 MEDIA_ROOT = '/vol/web/media'
-STATIC_ROOT = '/vol/web/static'
+# the image collects static files at build time, see the Dockerfile
+STATIC_ROOT = os.environ.get('STATIC_ROOT', '/vol/web/static')
+STATICFILES_STORAGE = 'core.storage.CompressedManifestStaticFilesStorage'
+
+# 'content' names recipe images by their SHA-256 so duplicates share one
+# file, 'uuid' gives every upload its own random name
+RECIPE_IMAGE_STORAGE = os.environ.get('RECIPE_IMAGE_STORAGE', 'content')
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
@@ -0,0 +1,272 @@
+"""
+Tests for the ASGI url configuration
+"""
+import asyncio
+import json
+import threading
+import time
+from decimal import Decimal
+from unittest.mock import patch
+
+from asgiref.testing import ApplicationCommunicator
+from django.contrib.auth import get_user_model
+from django.core.exceptions import SynchronousOnlyOperation
+from django.core.handlers.asgi import ASGIHandler
+from django.http import HttpResponse
+from django.test import (
+    AsyncClient,
+    RequestFactory,
+    SimpleTestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+
+from app.asgi import application
+from app.async_views import (StreamingASGIHandler, offload_reads)
+from core.health import Readiness
+from core.models import (Recipe, Tag)
+from recipe.views import TagViewSet
+
+
+TAGS_URL = '/api/recipe/tags/'
+SLOW_VIEW_SECONDS = 1
+
+
+def thread_name_view(request):
+    return HttpResponse(threading.current_thread().name)
+
+
+async def asgi_request(application, path, query_string=b'', token=None):
+    # send a GET through an ASGI application and return its messages
+    headers = [(b'host', b'testserver')]
+    if token is not None:
+        headers.append((b'authorization', f'Token {token}'.encode()))
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'query_string': query_string,
+        'headers': headers,
+    }
+    communicator = ApplicationCommunicator(application, scope)
+    await communicator.send_input({'type': 'http.request'})
+    messages = []
+    while True:
+        message = await communicator.receive_output(5)
+        messages.append(message)
+        if (message['type'] == 'http.response.body' and
+                not message.get('more_body')):
+            await communicator.wait(5)
+            return messages
+
+
+class OffloadTests(SimpleTestCase):
+    def test_reads_use_read_pool(self):
+        # test safe methods run on the read pool and writes do not
+        view = offload_reads(thread_name_view)
+        factory = RequestFactory()
+
+        read = asyncio.run(view(factory.get('/')))
+        write = asyncio.run(view(factory.post('/')))
+
+        self.assertTrue(read.content.startswith(b'asgi-read'))
+        self.assertFalse(write.content.startswith(b'asgi-read'))
+
+
+@override_settings(ROOT_URLCONF='app.asgi_urls')
+class AsgiApiTests(TransactionTestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='user@example.com', password='test123')
+        token = Token.objects.create(user=self.user)
+        self.auth = {'authorization': f'Token {token.key}'}
+        self.client = AsyncClient()
+        self.recipe = Recipe.objects.create(
+            user=self.user,
+            title='Sample recipe',
+            time_minutes=5,
+            price=Decimal('1.00'),
+        )
+        self.recipe.tags.add(Tag.objects.create(user=self.user, name='Vegan'))
+
+    def test_read_endpoints(self):
+        # test recipe, tag and ingredient reads are served
+        async def fetch():
+            return await asyncio.gather(
+                self.client.get(reverse('recipe:recipe-list'), **self.auth),
+                self.client.get(
+                    reverse('recipe:recipe-detail', args=[self.recipe.id]),
+                    **self.auth,
+                ),
+                self.client.get(reverse('recipe:tag-list'), **self.auth),
+                self.client.get(
+                    reverse('recipe:ingredient-list'), **self.auth),
+            )
+
+        recipes, detail, tags, ingredients = asyncio.run(fetch())
+
+        self.assertEqual(recipes.status_code, 200)
+        self.assertEqual(recipes.json()[0]['title'], 'Sample recipe')
+        self.assertEqual(detail.json()['tags'], [
+            {'id': self.recipe.tags.get().id, 'name': 'Vegan'}])
+        self.assertEqual(tags.json()[0]['name'], 'Vegan')
+        self.assertEqual(ingredients.json(), [])
+
+    def test_write_endpoint(self):
+        # test unsafe methods still reach the view
+        res = asyncio.run(self.client.patch(
+            reverse('recipe:recipe-detail', args=[self.recipe.id]),
+            {'title': 'New title'},
+            content_type='application/json',
+            **self.auth,
+        ))
+
+        self.assertEqual(res.status_code, 200)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.title, 'New title')
+
+    def test_token_endpoint(self):
+        # test tokens are issued from the password pool
+        res = asyncio.run(self.client.post(
+            reverse('user:token'),
+            {'email': 'user@example.com', 'password': 'test123'},
+            content_type='application/json',
+        ))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('token', res.json())
+
+    def test_auth_required(self):
+        # test reads still require authentication
+        res = asyncio.run(self.client.get(reverse('recipe:recipe-list')))
+
+        self.assertEqual(res.status_code, 401)
+
+
+@override_settings(ROOT_URLCONF='app.asgi_urls')
+class AsgiStreamingTests(TransactionTestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='user@example.com', password='test123')
+        self.token = Token.objects.create(user=self.user)
+        for n in range(3):
+            recipe = Recipe.objects.create(
+                user=self.user,
+                title=f'Recipe {n}',
+                time_minutes=5,
+                price=Decimal('1.00'),
+            )
+            recipe.tags.add(
+                Tag.objects.get_or_create(user=self.user, name='Vegan')[0])
+
+    def _export(self, application):
+        # run an export through the ASGI application, return the messages
+        return asyncio.run(asgi_request(
+            application,
+            reverse('recipe:recipe-export'),
+            query_string=b'format=ndjson',
+            token=self.token.key,
+        ))
+
+    def test_export_streams_over_asgi(self):
+        # test export chunks are read off the event loop
+        with patch('recipe.export.EXPORT_CHUNK_SIZE', 2):
+            messages = self._export(StreamingASGIHandler())
+
+        self.assertEqual(messages[0]['status'], 200)
+        body = b''.join(message.get('body', b'') for message in messages)
+        lines = body.decode().splitlines()
+        self.assertEqual(
+            [json.loads(line)['title'] for line in lines],
+            ['Recipe 0', 'Recipe 1', 'Recipe 2'],
+        )
+        self.assertEqual(json.loads(lines[0])['tags'], ['Vegan'])
+
+    def test_stock_handler_queries_on_event_loop(self):
+        # test the plain Django 3.2 handler fails once the stream queries
+        with self.assertRaises(SynchronousOnlyOperation):
+            self._export(ASGIHandler())
+
+
+@override_settings(ROOT_URLCONF='app.asgi_urls')
+class AsgiConcurrencyTests(TransactionTestCase):
+    # tests for requests overlapping in app.asgi.application
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='user@example.com', password='test123')
+        self.token = Token.objects.create(user=self.user).key
+
+    def _timed(self, path, started):
+        # return (seconds from start to the last message, status)
+        async def run():
+            messages = await asgi_request(application, path, token=self.token)
+            return time.monotonic() - started, messages[0]['status']
+
+        return run()
+
+    def _slow_tags(self):
+        # make the tag list take SLOW_VIEW_SECONDS on its pool thread
+        get_queryset = TagViewSet.get_queryset
+
+        def slow(view):
+            time.sleep(SLOW_VIEW_SECONDS)
+            return get_queryset(view)
+
+        return patch.object(TagViewSet, 'get_queryset', slow)
+
+    def test_probes_answer_during_slow_requests(self):
+        # test probes are not queued behind requests in flight
+        async def fetch():
+            started = time.monotonic()
+            slow = [
+                asyncio.ensure_future(self._timed(TAGS_URL, started))
+                for _ in range(3)
+            ]
+            await asyncio.sleep(0.1)
+            probes = await asyncio.gather(
+                self._timed('/healthz', started),
+                self._timed('/readyz', started),
+            )
+            return probes, await asyncio.gather(*slow)
+
+        with self._slow_tags(), patch(
+                'core.health.readiness', new_callable=Readiness):
+            probes, slow = asyncio.run(fetch())
+
+        for seconds, status in probes:
+            self.assertEqual(status, 200)
+            self.assertLess(seconds, SLOW_VIEW_SECONDS)
+        for seconds, status in slow:
+            self.assertEqual(status, 200)
+            self.assertLess(seconds, 2 * SLOW_VIEW_SECONDS)
+
+    def test_reads_overlap(self):
+        # test reads run side by side on the read pool, end to end
+        threads = []
+        get_queryset = TagViewSet.get_queryset
+
+        def slow(view):
+            threads.append(threading.current_thread().name)
+            time.sleep(SLOW_VIEW_SECONDS)
+            return get_queryset(view)
+
+        async def fetch():
+            started = time.monotonic()
+            return await asyncio.gather(*[
+                self._timed(TAGS_URL, started) for _ in range(4)
+            ])
+
+        with patch.object(TagViewSet, 'get_queryset', slow):
+            results = asyncio.run(fetch())
+
+        self.assertEqual([status for _, status in results], [200] * 4)
+        self.assertLess(max(seconds for seconds, _ in results),
+                        1.5 * SLOW_VIEW_SECONDS)
+        self.assertEqual(len(set(threads)), 4)
+        self.assertTrue(all(name.startswith('asgi-read') for name in threads))
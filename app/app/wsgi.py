@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
 
 application = get_wsgi_application()
+
+from core.health import warm_urls  # noqa: E402
+
+# load the views now so preforked workers share them and serve at once
+warm_urls()
@@ -0,0 +1,186 @@
+"""
+in-process database connection pool
+
+Threaded and ASGI servers run many requests per process; a pool shares a
+bounded number of connections between their threads instead of keeping one
+per thread. Pools are per process and per database alias.
+"""
+import collections
+import os
+import threading
+import time
+
+
+class PoolTimeout(Exception):
+    # no connection was returned to the pool within the checkout timeout
+    pass
+
+
+class ConnectionPool:
+    # hand out up to max_size connections made by connect()
+
+    def __init__(self, connect, max_size, timeout, check=None, reset=None,
+                 check_idle=0):
+        self.connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        # check(connection) -> bool, run before reusing a connection that
+        # was idle check_idle seconds or more, or saw an error
+        self.check = check
+        self.check_idle = check_idle
+        # reset(connection) -> bool, run when a connection comes back
+        self.reset = reset
+        self.pid = os.getpid()
+        self._idle = collections.deque()
+        self._cond = threading.Condition()
+        # open connections, idle or checked out
+        self.size = 0
+        self.checkouts = 0
+        self.checks = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.checkout_seconds = 0.0
+        self.max_checkout_seconds = 0.0
+
+    def _take(self, deadline):
+        # return an idle (connection, idle since, suspect) entry, or None
+        # once a new one may be opened
+        with self._cond:
+            waited = False
+            while not self._idle and self.size >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeout(
+                        f'No connection free after {self.timeout}s '
+                        f'({self.max_size} in use)')
+                if not waited:
+                    self.waits += 1
+                    waited = True
+                self._cond.wait(remaining)
+            if self._idle:
+                return self._idle.pop()
+
+            self.size += 1
+            return None
+
+    def _discard(self, connection):
+        with self._cond:
+            self.size -= 1
+            self._cond.notify()
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def checkout(self):
+        # return a working connection, waiting up to timeout for one
+        start = time.monotonic()
+        deadline = start + self.timeout
+        while True:
+            idle = self._take(deadline)
+            if idle is None:
+                try:
+                    connection = self.connect()
+                except Exception:
+                    with self._cond:
+                        self.size -= 1
+                        self._cond.notify()
+                    raise
+                break
+            connection, since, suspect = idle
+            if not self._needs_check(since, suspect):
+                break
+            with self._cond:
+                self.checks += 1
+            if self.check(connection):
+                break
+            # stale, e.g. closed by the server while idle
+            self._discard(connection)
+
+        elapsed = time.monotonic() - start
+        with self._cond:
+            self.checkouts += 1
+            self.checkout_seconds += elapsed
+            self.max_checkout_seconds = max(
+                self.max_checkout_seconds, elapsed)
+
+        return connection
+
+    def _needs_check(self, since, suspect):
+        # recently used connections are trusted unless they saw an error
+        if self.check is None:
+            return False
+        return suspect or time.monotonic() - since >= self.check_idle
+
+    def checkin(self, connection, suspect=False):
+        # take a connection back, closing it if it cannot be reused;
+        # suspect connections are checked before their next use
+        try:
+            reusable = self.reset is None or self.reset(connection)
+        except Exception:
+            reusable = False
+        if not reusable:
+            self._discard(connection)
+            return
+
+        with self._cond:
+            self._idle.append((connection, time.monotonic(), suspect))
+            self._cond.notify()
+
+    def close(self):
+        # close the idle connections
+        with self._cond:
+            idle, self._idle = list(self._idle), collections.deque()
+            self.size -= len(idle)
+        for connection, _, _ in idle:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    def stats(self):
+        with self._cond:
+            return {
+                'max_size': self.max_size,
+                'size': self.size,
+                'idle': len(self._idle),
+                'in_use': self.size - len(self._idle),
+                'checkouts': self.checkouts,
+                'checks': self.checks,
+                'waits': self.waits,
+                'timeouts': self.timeouts,
+                'checkout_seconds_total': self.checkout_seconds,
+                'checkout_seconds_max': self.max_checkout_seconds,
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+# pools inherited over fork; kept referenced so garbage collection never
+# closes connections the parent process is still using
+_inherited = []
+
+
+def get_pool(alias, **options):
+    # return the pool of this process for a database alias
+    with _pools_lock:
+        pool = _pools.get(alias)
+        if pool is not None and pool.pid != os.getpid():
+            _inherited.append(pool)
+            pool = None
+        if pool is None:
+            pool = _pools[alias] = ConnectionPool(**options)
+
+        return pool
+
+
+def pool_stats():
+    # return {alias: stats} for the pools of this process
+    with _pools_lock:
+        pools = {
+            alias: pool for alias, pool in _pools.items()
+            if pool.pid == os.getpid()
+        }
+
+    return {alias: pool.stats() for alias, pool in pools.items()}
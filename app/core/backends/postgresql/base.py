@@ -0,0 +1,132 @@
+"""
+PostgreSQL backend with connection health checks and optional pooling
+
+CONN_HEALTH_CHECKS checks a persistent connection still works before its
+first use in each request, so connections the server or a proxy dropped
+while idle are replaced instead of failing the request.
+
+POOL = {'MAX_SIZE': n, 'TIMEOUT': seconds} shares up to n connections
+between the threads of a process; closing a connection returns it to the
+pool. Use it with CONN_MAX_AGE = 0 so each request gives its connection
+back when it finishes. With CONN_HEALTH_CHECKS, a pooled connection is
+only checked when it sat idle for POOL['CHECK_IDLE_SECONDS'] (default 30)
+or its last user hit a database error, not on every checkout.
+"""
+import functools
+
+import psycopg2.extensions
+import psycopg2.extras
+from django.db.backends.postgresql import base
+
+from core.backends.pool import (PoolTimeout, get_pool)
+
+
+Database = base.Database
+
+
+def _ping(connection):
+    # return whether a raw connection still answers
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+    except Database.Error:
+        return False
+    return True
+
+
+def _reset(connection):
+    # roll back whatever the last user left open; False to discard
+    if connection.closed:
+        return False
+    status = connection.get_transaction_status()
+    if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        connection.rollback()
+    return (
+        connection.get_transaction_status() ==
+        psycopg2.extensions.TRANSACTION_STATUS_IDLE
+    )
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.health_check_done = False
+
+    @property
+    def health_check_enabled(self):
+        return self.settings_dict.get('CONN_HEALTH_CHECKS', False)
+
+    @property
+    def pool(self):
+        options = self.settings_dict.get('POOL')
+        if not options:
+            return None
+
+        return get_pool(
+            self.alias,
+            connect=functools.partial(
+                Database.connect, **self.get_connection_params()),
+            max_size=options.get('MAX_SIZE', 10),
+            timeout=options.get('TIMEOUT', 10),
+            check=_ping if self.health_check_enabled else None,
+            reset=_reset,
+            check_idle=options.get('CHECK_IDLE_SECONDS', 30),
+        )
+
+    def get_new_connection(self, conn_params):
+        pool = self.pool
+        if pool is None:
+            return super().get_new_connection(conn_params)
+
+        try:
+            connection = pool.checkout()
+        except PoolTimeout as exc:
+            raise Database.OperationalError(str(exc)) from exc
+        # the same set up the parent does for a fresh connection
+        options = self.settings_dict['OPTIONS']
+        try:
+            self.isolation_level = options['isolation_level']
+        except KeyError:
+            self.isolation_level = connection.isolation_level
+        else:
+            if self.isolation_level != connection.isolation_level:
+                connection.set_session(isolation_level=self.isolation_level)
+        psycopg2.extras.register_default_jsonb(
+            conn_or_curs=connection, loads=lambda x: x)
+        return connection
+
+    def _close(self):
+        pool = self.pool
+        if pool is None:
+            return super()._close()
+
+        pool.checkin(self.connection, suspect=self.errors_occurred)
+
+    def connect(self):
+        super().connect()
+        # a new or freshly checked out connection needs no check
+        self.health_check_done = True
+
+    def close_if_health_check_failed(self):
+        # close a dead persistent connection before its first use
+        if (self.connection is None or
+                not self.health_check_enabled or
+                self.health_check_done or
+                self.in_atomic_block):
+            return
+
+        if not self.is_usable():
+            self.close()
+        self.health_check_done = True
+
+    def ensure_connection(self):
+        self.close_if_health_check_failed()
+        super().ensure_connection()
+
+    def close_if_unusable_or_obsolete(self):
+        # runs when a request starts and finishes; the parent's autocommit
+        # lookup is not a use, the next query is checked instead
+        self.health_check_done = True
+        super().close_if_unusable_or_obsolete()
+        self.health_check_done = False
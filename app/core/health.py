@@ -0,0 +1,154 @@
+"""
+liveness and readiness probes
+
+/healthz answers as long as the process can serve requests. /readyz also
+checks the database is reachable, its migrations are applied and the
+per-process caches are warm. Both are answered by HealthCheckMiddleware
+ahead of the session, auth and host checks, and readiness results are
+reused for HEALTH_CHECK_CACHE_SECONDS so frequent probes stay cheap.
+Under ASGI the readiness checks run on a thread of their own, so a slow
+database holds up neither the event loop nor the thread Django runs
+sync code on.
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import (iscoroutinefunction, markcoroutinefunction)
+from django.conf import settings
+from django.core.cache import caches
+from django.db import (DatabaseError, connections)
+from django.db.migrations.executor import MigrationExecutor
+from django.http import JsonResponse
+from django.urls import get_resolver
+
+
+LIVENESS_PATHS = ('/healthz', '/healthz/')
+READINESS_PATHS = ('/readyz', '/readyz/')
+# readiness checks under ASGI; one thread, so one database connection
+PROBE_EXECUTOR = ThreadPoolExecutor(
+    max_workers=1, thread_name_prefix='readyz')
+
+
+def unapplied_migrations(using='default'):
+    # return the number of migrations not yet applied to a database
+    executor = MigrationExecutor(connections[using])
+    targets = executor.loader.graph.leaf_nodes()
+    return len(executor.migration_plan(targets))
+
+
+def warm_urls():
+    # import every view and build the URL maps; opens no connections, so
+    # it is safe in a server master before workers fork
+    get_resolver().reverse_dict
+
+
+def warm_caches():
+    # build the lazy per-process state the first requests would pay for
+    warm_urls()
+    for alias in settings.CACHES:
+        caches[alias].get('health:warm')
+
+
+class Readiness:
+    # run the readiness checks, at most once per cache period
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._result = None
+        self._checked_at = None
+        # these only go from false to true in a running process
+        self._migrated = False
+        self._warm = False
+
+    def _check_database(self):
+        connection = connections['default']
+        connection.ensure_connection()
+        if not connection.is_usable():
+            raise DatabaseError('Connection is not usable')
+
+    def _check_migrations(self):
+        if not self._migrated:
+            pending = unapplied_migrations()
+            if pending:
+                raise RuntimeError(f'{pending} migrations not applied')
+            self._migrated = True
+
+    def _check_caches(self):
+        if not self._warm:
+            warm_caches()
+            self._warm = True
+
+    def run(self):
+        # return (ready, {check: 'ok' or the error})
+        checks = {}
+        for name, check in (
+            ('database', self._check_database),
+            ('migrations', self._check_migrations),
+            ('caches', self._check_caches),
+        ):
+            try:
+                check()
+            except Exception as exc:
+                checks[name] = str(exc) or exc.__class__.__name__
+            else:
+                checks[name] = 'ok'
+
+        return all(v == 'ok' for v in checks.values()), checks
+
+    def result(self):
+        # return the last result while fresh, otherwise check again
+        with self._lock:
+            now = time.monotonic()
+            if (self._checked_at is None or
+                    now - self._checked_at >=
+                    settings.HEALTH_CHECK_CACHE_SECONDS):
+                self._result = self.run()
+                self._checked_at = now
+
+            return self._result
+
+
+readiness = Readiness()
+
+
+def _probe_response(ready, checks):
+    response = JsonResponse(
+        {'status': 'ok' if ready else 'unavailable', 'checks': checks},
+        status=200 if ready else 503,
+    )
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+class HealthCheckMiddleware:
+    # answer probes before any other middleware runs
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self._acall(request)
+        if request.path in LIVENESS_PATHS:
+            return _probe_response(True, {})
+        if request.path in READINESS_PATHS:
+            return _probe_response(*readiness.result())
+
+        return self.get_response(request)
+
+    async def _acall(self, request):
+        if request.path in LIVENESS_PATHS:
+            return _probe_response(True, {})
+        if request.path in READINESS_PATHS:
+            result = await asyncio.get_running_loop().run_in_executor(
+                PROBE_EXECUTOR, readiness.result)
+            return _probe_response(*result)
+
+        return await self.get_response(request)
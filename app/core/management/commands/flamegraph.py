@@ -0,0 +1,58 @@
+"""
+Django command to merge request profiles into a flame graph
+"""
+import time
+
+from django.core.management.base import (BaseCommand, CommandError)
+
+from core.profiling import (flame_graph_svg, load_profiles)
+
+
+class Command(BaseCommand):
+    help = 'Merge the profiles written by ProfilingMiddleware.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--route',
+            help='URL route name, e.g. recipe:recipe-list; all by default.',
+        )
+        parser.add_argument(
+            '--since', type=float,
+            help='Only profiles written in the last this many minutes.',
+        )
+        parser.add_argument(
+            '--folded', action='store_true',
+            help='Write merged collapsed stacks instead of an SVG, for '
+                 'flamegraph.pl or speedscope.',
+        )
+        parser.add_argument(
+            '--output', '-o',
+            help='File to write; standard output by default.',
+        )
+
+    def handle(self, *args, **options):
+        # entry point for command
+        since = None
+        if options['since'] is not None:
+            since = time.time() - options['since'] * 60
+        stacks = load_profiles(options['route'], since)
+        if not stacks:
+            raise CommandError('No profiles found.')
+
+        if options['folded']:
+            content = ''.join(
+                f'{stack} {count}\n'
+                for stack, count in sorted(stacks.items())
+            )
+        else:
+            content = flame_graph_svg(
+                stacks, title=options['route'] or 'All routes')
+
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(content)
+            self.stdout.write(self.style.SUCCESS(
+                f'Wrote {sum(stacks.values())} samples to '
+                f'{options["output"]}'))
+        else:
+            self.stdout.write(content, ending='')
@@ -0,0 +1,477 @@
+"""
+Django command to seed the database with benchmark data
+
+Creates users seed1@example.com, seed2@example.com, ... sharing one
+password. Recipes per user follow a power law, so a few users own most
+recipes, and tags and ingredients are picked with Zipfian popularity, so
+'Breakfast' and 'Salt' are everywhere and the tail is rare.
+
+The users are split into chunks of about CHUNK_RECIPES recipes, each with
+its own random stream and id ranges, which worker processes write in
+parallel; PostgreSQL rows are loaded with COPY. The same --seed always
+produces the same rows whatever the number of workers, so benchmark runs
+against different builds compare like with like.
+"""
+import io
+import multiprocessing
+import os
+import random
+import time
+from decimal import Decimal
+from itertools import accumulate
+
+import django
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import (BaseCommand, CommandError)
+from django.core.management.color import no_style
+from django.db import (DEFAULT_DB_ALIAS, connections, transaction)
+
+from core.models import (Ingredient, Recipe, Tag)
+from recipe.search import SEARCH_CONFIG
+
+
+SCALES = {'1k': 1_000, '100k': 100_000, '1m': 1_000_000}
+SEED_EMAIL = 'seed{}@example.com'
+RECIPES_PER_USER = 100
+TAGS_PER_USER = 20
+INGREDIENTS_PER_USER = 40
+BATCH_SIZE = 5000
+CHUNK_RECIPES = 20_000
+# shape of the recipes per user power law; 1.16 puts about 80% of the
+# recipes in the hands of 20% of the users
+RECIPES_ALPHA = 1.16
+# exponent of the Zipfian tag and ingredient popularity
+NAMES_EXPONENT = 1.1
+
+# most popular first
+TAG_NAMES = [
+    'Breakfast', 'Brunch', 'Lunch', 'Dinner', 'Dessert', 'Snack', 'Vegan',
+    'Vegetarian', 'Gluten free', 'Dairy free', 'Quick', 'Slow cooker',
+    'One pot', 'Baking', 'Grill', 'Salad', 'Soup', 'Curry', 'Pasta',
+    'Healthy', 'Comfort food', 'Spicy', 'Kids', 'Party', 'Summer',
+    'Winter', 'Budget', 'Meal prep', 'Italian', 'Mexican', 'Indian',
+    'Thai', 'French', 'Japanese', 'Greek', 'Seafood', 'Chicken', 'Beef',
+]
+INGREDIENT_NAMES = [
+    'Salt', 'Pepper', 'Olive oil', 'Butter', 'Garlic', 'Onion', 'Shallot',
+    'Tomato', 'Potato', 'Carrot', 'Celery', 'Leek', 'Spinach', 'Kale',
+    'Mushroom', 'Courgette', 'Aubergine', 'Bell pepper', 'Chilli',
+    'Ginger', 'Lemon', 'Lime', 'Basil', 'Parsley', 'Coriander', 'Thyme',
+    'Rosemary', 'Cumin', 'Paprika', 'Turmeric', 'Flour', 'Sugar', 'Egg',
+    'Milk', 'Cream', 'Yoghurt', 'Cheddar', 'Parmesan', 'Feta', 'Rice',
+    'Pasta', 'Noodles', 'Bread', 'Chickpeas', 'Lentils', 'Black beans',
+    'Tofu', 'Chicken', 'Beef', 'Pork', 'Salmon', 'Prawns', 'Coconut milk',
+    'Soy sauce', 'Honey', 'Vinegar', 'Mustard', 'Stock', 'Almonds',
+]
+TITLE_WORDS = [
+    'Roast', 'Baked', 'Grilled', 'Braised', 'Crispy', 'Creamy', 'Smoky',
+    'Spiced', 'Sticky', 'Fresh', 'Easy', 'Classic', 'Rustic', 'Zesty',
+]
+DISHES = [
+    'stew', 'soup', 'salad', 'curry', 'pie', 'tart', 'risotto', 'bake',
+    'stir fry', 'tacos', 'burger', 'traybake', 'noodles', 'pancakes',
+]
+
+
+def seed_emails(count):
+    return [SEED_EMAIL.format(n) for n in range(1, count + 1)]
+
+
+def next_id(model, using):
+    # rows are inserted with explicit ids, so their relations can be
+    # written without reading the ids back
+    last = model.objects.using(using).order_by('-id').values_list(
+        'id', flat=True).first()
+    return (last or 0) + 1
+
+
+def recipes_per_user(recipes, users, rng):
+    # split recipes over users in proportion to Pareto distributed weights
+    weights = [rng.paretovariate(RECIPES_ALPHA) for _ in range(users)]
+    total = sum(weights)
+    shares = [recipes * weight / total for weight in weights]
+    counts = [int(share) for share in shares]
+    # hand what rounding down left over to the largest remainders
+    by_remainder = sorted(range(users), key=lambda n: counts[n] - shares[n])
+    for n in by_remainder[:recipes - sum(counts)]:
+        counts[n] += 1
+    return counts
+
+
+def pick(rng, ids, cum_weights, count):
+    # return count distinct ids, popular ones more often
+    picked = set()
+    while len(picked) < count:
+        picked.add(rng.choices(ids, cum_weights=cum_weights)[0])
+    return sorted(picked)
+
+
+def copy_value(value):
+    # encode one value for COPY ... FROM STDIN in text format
+    if value is None:
+        return '\\N'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def copy_rows(connection, table, columns, rows):
+    # load tuples of database values into a table with COPY
+    data = ''.join(
+        '\t'.join(copy_value(value) for value in row) + '\n' for row in rows)
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(column) for column in columns)
+    with connection.cursor() as cursor:
+        cursor.cursor.copy_expert(
+            f'COPY {quote(table)} ({columns}) FROM STDIN',
+            io.StringIO(data),
+        )
+
+
+def insert(model, objs, using, batch_size):
+    # write instances with COPY on PostgreSQL and bulk_create elsewhere
+    if not objs:
+        return
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        model.objects.using(using).bulk_create(objs, batch_size=batch_size)
+        return
+
+    fields = model._meta.concrete_fields
+    copy_rows(connection, model._meta.db_table, [
+        field.column for field in fields
+    ], [
+        [field.get_db_prep_save(field.pre_save(obj, True), connection)
+         for field in fields]
+        for obj in objs
+    ])
+
+
+def insert_links(field, rows, using):
+    # write (recipe id, related id) pairs of a many to many field without
+    # building an instance per row, there are several per recipe
+    if not rows:
+        return
+    connection = connections[using]
+    through = field.remote_field.through
+    table = through._meta.db_table
+    columns = [
+        through._meta.get_field(field.m2m_field_name()).column,
+        through._meta.get_field(field.m2m_reverse_field_name()).column,
+    ]
+    if connection.vendor == 'postgresql':
+        copy_rows(connection, table, columns, rows)
+        return
+
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT INTO {quote(table)} ({quote(columns[0])}, '
+            f'{quote(columns[1])}) VALUES (%s, %s)',
+            rows,
+        )
+
+
+def index_search_vectors(recipes, names, using):
+    # fill search_vector the way recipe.search.search_fields does, with
+    # the tag and ingredient names known without reading them back
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return
+    table = connection.ops.quote_name(Recipe._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            UPDATE {table} AS recipe SET search_vector =
+                setweight(to_tsvector(%s::regconfig, recipe.title), 'A') ||
+                setweight(to_tsvector(%s::regconfig, names.names), 'B') ||
+                setweight(
+                    to_tsvector(%s::regconfig, recipe.description), 'C')
+            FROM unnest(%s::bigint[], %s::text[]) AS names (id, names)
+            WHERE recipe.id = names.id
+            """,
+            [SEARCH_CONFIG] * 3 + [[recipe.id for recipe in recipes], names],
+        )
+
+
+class ChunkWriter:
+    # generate and write the data of one chunk of users
+
+    def __init__(self, task):
+        self.chunk = task['chunk']
+        self.users = task['users']
+        self.ids = dict(task['ids'])
+        self.batch_size = task['batch_size']
+        self.using = task['using']
+        # every chunk has its own stream, so the data does not depend on
+        # which worker writes which chunk
+        self.rng = random.Random(f'{task["seed"]}-{self.chunk}')
+        self.rows = {Tag: [], Ingredient: [], Recipe: []}
+
+    def run(self):
+        written = 0
+        for user_id, count in self.users:
+            tags = self._names(Tag, user_id, TAG_NAMES, TAGS_PER_USER)
+            ingredients = self._names(
+                Ingredient, user_id, INGREDIENT_NAMES, INGREDIENTS_PER_USER)
+            for _ in range(count):
+                self.rows[Recipe].append(
+                    self._recipe(user_id, tags, ingredients))
+                if len(self.rows[Recipe]) >= self.batch_size:
+                    written += self._write()
+        written += self._write()
+
+        return written
+
+    def _names(self, model, user_id, names, count):
+        # queue a user's tags or ingredients and return their names by id
+        # with cumulative weights for picking them
+        ranks = sorted(self.rng.sample(range(len(names)), count))
+        rows = []
+        for rank in ranks:
+            rows.append(model(
+                id=self.ids[model], user_id=user_id, name=names[rank]))
+            self.ids[model] += 1
+        self.rows[model].extend(rows)
+
+        # weights follow the global rank of each name, not its position
+        # in the user's list, so popular names are popular everywhere
+        weights = list(accumulate(
+            1 / (rank + 1) ** NAMES_EXPONENT for rank in ranks))
+        return {row.id: row.name for row in rows}, weights
+
+    def _recipe(self, user_id, tags, ingredients):
+        rng = self.rng
+        title = f'{rng.choice(TITLE_WORDS)} {rng.choice(DISHES)}'
+        recipe = Recipe(
+            id=self.ids[Recipe],
+            user_id=user_id,
+            title=title,
+            description=f'{title} seeded for benchmarks.',
+            time_minutes=rng.randint(5, 180),
+            price=Decimal(rng.randint(100, 5000)) / 100,
+        )
+        self.ids[Recipe] += 1
+        tag_names, tag_weights = tags
+        ingredient_names, ingredient_weights = ingredients
+        tag_ids = pick(rng, list(tag_names), tag_weights, rng.randint(1, 3))
+        ingredient_ids = pick(
+            rng, list(ingredient_names), ingredient_weights,
+            rng.randint(3, 8))
+        # the same document recipe.search.search_fields stores
+        names = ' '.join(
+            [tag_names[tag_id] for tag_id in tag_ids] +
+            [ingredient_names[ingredient_id]
+             for ingredient_id in ingredient_ids]
+        )
+        recipe.search_document = ' '.join(
+            [recipe.title, names, recipe.description]).lower()
+
+        return recipe, tag_ids, ingredient_ids, names
+
+    def _write(self):
+        # insert the queued rows in one transaction
+        pending = self.rows[Recipe]
+        recipes = [recipe for recipe, _, _, _ in pending]
+        connection = connections[self.using]
+        with transaction.atomic(using=self.using):
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    # a crash can lose the last batches, never consistency
+                    cursor.execute('SET LOCAL synchronous_commit TO OFF')
+            for model in (Tag, Ingredient):
+                insert(model, self.rows[model], self.using, self.batch_size)
+            insert(Recipe, recipes, self.using, self.batch_size)
+            insert_links(Recipe.tags.field, [
+                (recipe.id, tag_id)
+                for recipe, tag_ids, _, _ in pending for tag_id in tag_ids
+            ], self.using)
+            insert_links(Recipe.ingredients.field, [
+                (recipe.id, ingredient_id)
+                for recipe, _, ingredient_ids, _ in pending
+                for ingredient_id in ingredient_ids
+            ], self.using)
+            index_search_vectors(
+                recipes, [names for _, _, _, names in pending], self.using)
+
+        self.rows = {model: [] for model in self.rows}
+        return len(recipes)
+
+
+def write_chunk(task):
+    # worker process entry point
+    return ChunkWriter(task).run()
+
+
+def setup_worker():
+    # spawned workers start without Django; forked ones share the parent's
+    # setup but must not reuse its connections
+    if not django.apps.apps.ready:
+        django.setup()
+    connections.close_all()
+
+
+class Seeder:
+    # plan the data from one random seed and write it in chunks
+
+    def __init__(self, recipes, users, seed=0, password='benchmark',
+                 batch_size=BATCH_SIZE, workers=1, using=DEFAULT_DB_ALIAS):
+        self.recipes = recipes
+        self.users = users
+        self.seed = seed
+        self.password = make_password(password)
+        self.batch_size = batch_size
+        self.workers = workers
+        self.using = using
+
+    def run(self, progress=None):
+        counts = recipes_per_user(
+            self.recipes, self.users, random.Random(self.seed))
+        tasks = self._tasks(list(zip(self._users(), counts)))
+
+        written = 0
+        if self.workers > 1:
+            # workers open their own connections
+            connections.close_all()
+            with multiprocessing.Pool(
+                    self.workers, initializer=setup_worker) as pool:
+                for count in pool.imap_unordered(write_chunk, tasks):
+                    written += count
+                    if progress is not None:
+                        progress(written)
+        else:
+            for task in tasks:
+                written += write_chunk(task)
+                if progress is not None:
+                    progress(written)
+        self._reset_sequences()
+
+        return written
+
+    def _users(self):
+        User = get_user_model()
+        first = next_id(User, self.using)
+        users = [
+            User(id=first + n, email=email, name=f'Seed user {n + 1}',
+                 password=self.password)
+            for n, email in enumerate(seed_emails(self.users))
+        ]
+        User.objects.using(self.using).bulk_create(
+            users, batch_size=self.batch_size)
+
+        return [user.id for user in users]
+
+    def _tasks(self, users):
+        # split users into chunks of about CHUNK_RECIPES recipes, each
+        # starting its ids where the previous chunk's end
+        ids = {
+            model: next_id(model, self.using)
+            for model in (Tag, Ingredient, Recipe)
+        }
+        tasks = []
+
+        def add(chunk):
+            tasks.append({
+                'seed': self.seed,
+                'chunk': len(tasks),
+                'users': chunk,
+                'ids': list(ids.items()),
+                'batch_size': self.batch_size,
+                'using': self.using,
+            })
+            ids[Tag] += len(chunk) * TAGS_PER_USER
+            ids[Ingredient] += len(chunk) * INGREDIENTS_PER_USER
+            ids[Recipe] += sum(count for _, count in chunk)
+
+        chunk, size = [], 0
+        for user_id, count in users:
+            if chunk and size + count > CHUNK_RECIPES:
+                add(chunk)
+                chunk, size = [], 0
+            chunk.append((user_id, count))
+            size += count
+        if chunk:
+            add(chunk)
+
+        return tasks
+
+    def _reset_sequences(self):
+        # move id sequences past the explicit ids
+        connection = connections[self.using]
+        models = [get_user_model(), Tag, Ingredient, Recipe]
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), models):
+                cursor.execute(sql)
+
+
+class Command(BaseCommand):
+    help = 'Seed the database with users and recipes for benchmarks.'
+
+    def add_arguments(self, parser):
+        size = parser.add_mutually_exclusive_group(required=True)
+        size.add_argument(
+            '--scale', choices=sorted(SCALES),
+            help='Number of recipes to create.',
+        )
+        size.add_argument('--recipes', type=int)
+        parser.add_argument(
+            '--users', type=int, default=None,
+            help=f'Users to spread recipes over, by default one per '
+                 f'{RECIPES_PER_USER} recipes.',
+        )
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Random seed; the same seed creates the same data.',
+        )
+        parser.add_argument(
+            '--password', default='benchmark',
+            help='Password of every seeded user.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=BATCH_SIZE,
+            help='Recipes written per transaction.',
+        )
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='Processes writing in parallel, on PostgreSQL only.',
+        )
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        # entry point for command
+        recipes = options['recipes']
+        if options['scale']:
+            recipes = SCALES[options['scale']]
+        users = options['users'] or max(1, recipes // RECIPES_PER_USER)
+        if recipes < 0 or users < 1:
+            raise CommandError('Recipes and users must be positive.')
+
+        using = options['database']
+        if get_user_model().objects.using(using).filter(
+                email__in=seed_emails(1)).exists():
+            raise CommandError(
+                'The database is already seeded, run flush first.')
+
+        workers = max(1, options['workers'] or 1)
+        if connections[using].vendor != 'postgresql':
+            # other databases lock out concurrent writers
+            workers = 1
+
+        seeder = Seeder(
+            recipes, users,
+            seed=options['seed'],
+            password=options['password'],
+            batch_size=options['batch_size'],
+            workers=workers,
+            using=using,
+        )
+        start = time.monotonic()
+
+        def progress(written):
+            self.stdout.write(f'{written}/{recipes} recipes')
+
+        written = seeder.run(progress=progress)
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {users} users and {written} recipes in '
+            f'{time.monotonic() - start:.1f}s with {workers} workers'
+        ))
@@ -1,22 +1,53 @@
 """
 Django command to wait for the database to be ready
 """
+import random
 import time
 from psycopg2 import OperationalError as Psycopg2Error
 from django.db.utils import OperationalError
-from django.core.management.base import BaseCommand
+from django.core.management.base import (BaseCommand, CommandError)
 
 
 class Command(BaseCommand):
+    help = 'Wait for the database, backing off exponentially with jitter.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--timeout', type=float, default=60,
+            help='Seconds to wait in total before failing.',
+        )
+        parser.add_argument(
+            '--initial-delay', type=float, default=0.5,
+            help='Upper bound of the first wait, in seconds.',
+        )
+        parser.add_argument(
+            '--max-delay', type=float, default=10,
+            help='Upper bound of any single wait, in seconds.',
+        )
+
     def handle(self, *args, **options):
         # entry point for command
         self.stdout.write('Waiting for database...')
-        db_up = False
-        while db_up is False:
+        deadline = time.monotonic() + options['timeout']
+        attempt = 0
+        while True:
             try:
                 self.check(databases=['default'])
-                db_up = True
+                break
             except (Psycopg2Error, OperationalError):
-                self.stdout.write('Database unavailable, waiting 1 second...')
-                time.sleep(1)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise CommandError(
+                        f'Database unavailable after {options["timeout"]}s')
+                # full jitter keeps restarting containers from retrying
+                # in lockstep
+                cap = min(
+                    options['max_delay'],
+                    options['initial_delay'] * 2 ** attempt,
+                )
+                delay = min(random.uniform(0, cap), remaining)
+                self.stdout.write(
+                    f'Database unavailable, waiting {delay:.1f} seconds...')
+                time.sleep(delay)
+                attempt += 1
         self.stdout.write(self.style.SUCCESS('Database available!!'))
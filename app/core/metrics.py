@@ -0,0 +1,200 @@
+"""
+Prometheus metrics per URL route
+
+MetricsMiddleware records, per route name, method and status code, the
+request latency, response size and the number and total time of database
+queries; core.query_budget counts the requests over their view's query
+budget. GET /metrics returns them in the Prometheus text format.
+
+Forked server workers each write their samples to memory mapped files in
+PROMETHEUS_MULTIPROC_DIR, which /metrics sums over; scripts/run.sh sets
+it up. Without it, each process reports only its own samples.
+"""
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import (iscoroutinefunction, markcoroutinefunction)
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+
+METRICS_PATHS = ('/metrics', '/metrics/')
+# route label of requests no URL pattern matched, so scans of random
+# paths cannot add label values without bound
+UNMATCHED_ROUTE = '<unmatched>'
+LABELS = ('route', 'method', 'status')
+# statements kept per request for core.query_budget to fingerprint
+MAX_STATEMENTS = 200
+
+REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds',
+    'Time spent handling a request.',
+    LABELS,
+)
+RESPONSE_BYTES = Histogram(
+    'http_response_size_bytes',
+    'Size of response bodies, streamed responses excluded.',
+    LABELS,
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304),
+)
+DB_QUERIES = Histogram(
+    'http_db_queries',
+    'Database queries run by a request.',
+    LABELS,
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200),
+)
+DB_SECONDS = Histogram(
+    'http_db_query_duration_seconds',
+    'Time a request spent in database queries.',
+    LABELS,
+)
+QUERY_BUDGET_EXCEEDED = Counter(
+    'http_query_budget_exceeded',
+    'Requests that ran more queries than their view allows.',
+    ('route', 'action'),
+)
+
+# query totals of the request being handled, shared with the threads a
+# request runs its view on through context copies
+_request_queries = ContextVar('request_queries', default=None)
+
+
+class QueryStats:
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = []
+
+
+def count_queries(execute, sql, params, many, context):
+    # execute wrapper adding each query to the current request's totals
+    stats = _request_queries.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.count += 1
+        stats.seconds += time.perf_counter() - start
+        if len(stats.statements) < MAX_STATEMENTS:
+            stats.statements.append(sql)
+
+
+@contextmanager
+def query_stats():
+    # yield the query totals of the current request, counting from here
+    # when no MetricsMiddleware counts them already
+    stats = _request_queries.get()
+    if stats is not None:
+        yield stats
+        return
+
+    stats = QueryStats()
+    token = _request_queries.set(stats)
+    try:
+        yield stats
+    finally:
+        _request_queries.reset(token)
+
+
+@receiver(connection_created)
+def install_query_counter(sender, connection, **kwargs):
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+
+def route_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return UNMATCHED_ROUTE
+
+    return match.view_name
+
+
+def observe(route, method, status, seconds, size, queries):
+    labels = (route, method, str(status))
+    REQUEST_SECONDS.labels(*labels).observe(seconds)
+    if size is not None:
+        RESPONSE_BYTES.labels(*labels).observe(size)
+    DB_QUERIES.labels(*labels).observe(queries.count)
+    DB_SECONDS.labels(*labels).observe(queries.seconds)
+
+
+def render():
+    # return the exposition text of every process's samples
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+
+    return generate_latest(registry)
+
+
+class MetricsMiddleware:
+    # time every request and answer /metrics; under ASGI it stays on the
+    # event loop and times the awaited response
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self._acall(request)
+        if request.path in METRICS_PATHS:
+            return HttpResponse(render(), content_type=CONTENT_TYPE_LATEST)
+
+        queries = QueryStats()
+        token = _request_queries.set(queries)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_queries.reset(token)
+
+        return self._observe(request, response, start, queries)
+
+    async def _acall(self, request):
+        if request.path in METRICS_PATHS:
+            return HttpResponse(render(), content_type=CONTENT_TYPE_LATEST)
+
+        # views on pool threads run in copies of this context, so they add
+        # to the same totals
+        queries = QueryStats()
+        token = _request_queries.set(queries)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_queries.reset(token)
+
+        return self._observe(request, response, start, queries)
+
+    def _observe(self, request, response, start, queries):
+        seconds = time.perf_counter() - start
+        size = None if response.streaming else len(response.content)
+        observe(
+            route_name(request), request.method, response.status_code,
+            seconds, size, queries,
+        )
+        return response
@@ -0,0 +1,53 @@
+# Generated by Django 3.2.15 on 2026-10-18 09:00
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def merge_duplicates(apps, model_name, field_name):
+    # point recipes at the oldest row of each (user, name) and drop the rest
+    model = apps.get_model('core', model_name)
+    Recipe = apps.get_model('core', 'Recipe')
+    through = getattr(Recipe, field_name).through
+    fk_name = f'{model_name.lower()}_id'
+
+    duplicates = (
+        model.objects.values('user', 'name')
+        .annotate(keep_id=Min('id'), total=Count('id'))
+        .filter(total__gt=1)
+    )
+    for duplicate in duplicates:
+        dup_ids = list(
+            model.objects.filter(
+                user=duplicate['user'],
+                name=duplicate['name'],
+            ).exclude(id=duplicate['keep_id']).values_list('id', flat=True)
+        )
+        recipe_ids = set(
+            through.objects.filter(**{f'{fk_name}__in': dup_ids})
+            .values_list('recipe_id', flat=True)
+        )
+        through.objects.bulk_create(
+            [
+                through(recipe_id=recipe_id, **{fk_name: duplicate['keep_id']})
+                for recipe_id in recipe_ids
+            ],
+            ignore_conflicts=True,
+        )
+        model.objects.filter(id__in=dup_ids).delete()
+
+
+def merge_duplicate_names(apps, schema_editor):
+    merge_duplicates(apps, 'Tag', 'tags')
+    merge_duplicates(apps, 'Ingredient', 'ingredients')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_recipe_image'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_names, migrations.RunPython.noop),
+    ]
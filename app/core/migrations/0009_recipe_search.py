@@ -0,0 +1,81 @@
+# Generated by Django 3.2.15 on 2026-10-18 10:00
+
+import django.contrib.postgres.search
+from django.db import migrations, models
+
+
+POSTGRES_BACKFILL = """
+WITH names AS (
+    SELECT r.id,
+        concat_ws(' ',
+            (SELECT string_agg(t.name, ' ') FROM core_tag t
+             JOIN core_recipe_tags rt ON rt.tag_id = t.id
+             WHERE rt.recipe_id = r.id),
+            (SELECT string_agg(i.name, ' ') FROM core_ingredient i
+             JOIN core_recipe_ingredients ri ON ri.ingredient_id = i.id
+             WHERE ri.recipe_id = r.id)
+        ) AS names
+    FROM core_recipe r
+)
+UPDATE core_recipe r SET
+    search_document = lower(concat_ws(' ', r.title, n.names, r.description)),
+    search_vector =
+        setweight(to_tsvector('english', r.title), 'A') ||
+        setweight(to_tsvector('english', n.names), 'B') ||
+        setweight(to_tsvector('english', r.description), 'C')
+FROM names n
+WHERE n.id = r.id
+"""
+
+
+def backfill_search(apps, schema_editor):
+    # fill the search columns for recipes that already exist
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(POSTGRES_BACKFILL)
+        return
+
+    Recipe = apps.get_model('core', 'Recipe')
+    recipes = Recipe.objects.prefetch_related('tags', 'ingredients')
+    for recipe in recipes.iterator(chunk_size=500):
+        names = [tag.name for tag in recipe.tags.all()]
+        names += [ingredient.name for ingredient in recipe.ingredients.all()]
+        recipe.search_document = ' '.join(
+            [recipe.title] + names + [recipe.description]).lower()
+        recipe.save(update_fields=['search_document'])
+
+
+def create_search_index(apps, schema_editor):
+    # GIN indexes only exist on PostgreSQL
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS core_recipe_search_vector_gin '
+            'ON core_recipe USING gin (search_vector)'
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            'DROP INDEX IF EXISTS core_recipe_search_vector_gin')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_unique_tag_ingredient_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_document',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_search, migrations.RunPython.noop),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:02
+
+from django.db import migrations, models
+
+
+def queue_existing_images(apps, schema_editor):
+    # recipes uploaded before the pipeline existed still need derivatives
+    Recipe = apps.get_model('core', 'Recipe')
+    Recipe.objects.exclude(image='').exclude(image__isnull=True).update(
+        image_status='pending')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_change_tracking'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_derivatives',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='image_status',
+            field=models.CharField(
+                choices=[
+                    ('none', 'None'),
+                    ('pending', 'Pending'),
+                    ('processing', 'Processing'),
+                    ('ready', 'Ready'),
+                    ('failed', 'Failed'),
+                ],
+                default='none',
+                editable=False,
+                max_length=10,
+            ),
+        ),
+        migrations.RunPython(
+            queue_existing_images, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(
+                condition=models.Q(
+                    ('image_status__in', ['pending', 'processing'])),
+                fields=['image_status'],
+                name='core_recipe_image_queue',
+            ),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:08
+
+import core.models
+import core.storage
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_image_references(apps, schema_editor):
+    # start the reference counts from the images recipes already use
+    Recipe = apps.get_model('core', 'Recipe')
+    ImageBlob = apps.get_model('core', 'ImageBlob')
+    counts = (
+        Recipe.objects.exclude(image='').exclude(image__isnull=True)
+        .values('image').annotate(references=Count('id'))
+    )
+    ImageBlob.objects.bulk_create(
+        [
+            ImageBlob(name=row['image'], references=row['references'])
+            for row in counts.iterator()
+        ],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_recipe_image_processing'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageBlob',
+            fields=[
+                ('id', models.BigAutoField(
+                    auto_created=True,
+                    primary_key=True,
+                    serialize=False,
+                    verbose_name='ID',
+                )),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('references', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(
+                null=True,
+                storage=core.storage.RecipeImageStorage(),
+                upload_to=core.models.recipe_image_file_path,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='imageblob',
+            index=models.Index(
+                condition=models.Q(('references', 0)),
+                fields=['updated_at'],
+                name='core_imageblob_unreferenced',
+            ),
+        ),
+        migrations.RunPython(
+            count_image_references, migrations.RunPython.noop),
+    ]
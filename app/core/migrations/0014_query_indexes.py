@@ -0,0 +1,38 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:16
+
+from django.db import migrations, models
+
+from core.operations import (
+    AddIndexConcurrently,
+    AddThroughIndexConcurrently,
+)
+
+
+class Migration(migrations.Migration):
+    # indexes are built without blocking writes, which can not happen
+    # inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('core', '0013_image_blobs'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='recipe',
+            index=models.Index(
+                fields=['user', 'id'], name='core_recipe_user_id'),
+        ),
+        # assigned_only and tag filters look links up from the tag or
+        # ingredient side and only need the recipe id back
+        AddThroughIndexConcurrently(
+            table='core_recipe_tags',
+            columns=['tag_id', 'recipe_id'],
+            name='core_recipe_tags_tag_recipe',
+        ),
+        AddThroughIndexConcurrently(
+            table='core_recipe_ingredients',
+            columns=['ingredient_id', 'recipe_id'],
+            name='core_recipe_ingredients_ingredient_recipe',
+        ),
+    ]
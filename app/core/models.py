@@ -6,13 +6,18 @@ import uuid
 import os
 
 from django.conf import settings
-from django.db import models
+from django.contrib.postgres.search import SearchVectorField
+from django.db import (models, transaction)
+from django.db.models import F
+from django.utils import timezone
 from django.contrib.auth.models import (
     AbstractBaseUser,
     BaseUserManager,
     PermissionsMixin
 )
 
+from core.storage import recipe_image_storage
+
 
 def recipe_image_file_path(instance, filename):
     # generate file path for new recipe image
@@ -50,6 +55,9 @@ class User(AbstractBaseUser, PermissionsMixin):
     name = models.CharField(max_length=255)
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
+    # bumped on every write to the user's recipes, tags and ingredients
+    data_version = models.PositiveBigIntegerField(default=0, editable=False)
+    data_updated_at = models.DateTimeField(null=True, editable=False)
 
     objects = UserManager()
 
@@ -58,6 +66,15 @@ class User(AbstractBaseUser, PermissionsMixin):
 
 class Recipe(models.Model):
     # recipe object
+
+    class ImageStatus(models.TextChoices):
+        # where an uploaded image is in the processing pipeline
+        NONE = 'none'
+        PENDING = 'pending'
+        PROCESSING = 'processing'
+        READY = 'ready'
+        FAILED = 'failed'
+
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     title = models.CharField(max_length=255)
     description = models.TextField(blank=True)
@@ -66,7 +83,39 @@ class Recipe(models.Model):
     link = models.CharField(max_length=255, blank=True)
     tags = models.ManyToManyField('Tag')
     ingredients = models.ManyToManyField('Ingredient')
-    image = models.ImageField(null=True, upload_to=recipe_image_file_path)
+    image = models.ImageField(
+        null=True,
+        upload_to=recipe_image_file_path,
+        storage=recipe_image_storage,
+    )
+    # filled in by the process_images command, see recipe.images
+    image_status = models.CharField(
+        max_length=10,
+        choices=ImageStatus.choices,
+        default=ImageStatus.NONE,
+        editable=False,
+    )
+    image_derivatives = models.JSONField(
+        default=dict, blank=True, editable=False)
+    # lowercased title, tag and ingredient names and description, kept in
+    # sync by recipe.search; search_vector is only filled on PostgreSQL,
+    # where migration 0009 adds a GIN index on it
+    search_document = models.TextField(blank=True, editable=False)
+    search_vector = SearchVectorField(null=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # serves the recipe list, filter(user=...).order_by('-id'),
+            # without a sort
+            models.Index(fields=['user', 'id'], name='core_recipe_user_id'),
+            # keeps polling for queued images cheap
+            models.Index(
+                fields=['image_status'],
+                name='core_recipe_image_queue',
+                condition=models.Q(image_status__in=['pending', 'processing']),
+            ),
+        ]
 
     def __str__(self):
         return self.title
@@ -76,6 +125,15 @@ class Tag(models.Model):
     # tag model
     name = models.CharField(max_length=255)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'name'],
+                name='unique_tag_user_name',
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -87,6 +145,61 @@ class Ingredient(models.Model):
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
     )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'name'],
+                name='unique_ingredient_user_name',
+            ),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+class ImageBlobManager(models.Manager):
+    # manager keeping recipe image reference counts
+
+    def retain(self, name):
+        # count one more recipe using a stored image; the row stays locked
+        # until the caller's transaction ends, so gc_images either sees the
+        # count or has already deleted the row and its file
+        with transaction.atomic(using=self.db, savepoint=False):
+            blob, created = self.select_for_update().get_or_create(
+                name=name, defaults={'references': 1})
+            if not created:
+                self.filter(pk=blob.pk).update(
+                    references=F('references') + 1,
+                    updated_at=timezone.now(),
+                )
+
+    def release(self, name):
+        # count one less recipe using a stored image
+        self.filter(name=name, references__gt=0).update(
+            references=F('references') - 1,
+            updated_at=timezone.now(),
+        )
+
+
+class ImageBlob(models.Model):
+    # a stored recipe image and how many recipes use it; blobs left with no
+    # references are removed by the gc_images command
+    name = models.CharField(max_length=255, unique=True)
+    references = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = ImageBlobManager()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['updated_at'],
+                name='core_imageblob_unreferenced',
+                condition=models.Q(references=0),
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -0,0 +1,100 @@
+"""
+Migration operations shared by the core migrations
+"""
+from django.contrib.postgres import operations
+from django.db.migrations import AddIndex
+from django.db.migrations.operations.base import Operation
+
+
+class AddIndexConcurrently(operations.AddIndexConcurrently):
+    # CREATE INDEX CONCURRENTLY on PostgreSQL, a plain AddIndex elsewhere so
+    # the SQLite test database can still migrate
+
+    def database_forwards(self, app_label, schema_editor, from_state,
+                          to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            return super().database_forwards(
+                app_label, schema_editor, from_state, to_state)
+
+        return AddIndex.database_forwards(
+            self, app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state,
+                           to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            return super().database_backwards(
+                app_label, schema_editor, from_state, to_state)
+
+        return AddIndex.database_backwards(
+            self, app_label, schema_editor, from_state, to_state)
+
+
+class AddThroughIndexConcurrently(operations.NotInTransactionMixin,
+                                  Operation):
+    # index an auto-created many to many table, which has no model Meta to
+    # declare it on; the index is not tracked in the migration state
+    reduces_to_sql = False
+    reversible = True
+    atomic = False
+
+    def __init__(self, table, columns, name):
+        self.table = table
+        self.columns = columns
+        self.name = name
+
+    def deconstruct(self):
+        return (
+            self.__class__.__name__,
+            [],
+            {'table': self.table, 'columns': self.columns, 'name': self.name},
+        )
+
+    def state_forwards(self, app_label, state):
+        pass
+
+    def describe(self):
+        return (
+            f'Concurrently create index {self.name} on '
+            f'{self.table} ({", ".join(self.columns)})'
+        )
+
+    def _drop_invalid(self, schema_editor):
+        # a failed concurrent build leaves an invalid index behind
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT NOT i.indisvalid FROM pg_index i '
+                'JOIN pg_class c ON c.oid = i.indexrelid '
+                'WHERE c.relname = %s',
+                [self.name],
+            )
+            row = cursor.fetchone()
+        if row and row[0]:
+            schema_editor.execute(
+                'DROP INDEX CONCURRENTLY '
+                f'{schema_editor.quote_name(self.name)}'
+            )
+
+    def database_forwards(self, app_label, schema_editor, from_state,
+                          to_state):
+        quote = schema_editor.quote_name
+        columns = ', '.join(quote(column) for column in self.columns)
+        concurrently = ''
+        if schema_editor.connection.vendor == 'postgresql':
+            self._ensure_not_in_transaction(schema_editor)
+            self._drop_invalid(schema_editor)
+            concurrently = 'CONCURRENTLY '
+        schema_editor.execute(
+            f'CREATE INDEX {concurrently}IF NOT EXISTS {quote(self.name)} '
+            f'ON {quote(self.table)} ({columns})'
+        )
+
+    def database_backwards(self, app_label, schema_editor, from_state,
+                           to_state):
+        concurrently = ''
+        if schema_editor.connection.vendor == 'postgresql':
+            self._ensure_not_in_transaction(schema_editor)
+            concurrently = 'CONCURRENTLY '
+        schema_editor.execute(
+            f'DROP INDEX {concurrently}IF EXISTS '
+            f'{schema_editor.quote_name(self.name)}'
+        )
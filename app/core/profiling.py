@@ -0,0 +1,319 @@
+"""
+Sampling profiler for individual requests
+
+With PROFILING on, ProfilingMiddleware profiles a PROFILE_SAMPLE_RATE
+fraction of requests, plus any request from a staff user that carries the
+X-Profile header. A helper thread samples the stack of the thread handling
+the request every PROFILE_INTERVAL seconds; the request itself runs
+untraced. Samples are written in collapsed stack format to
+PROFILE_DIR/<route>/, keeping the newest PROFILE_RING_SIZE files per
+route, and `manage.py flamegraph` merges them into a flame graph.
+
+Under WSGI the thread that runs the middleware is sampled. Under ASGI the
+middleware stays on the event loop, and the pool threads that
+app.async_views runs the request's view on are sampled instead. The body
+of streamed responses is not seen either way.
+"""
+import collections
+import hashlib
+import os
+import random
+import sys
+import threading
+import time
+from contextvars import ContextVar
+from xml.sax.saxutils import escape
+
+from asgiref.sync import (
+    iscoroutinefunction,
+    markcoroutinefunction,
+    sync_to_async,
+)
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from rest_framework.exceptions import AuthenticationFailed
+
+from core.metrics import route_name
+from user.authentication import CachedTokenAuthentication
+
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+PROFILE_SUFFIX = '.folded'
+
+_short_names = {}
+# sampler of the request being profiled, seen by the threads it runs on
+_sampler = ContextVar('profile_sampler', default=None)
+
+
+def _frame_name(code):
+    # "function (path/to/file.py:line)", with the path made relative
+    filename = _short_names.get(code.co_filename)
+    if filename is None:
+        filename = code.co_filename
+        for root in sorted(
+            (str(settings.BASE_DIR), *sys.path), key=len, reverse=True
+        ):
+            if root and filename.startswith(root + os.sep):
+                filename = filename[len(root) + 1:]
+                break
+        _short_names[code.co_filename] = filename
+    name = f'{code.co_name} ({filename}:{code.co_firstlineno})'
+    return name.replace(';', ':')
+
+
+def collapse(frame):
+    # return a frame's stack, outermost first, joined by semicolons
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame.f_code))
+        frame = frame.f_back
+
+    return ';'.join(reversed(names))
+
+
+class StackSampler:
+    # count the stacks of some threads, sampled from a helper thread
+
+    def __init__(self, thread_id, interval):
+        self.thread_ids = set() if thread_id is None else {thread_id}
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name='profile-sampler', daemon=True)
+
+    def add_thread(self, thread_id):
+        self.thread_ids.add(thread_id)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id in list(self.thread_ids):
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    self.stacks[collapse(frame)] += 1
+            # frames keep the sampled threads' locals alive
+            frames = frame = None
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        # stop sampling and return {stack: samples}
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+
+def sample_current_thread():
+    # called by threads running a view for the request being profiled
+    sampler = _sampler.get()
+    if sampler is not None:
+        sampler.add_thread(threading.get_ident())
+
+
+def route_dir(route):
+    return os.path.join(settings.PROFILE_DIR, route.replace(':', '.'))
+
+
+def write_profile(route, stacks):
+    # write one profile and drop the oldest beyond the ring size
+    directory = route_dir(route)
+    os.makedirs(directory, exist_ok=True)
+    name = f'{time.time_ns()}-{os.getpid()}{PROFILE_SUFFIX}'
+    path = os.path.join(directory, name)
+    with open(f'{path}.tmp', 'w') as file:
+        for stack, count in stacks.items():
+            file.write(f'{stack} {count}\n')
+    os.replace(f'{path}.tmp', path)
+
+    profiles = sorted(
+        entry for entry in os.listdir(directory)
+        if entry.endswith(PROFILE_SUFFIX)
+    )
+    for old in profiles[:-settings.PROFILE_RING_SIZE]:
+        try:
+            os.remove(os.path.join(directory, old))
+        except FileNotFoundError:
+            # another worker trimmed it first
+            pass
+
+    return path
+
+
+def load_profiles(route=None, since=None):
+    # merge the profiles of one route, or of all, into {stack: samples}
+    stacks = collections.Counter()
+    if not os.path.isdir(settings.PROFILE_DIR):
+        return stacks
+    if route is None:
+        directories = [
+            os.path.join(settings.PROFILE_DIR, entry)
+            for entry in os.listdir(settings.PROFILE_DIR)
+        ]
+    else:
+        directories = [route_dir(route)]
+
+    for directory in directories:
+        if not os.path.isdir(directory):
+            continue
+        for entry in os.listdir(directory):
+            path = os.path.join(directory, entry)
+            if not entry.endswith(PROFILE_SUFFIX):
+                continue
+            if since is not None and os.path.getmtime(path) < since:
+                continue
+            with open(path) as file:
+                for line in file:
+                    stack, _, count = line.rstrip('\n').rpartition(' ')
+                    if stack and count.isdigit():
+                        stacks[stack] += int(count)
+
+    return stacks
+
+
+FLAME_WIDTH = 1200
+FLAME_ROW = 16
+# frames narrower than this many pixels are left out
+FLAME_MIN_WIDTH = 0.5
+
+
+def _flame_color(name):
+    # stable warm colour per function
+    digest = hashlib.md5(name.encode()).digest()
+    return f'rgb({205 + digest[0] % 50},{digest[1] % 180},{digest[2] % 50})'
+
+
+def flame_graph_svg(stacks, title='Flame graph'):
+    # render {stack: samples} as an SVG flame graph, callers at the bottom
+    root = {'children': {}, 'value': 0}
+    for stack, count in stacks.items():
+        root['value'] += count
+        node = root
+        for name in stack.split(';'):
+            node = node['children'].setdefault(
+                name, {'children': {}, 'value': 0})
+            node['value'] += count
+
+    total = root['value'] or 1
+    scale = FLAME_WIDTH / total
+    rects = []
+    depth = 0
+    # (name, node, x offset, level) of the frames still to lay out
+    pending = [('all', root, 0.0, 0)]
+    while pending:
+        name, node, x, level = pending.pop()
+        width = node['value'] * scale
+        if width < FLAME_MIN_WIDTH:
+            continue
+        depth = max(depth, level)
+        rects.append((name, node['value'], x, level, width))
+        child_x = x
+        for child_name, child in sorted(node['children'].items()):
+            pending.append((child_name, child, child_x, level + 1))
+            child_x += child['value'] * scale
+
+    height = (depth + 1) * FLAME_ROW + 2 * FLAME_ROW
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{FLAME_WIDTH}" '
+        f'height="{height}" font-family="monospace" font-size="11">',
+        f'<text x="4" y="{FLAME_ROW - 4}">{escape(title)} '
+        f'({root["value"]} samples)</text>',
+    ]
+    for name, value, x, level, width in rects:
+        y = height - (level + 1) * FLAME_ROW
+        label = escape(name)
+        parts.append(
+            f'<g><title>{label} ({value} samples, '
+            f'{value * 100 / total:.1f}%)</title>'
+            f'<rect x="{x:.1f}" y="{y}" width="{width:.1f}" '
+            f'height="{FLAME_ROW - 1}" fill="{_flame_color(name)}"/>'
+        )
+        # about 7 pixels per character at this font size
+        chars = int(width / 7)
+        if chars > 3:
+            text = name if len(name) <= chars else name[:chars - 2] + '..'
+            parts.append(
+                f'<text x="{x + 2:.1f}" y="{y + FLAME_ROW - 4}">'
+                f'{escape(text)}</text>')
+        parts.append('</g>')
+    parts.append('</svg>')
+
+    return '\n'.join(parts) + '\n'
+
+
+def is_staff(request):
+    # check the session user, else the API token, without a DRF view
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user.is_staff
+    try:
+        result = CachedTokenAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return False
+
+    return result is not None and result[0].is_staff
+
+
+class ProfilingMiddleware:
+    # profile sampled requests, unused unless PROFILING is on
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PROFILING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def _sampled(self):
+        return random.random() < settings.PROFILE_SAMPLE_RATE
+
+    def _wants_profile(self, request):
+        if self._sampled():
+            return True
+
+        return PROFILE_HEADER in request.META and is_staff(request)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self._acall(request)
+        if not self._wants_profile(request):
+            return self.get_response(request)
+
+        sampler = StackSampler(
+            threading.get_ident(), settings.PROFILE_INTERVAL)
+        sampler.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            stacks = sampler.stop()
+        if stacks:
+            write_profile(route_name(request), stacks)
+
+        return response
+
+    async def _acall(self, request):
+        wanted = self._sampled() or (
+            PROFILE_HEADER in request.META and
+            await sync_to_async(is_staff)(request)
+        )
+        if not wanted:
+            return await self.get_response(request)
+
+        # the event loop only awaits; view threads add themselves
+        sampler = StackSampler(None, settings.PROFILE_INTERVAL)
+        token = _sampler.set(sampler)
+        sampler.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            stacks = sampler.stop()
+            _sampler.reset(token)
+        if stacks:
+            await sync_to_async(write_profile, thread_sensitive=False)(
+                route_name(request), stacks)
+
+        return response
@@ -0,0 +1,85 @@
+"""
+Query budgets for API views
+
+A view declares the most queries each of its actions may run:
+
+    class TagViewSet(QueryBudgetMixin, ...):
+        query_budget = {'list': 3, 'update': 6}
+
+Views without actions use the lowercased request method as the key.
+core.metrics counts the queries of every request anyway, so the check
+costs one comparison per request. A request over budget is counted in
+http_query_budget_exceeded_total and logged with the fingerprints of its
+queries, most repeated first, which is where an N+1 loop shows up. With
+QUERY_BUDGET_STRICT, which core.test_runner turns on, it raises
+QueryBudgetExceeded instead, failing the test that made the request.
+"""
+import logging
+import re
+from collections import Counter
+
+from django.conf import settings
+
+from core.metrics import (QUERY_BUDGET_EXCEEDED, query_stats, route_name)
+
+
+logger = logging.getLogger(__name__)
+
+# fingerprints shown per violation
+MAX_FINGERPRINTS = 5
+STRING = re.compile(r"'(?:[^']|'')*'")
+NUMBER = re.compile(r'\b\d+\b')
+IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+SPACE = re.compile(r'\s+')
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def fingerprint(sql):
+    # fold literals and IN lists so the queries of a loop look the same
+    sql = STRING.sub('?', sql)
+    sql = NUMBER.sub('?', sql)
+    sql = IN_LIST.sub('IN (...)', sql)
+    return SPACE.sub(' ', sql).strip()
+
+
+def fingerprints(statements):
+    # return (fingerprint, count) pairs, most repeated first
+    return Counter(map(fingerprint, statements)).most_common()
+
+
+class QueryBudgetMixin:
+    # check the queries of each request against query_budget
+    query_budget = {}
+
+    def _budget_key(self, request):
+        return getattr(self, 'action', None) or request.method.lower()
+
+    def dispatch(self, request, *args, **kwargs):
+        with query_stats() as stats:
+            count = stats.count
+            first = len(stats.statements)
+            response = super().dispatch(request, *args, **kwargs)
+            used = stats.count - count
+            key = self._budget_key(request)
+            budget = self.query_budget.get(key)
+            if budget is not None and used > budget:
+                self._over_budget(
+                    request, key, budget, used, stats.statements[first:])
+
+        return response
+
+    def _over_budget(self, request, key, budget, used, statements):
+        route = route_name(request)
+        QUERY_BUDGET_EXCEEDED.labels(route, key).inc()
+        message = f'{route} {key} ran {used} queries, budget {budget}'
+        details = ''.join(
+            f'\n  {count} x {sql}'
+            for sql, count in fingerprints(statements)[:MAX_FINGERPRINTS]
+        )
+        if settings.QUERY_BUDGET_STRICT:
+            raise QueryBudgetExceeded(message + details)
+
+        logger.warning('%s%s', message, details)
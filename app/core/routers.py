@@ -0,0 +1,46 @@
+"""
+database routing for read replicas
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+
+# alias reads go to in the current request, None for the primary
+_read_alias = ContextVar('read_alias', default=None)
+
+
+@contextmanager
+def read_scope():
+    # restore the read database when the block exits
+    token = _read_alias.set(_read_alias.get())
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+def use_replica():
+    # send the remaining reads of the current scope to a random replica
+    replicas = settings.DATABASE_REPLICAS
+    _read_alias.set(random.choice(replicas) if replicas else None)
+
+
+class ReplicaRouter:
+    # read from the replica picked for the request, write to the primary
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        # also for instances that were read from a replica
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.DATABASE_REPLICAS
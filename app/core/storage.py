@@ -0,0 +1,109 @@
+"""
+File storage for recipe images and static files
+"""
+import gzip
+import hashlib
+import os
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+# static files worth serving compressed
+COMPRESSIBLE_EXTENSIONS = (
+    '.css', '.js', '.map', '.json', '.svg', '.txt', '.html', '.xml',
+    '.ico', '.ttf', '.eot',
+)
+# smaller files fit in one packet either way
+MIN_COMPRESS_SIZE = 256
+
+
+@deconstructible
+class RecipeImageStorage(FileSystemStorage):
+    # media storage that, with RECIPE_IMAGE_STORAGE = 'content', names each
+    # file after the SHA-256 of its bytes so identical uploads share a blob
+
+    @property
+    def content_addressed(self):
+        return settings.RECIPE_IMAGE_STORAGE == 'content'
+
+    def content_name(self, name, content):
+        # hash the upload chunk by chunk and return its blob name
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        digest = digest.hexdigest()
+        ext = os.path.splitext(name)[1].lower()
+        return os.path.join(
+            os.path.dirname(name), digest[:2], f'{digest}{ext}')
+
+    def _save(self, name, content):
+        if not self.content_addressed:
+            return super()._save(name, content)
+
+        name = self.content_name(name, content)
+        if self.exists(name):
+            # the same bytes are already stored; refresh the mtime so
+            # gc_images treats the blob as recently used
+            os.utime(self.path(name))
+            return name
+
+        saved = super()._save(name, content)
+        if saved != name:
+            # a concurrent upload of the same bytes won the race
+            self.delete(saved)
+        return name
+
+    def restore(self, name, content):
+        # write a blob back under its name if gc_images deleted it while an
+        # upload of the same bytes was waiting for the blob row
+        if not self.exists(name):
+            content.seek(0)
+            super()._save(name, content)
+
+
+recipe_image_storage = RecipeImageStorage()
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    # hashed static file names, each with a .gz copy for nginx gzip_static
+
+    def stored_name(self, name):
+        if not self.hashed_files:
+            # collectstatic has not run, e.g. in development and tests
+            return name
+
+        return super().stored_name(name)
+
+    def post_process(self, paths, dry_run=False, **options):
+        # files that reference others are yielded once per pass; only the
+        # name from the last pass is kept
+        hashed_names = {}
+        for name, hashed_name, processed in super().post_process(
+                paths, dry_run, **options):
+            if hashed_name and not isinstance(processed, Exception):
+                hashed_names[name] = hashed_name
+            yield name, hashed_name, processed
+
+        if not dry_run:
+            for hashed_name in sorted(hashed_names.values()):
+                self.compress(hashed_name)
+
+    def compress(self, name):
+        # write a gzip copy next to a file when it is smaller
+        if not name.lower().endswith(COMPRESSIBLE_EXTENSIONS):
+            return
+        path = self.path(name)
+        with open(path, 'rb') as file:
+            data = file.read()
+        if len(data) < MIN_COMPRESS_SIZE:
+            return
+
+        compressed = gzip.compress(data, compresslevel=9, mtime=0)
+        if len(compressed) < len(data):
+            with open(path + '.gz', 'wb') as file:
+                file.write(compressed)
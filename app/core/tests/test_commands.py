@@ -6,6 +6,7 @@ from unittest.mock import patch
 from psycopg2 import OperationalError as Psycopg2Error
 
 from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.db.utils import OperationalError
 from django.test import SimpleTestCase
 
@@ -26,3 +27,24 @@ class CommandTests(SimpleTestCase):
         call_command('wait_for_db')
         self.assertEqual(patched_check.call_count, 6)
         patched_check.assert_called_with(databases=['default'])
+
+    @patch('random.uniform', side_effect=lambda low, high: high)
+    @patch('time.sleep')
+    def test_wait_for_db_backoff(self, patched_sleep, patched_uniform,
+                                 patched_check):
+        # test waits double up to the maximum delay
+        patched_check.side_effect = [OperationalError] * 6 + [True]
+        call_command('wait_for_db', '--initial-delay', '1', '--max-delay',
+                     '8', '--timeout', '600')
+        delays = [call.args[0] for call in patched_sleep.call_args_list]
+        self.assertEqual(delays, [1, 2, 4, 8, 8, 8])
+
+    @patch('time.monotonic', side_effect=[0, 5, 31])
+    @patch('time.sleep')
+    def test_wait_for_db_timeout(self, patched_sleep, patched_monotonic,
+                                 patched_check):
+        # test the command fails once the deadline has passed
+        patched_check.side_effect = OperationalError
+        with self.assertRaises(CommandError):
+            call_command('wait_for_db', '--timeout', '30')
+        self.assertEqual(patched_check.call_count, 2)
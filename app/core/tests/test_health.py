@@ -0,0 +1,78 @@
+"""
+Tests for the liveness and readiness probes
+"""
+from unittest.mock import patch
+
+from django.db import (OperationalError, connection)
+from django.test import (TestCase, override_settings)
+
+from core.health import Readiness
+
+
+@patch('core.health.readiness', new_callable=Readiness)
+class HealthCheckTests(TestCase):
+    # tests for /healthz and /readyz
+
+    def test_healthz(self, readiness):
+        # test liveness needs no database
+        with self.assertNumQueries(0):
+            res = self.client.get('/healthz')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()['status'], 'ok')
+
+    @override_settings(ALLOWED_HOSTS=['example.com'])
+    def test_probes_skip_host_checks(self, readiness):
+        # test probes answer whatever host the orchestrator sends
+        res = self.client.get('/healthz', HTTP_HOST='10.0.0.7:9000')
+
+        self.assertEqual(res.status_code, 200)
+
+    def test_readyz(self, readiness):
+        # test readiness reports every check
+        res = self.client.get('/readyz')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()['checks'], {
+            'database': 'ok', 'migrations': 'ok', 'caches': 'ok'})
+        self.assertEqual(res['Cache-Control'], 'no-store')
+
+    def test_readyz_database_down(self, readiness):
+        # test readiness fails while the database is unreachable
+        with patch.object(connection, 'ensure_connection',
+                          side_effect=OperationalError('refused')):
+            res = self.client.get('/readyz')
+
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(res.json()['checks']['database'], 'refused')
+
+    @patch('core.health.unapplied_migrations', return_value=2)
+    def test_readyz_migrations_pending(self, unapplied, readiness):
+        # test readiness fails until migrations are applied
+        res = self.client.get('/readyz')
+
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(
+            res.json()['checks']['migrations'], '2 migrations not applied')
+
+    @override_settings(HEALTH_CHECK_CACHE_SECONDS=60)
+    def test_readyz_result_cached(self, readiness):
+        # test probes within the cache period reuse the last result
+        with patch.object(readiness, 'run',
+                          wraps=readiness.run) as run:
+            self.client.get('/readyz')
+            res = self.client.get('/readyz')
+
+        run.assert_called_once()
+        self.assertEqual(res.status_code, 200)
+
+    @override_settings(HEALTH_CHECK_CACHE_SECONDS=0)
+    def test_migrations_checked_until_applied(self, readiness):
+        # test the migration graph is not loaded again once it is applied
+        with patch('core.health.unapplied_migrations',
+                   side_effect=[1, 0]) as unapplied:
+            statuses = [
+                self.client.get('/readyz').status_code for _ in range(3)]
+
+        self.assertEqual(statuses, [503, 200, 200])
+        self.assertEqual(unapplied.call_count, 2)
@@ -0,0 +1,170 @@
+"""
+Tests for the request metrics
+"""
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import textwrap
+
+from asgiref.sync import iscoroutinefunction
+from django.contrib.auth import get_user_model
+from django.http import HttpResponse
+from django.test import (
+    AsyncClient,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from prometheus_client import REGISTRY
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.metrics import MetricsMiddleware
+
+
+def sample(name, **labels):
+    # return the current value of a sample, 0 if not recorded yet
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class MetricsMiddlewareTests(TestCase):
+    # tests for per route metrics
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='user@example.com', password='test123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_request_recorded_by_route(self):
+        # test latency, size and queries are recorded per route and status
+        labels = {'route': 'recipe:tag-list', 'method': 'GET',
+                  'status': '200'}
+        count = sample('http_request_duration_seconds_count', **labels)
+        queries = sample('http_db_queries_sum', **labels)
+        size = sample('http_response_size_bytes_sum', **labels)
+
+        res = self.client.get('/api/recipe/tags/')
+
+        self.assertEqual(
+            sample('http_request_duration_seconds_count', **labels),
+            count + 1)
+        self.assertGreater(sample('http_db_queries_sum', **labels), queries)
+        self.assertEqual(
+            sample('http_response_size_bytes_sum', **labels),
+            size + len(res.content))
+
+    def test_unmatched_route(self):
+        # test unknown paths share one label value
+        labels = {'route': '<unmatched>', 'method': 'GET', 'status': '404'}
+        count = sample('http_request_duration_seconds_count', **labels)
+
+        self.client.get('/no/such/page/')
+
+        self.assertEqual(
+            sample('http_request_duration_seconds_count', **labels),
+            count + 1)
+
+    def test_metrics_endpoint(self):
+        # test /metrics returns the text exposition format
+        self.client.get('/api/recipe/tags/')
+
+        res = self.client.get('/metrics')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res['Content-Type'].startswith('text/plain'))
+        self.assertIn(
+            b'http_request_duration_seconds_count{method="GET",'
+            b'route="recipe:tag-list",status="200"}',
+            res.content,
+        )
+
+
+class MetricsMiddlewareModeTests(SimpleTestCase):
+    # tests for running in both sync and async handler chains
+
+    def test_async_chain_stays_async(self):
+        # test the middleware is a coroutine when the chain below is one
+        async def get_response(request):
+            return HttpResponse()
+
+        def get_sync_response(request):
+            return HttpResponse()
+
+        self.assertTrue(iscoroutinefunction(MetricsMiddleware(get_response)))
+        self.assertFalse(
+            iscoroutinefunction(MetricsMiddleware(get_sync_response)))
+
+
+@override_settings(ROOT_URLCONF='app.asgi_urls')
+class AsyncMetricsMiddlewareTests(TransactionTestCase):
+    # tests for metrics of requests served over ASGI
+
+    def test_request_recorded_with_pool_queries(self):
+        # test queries of a view run on a pool thread are counted
+        user = get_user_model().objects.create_user(
+            email='user@example.com', password='test123')
+        token = Token.objects.create(user=user)
+        labels = {'route': 'recipe:tag-list', 'method': 'GET',
+                  'status': '200'}
+        count = sample('http_request_duration_seconds_count', **labels)
+        queries = sample('http_db_queries_sum', **labels)
+
+        res = asyncio.run(AsyncClient().get(
+            '/api/recipe/tags/', authorization=f'Token {token.key}'))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(
+            sample('http_request_duration_seconds_count', **labels),
+            count + 1)
+        self.assertGreater(sample('http_db_queries_sum', **labels), queries)
+
+
+# forks workers that each record requests, then renders from the parent
+MULTIPROCESS_SCRIPT = textwrap.dedent('''
+    import os
+    import django
+
+    django.setup()
+
+    from core.metrics import (QueryStats, observe, render)
+
+    children = []
+    for worker in range(3):
+        pid = os.fork()
+        if pid == 0:
+            for _ in range(worker + 1):
+                observe('recipe:recipe-list', 'GET', 200, 0.01, 100,
+                        QueryStats())
+            os._exit(0)
+        children.append(pid)
+    for pid in children:
+        os.waitpid(pid, 0)
+
+    print(render().decode())
+''')
+
+
+class MultiprocessMetricsTests(TestCase):
+    # tests for metrics of forked workers
+
+    def test_samples_summed_across_workers(self):
+        # test /metrics counts the requests of every worker
+        if not hasattr(os, 'fork'):
+            self.skipTest('needs fork')
+
+        with tempfile.TemporaryDirectory() as directory:
+            env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=directory)
+            output = subprocess.run(
+                [sys.executable, '-c', MULTIPROCESS_SCRIPT],
+                env=env, check=True, capture_output=True, text=True,
+            ).stdout
+
+        self.assertIn(
+            'http_request_duration_seconds_count{method="GET",'
+            'route="recipe:recipe-list",status="200"} 6.0',
+            output,
+        )
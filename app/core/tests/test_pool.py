@@ -0,0 +1,273 @@
+"""
+Tests for database connection health checks and pooling
+"""
+import threading
+import time
+from unittest.mock import (MagicMock, patch)
+
+import psycopg2.extensions
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import (SimpleTestCase, TestCase)
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.backends import pool as pools
+from core.backends.pool import (ConnectionPool, PoolTimeout)
+from core.backends.postgresql.base import DatabaseWrapper
+
+
+POOL_URL = reverse('db-pool')
+
+
+class FakeConnection:
+    # stands in for a DB-API connection
+
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    # tests for the in-process connection pool
+
+    def _pool(self, **options):
+        options.setdefault('max_size', 2)
+        options.setdefault('timeout', 0.05)
+        return ConnectionPool(connect=FakeConnection, **options)
+
+    def test_reuses_returned_connections(self):
+        # test a returned connection is handed out again
+        pool = self._pool()
+
+        first = pool.checkout()
+        pool.checkin(first)
+        second = pool.checkout()
+
+        self.assertIs(first, second)
+        self.assertEqual(pool.stats()['size'], 1)
+
+    def test_size_limit_and_timeout(self):
+        # test checkout waits for a free connection, then gives up
+        pool = self._pool()
+        pool.checkout()
+        pool.checkout()
+
+        with self.assertRaises(PoolTimeout):
+            pool.checkout()
+
+        stats = pool.stats()
+        self.assertEqual(stats['in_use'], 2)
+        self.assertEqual(stats['waits'], 1)
+        self.assertEqual(stats['timeouts'], 1)
+
+    def test_waiter_gets_returned_connection(self):
+        # test a blocked checkout takes the next connection checked in
+        pool = self._pool(max_size=1, timeout=5)
+        held = pool.checkout()
+        timer = threading.Timer(0.05, pool.checkin, [held])
+        timer.start()
+
+        connection = pool.checkout()
+        timer.join()
+
+        self.assertIs(connection, held)
+        stats = pool.stats()
+        self.assertEqual(stats['waits'], 1)
+        self.assertGreater(stats['checkout_seconds_max'], 0)
+
+    def test_failed_check_discards_connection(self):
+        # test an idle connection that fails its check is replaced
+        pool = self._pool(check=lambda c: not c.closed)
+        stale = pool.checkout()
+        pool.checkin(stale)
+        stale.closed = True
+
+        connection = pool.checkout()
+
+        self.assertIsNot(connection, stale)
+        self.assertEqual(pool.stats()['size'], 1)
+
+    def test_recently_used_connection_not_checked(self):
+        # test a connection back from a request is reused without a check
+        check = MagicMock(return_value=True)
+        pool = self._pool(check=check, check_idle=60)
+        pool.checkin(pool.checkout())
+
+        pool.checkout()
+
+        check.assert_not_called()
+        self.assertEqual(pool.stats()['checks'], 0)
+
+    def test_long_idle_connection_checked(self):
+        # test a connection idle past the threshold is checked first
+        check = MagicMock(return_value=True)
+        pool = self._pool(check=check, check_idle=60)
+        connection = pool.checkout()
+        pool.checkin(connection)
+
+        with patch('time.monotonic', return_value=time.monotonic() + 61):
+            pool.checkout()
+
+        check.assert_called_once_with(connection)
+        self.assertEqual(pool.stats()['checks'], 1)
+
+    def test_connection_after_error_checked(self):
+        # test a connection whose last user hit an error is checked first
+        check = MagicMock(return_value=False)
+        pool = self._pool(check=check, check_idle=60)
+        broken = pool.checkout()
+        pool.checkin(broken, suspect=True)
+
+        connection = pool.checkout()
+
+        check.assert_called_once_with(broken)
+        self.assertIsNot(connection, broken)
+
+    def test_failed_reset_discards_connection(self):
+        # test a connection that cannot be reset is closed, not reused
+        pool = self._pool(reset=lambda c: False)
+        connection = pool.checkout()
+
+        pool.checkin(connection)
+
+        self.assertTrue(connection.closed)
+        self.assertEqual(pool.stats()['size'], 0)
+
+    def test_failed_connect_frees_slot(self):
+        # test a connection error does not leak pool capacity
+        pool = ConnectionPool(
+            connect=MagicMock(side_effect=OSError), max_size=1, timeout=0)
+
+        for _ in range(2):
+            with self.assertRaises(OSError):
+                pool.checkout()
+
+        self.assertEqual(pool.stats()['size'], 0)
+
+    def test_new_pool_after_fork(self):
+        # test a child process does not share its parent's connections
+        with patch.dict(pools._pools, clear=True):
+            pool = pools.get_pool('test', connect=FakeConnection,
+                                  max_size=1, timeout=0)
+            self.assertIs(pools.get_pool('test'), pool)
+
+            with patch('os.getpid', return_value=pool.pid + 1):
+                child = pools.get_pool('test', connect=FakeConnection,
+                                       max_size=1, timeout=0)
+
+        self.assertIsNot(child, pool)
+
+
+class DatabaseWrapperTests(SimpleTestCase):
+    # tests for health checks in the PostgreSQL backend
+
+    def _wrapper(self, **settings):
+        settings_dict = dict(
+            connection.settings_dict,
+            ENGINE='core.backends.postgresql',
+            NAME='recipe',
+            CONN_HEALTH_CHECKS=True,
+        )
+        settings_dict.update(settings)
+        wrapper = DatabaseWrapper(settings_dict, alias='health')
+        wrapper.connection = MagicMock(closed=False)
+        wrapper.connection.get_transaction_status.return_value = (
+            psycopg2.extensions.TRANSACTION_STATUS_IDLE)
+        wrapper.autocommit = settings_dict['AUTOCOMMIT']
+        return wrapper
+
+    def test_dead_connection_replaced_before_use(self):
+        # test a persistent connection is checked once per request
+        wrapper = self._wrapper()
+        dead = wrapper.connection
+
+        with patch.object(wrapper, 'is_usable', return_value=False), \
+                patch.object(wrapper, 'connect') as connect:
+            wrapper.close_if_unusable_or_obsolete()
+            wrapper.ensure_connection()
+
+        dead.close.assert_called_once()
+        connect.assert_called_once()
+
+    def test_health_check_once_per_request(self):
+        # test later queries in the request skip the check
+        wrapper = self._wrapper()
+
+        with patch.object(wrapper, 'is_usable', return_value=True) as usable:
+            wrapper.close_if_unusable_or_obsolete()
+            wrapper.ensure_connection()
+            wrapper.ensure_connection()
+
+        usable.assert_called_once()
+
+    def test_health_checks_disabled(self):
+        # test no check runs when CONN_HEALTH_CHECKS is off
+        wrapper = self._wrapper(CONN_HEALTH_CHECKS=False)
+
+        with patch.object(wrapper, 'is_usable') as usable:
+            wrapper.close_if_unusable_or_obsolete()
+            wrapper.ensure_connection()
+
+        usable.assert_not_called()
+
+    def test_close_returns_connection_to_pool(self):
+        # test closing a pooled connection checks it back in
+        wrapper = self._wrapper(POOL={'MAX_SIZE': 1, 'TIMEOUT': 0})
+        raw = wrapper.connection
+
+        with patch.dict(pools._pools, clear=True):
+            wrapper._close()
+            pool = pools._pools['health']
+
+            self.assertEqual(pool.stats()['idle'], 1)
+        raw.close.assert_not_called()
+
+    def test_error_marks_pooled_connection_suspect(self):
+        # test a connection that saw a database error is checked on reuse
+        wrapper = self._wrapper(POOL={'MAX_SIZE': 1, 'TIMEOUT': 0})
+        wrapper.errors_occurred = True
+
+        with patch.dict(pools._pools, clear=True):
+            wrapper._close()
+            pool = pools._pools['health']
+
+        self.assertEqual(pool.check_idle, 30)
+        _, _, suspect = pool._idle[0]
+        self.assertTrue(suspect)
+
+
+class PoolStatsApiTests(TestCase):
+    # tests for the pool metrics endpoint
+
+    def test_admin_required(self):
+        # test only admins can read pool metrics
+        user = get_user_model().objects.create_user(
+            email='user@example.com', password='test123')
+        client = APIClient()
+        client.force_authenticate(user)
+
+        res = client.get(POOL_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_pool_stats(self):
+        # test the metrics of each pool are returned by alias
+        admin = get_user_model().objects.create_superuser(
+            email='admin@example.com', password='test123')
+        client = APIClient()
+        client.force_authenticate(admin)
+        pool = ConnectionPool(connect=FakeConnection, max_size=3, timeout=1)
+        pool.checkout()
+
+        with patch.dict(pools._pools, {'default': pool}, clear=True):
+            res = client.get(POOL_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['default']['in_use'], 1)
+        self.assertEqual(res.data['default']['max_size'], 3)
@@ -0,0 +1,199 @@
+"""
+Tests for the sampling request profiler
+"""
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+import time
+from io import StringIO
+from unittest.mock import patch
+
+from asgiref.sync import iscoroutinefunction
+from django.contrib.auth import get_user_model
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.http import HttpResponse
+from django.test import (RequestFactory, TestCase, override_settings)
+from django.urls import resolve
+from rest_framework.authtoken.models import Token
+
+from app.async_views import offload_reads
+
+from core.profiling import (
+    ProfilingMiddleware,
+    StackSampler,
+    flame_graph_svg,
+    load_profiles,
+    write_profile,
+)
+
+
+def busy_view(request):
+    # stand in for a slow view
+    request.resolver_match = resolve('/api/recipe/tags/')
+    deadline = time.monotonic() + 0.05
+    while time.monotonic() < deadline:
+        pass
+    return HttpResponse('ok')
+
+
+class ProfilerTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings = override_settings(
+            PROFILING=True,
+            PROFILE_SAMPLE_RATE=0,
+            PROFILE_INTERVAL=0.001,
+            PROFILE_DIR=self.directory,
+            PROFILE_RING_SIZE=3,
+        )
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _profiles(self):
+        directory = os.path.join(self.directory, 'recipe.tag-list')
+        if not os.path.isdir(directory):
+            return []
+        return sorted(os.listdir(directory))
+
+
+class ProfilingMiddlewareTests(ProfilerTestCase):
+    # tests for choosing and writing request profiles
+
+    def test_off_by_default(self):
+        # test the middleware drops out when profiling is off
+        with override_settings(PROFILING=False):
+            with self.assertRaises(MiddlewareNotUsed):
+                ProfilingMiddleware(busy_view)
+
+    def test_unsampled_requests_not_profiled(self):
+        # test no sampler runs for requests that are not sampled
+        middleware = ProfilingMiddleware(busy_view)
+
+        with patch('core.profiling.StackSampler') as sampler:
+            middleware(RequestFactory().get('/api/recipe/tags/'))
+
+        sampler.assert_not_called()
+        self.assertEqual(self._profiles(), [])
+
+    def test_sampled_request_written_by_route(self):
+        # test a sampled request leaves a collapsed stack profile
+        middleware = ProfilingMiddleware(busy_view)
+
+        with override_settings(PROFILE_SAMPLE_RATE=1):
+            res = middleware(RequestFactory().get('/api/recipe/tags/'))
+
+        self.assertEqual(res.status_code, 200)
+        profiles = self._profiles()
+        self.assertEqual(len(profiles), 1)
+        stacks = load_profiles('recipe:tag-list')
+        self.assertTrue(any('busy_view' in stack for stack in stacks))
+
+    def test_async_request_samples_view_thread(self):
+        # test under ASGI the pool thread running the view is sampled
+        middleware = ProfilingMiddleware(offload_reads(busy_view))
+        self.assertTrue(iscoroutinefunction(middleware))
+
+        with override_settings(PROFILE_SAMPLE_RATE=1):
+            res = asyncio.run(
+                middleware(RequestFactory().get('/api/recipe/tags/')))
+
+        self.assertEqual(res.status_code, 200)
+        stacks = load_profiles('recipe:tag-list')
+        self.assertTrue(any('busy_view' in stack for stack in stacks))
+
+    def test_ring_keeps_newest_profiles(self):
+        # test old profiles are removed past the ring size
+        for count in range(5):
+            write_profile('recipe:tag-list', {'a;b': count + 1})
+
+        profiles = self._profiles()
+        self.assertEqual(len(profiles), 3)
+        self.assertEqual(load_profiles('recipe:tag-list'), {'a;b': 12})
+
+    def _header_request(self, is_staff):
+        user = get_user_model().objects.create_user(
+            email=f'{is_staff}@example.com', password='test123',
+            is_staff=is_staff)
+        token = Token.objects.create(user=user)
+        return RequestFactory().get(
+            '/api/recipe/tags/', HTTP_X_PROFILE='1',
+            HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def test_header_profiles_staff_request(self):
+        # test staff can ask for a profile of one request
+        ProfilingMiddleware(busy_view)(self._header_request(True))
+
+        self.assertEqual(len(self._profiles()), 1)
+
+    def test_header_ignored_for_other_users(self):
+        # test the header does nothing for users who are not staff
+        ProfilingMiddleware(busy_view)(self._header_request(False))
+
+        self.assertEqual(self._profiles(), [])
+
+
+class StackSamplerTests(TestCase):
+    # tests for sampling another thread
+
+    def test_samples_target_thread(self):
+        # test samples show what the target thread is running
+        sampler = StackSampler(threading.get_ident(), 0.001)
+        sampler.start()
+        busy_view(RequestFactory().get('/'))
+        stacks = sampler.stop()
+
+        self.assertGreater(sum(stacks.values()), 0)
+        stack = next(iter(stacks))
+        self.assertIn('test_samples_target_thread', stack)
+        self.assertIn('core/tests/test_profiling.py', stack)
+
+
+class FlamegraphCommandTests(ProfilerTestCase):
+    # tests for merging profiles
+
+    def test_folded_output_merges_profiles(self):
+        # test collapsed stacks of several profiles are summed
+        write_profile('recipe:tag-list', {'main;list;serialize': 3})
+        write_profile('recipe:tag-list', {'main;list;serialize': 2,
+                                          'main;auth': 1})
+        write_profile('user:me', {'main;me': 4})
+        out = StringIO()
+
+        call_command('flamegraph', '--route', 'recipe:tag-list', '--folded',
+                     stdout=out)
+
+        self.assertEqual(
+            out.getvalue(), 'main;auth 1\nmain;list;serialize 5\n')
+
+    def test_svg_output(self):
+        # test the flame graph names each frame with its samples
+        write_profile('user:me', {'main;me': 4, 'main;<auth>': 1})
+        path = os.path.join(self.directory, 'flame.svg')
+
+        call_command('flamegraph', '--output', path, stdout=StringIO())
+
+        with open(path) as file:
+            svg = file.read()
+        self.assertTrue(svg.startswith('<svg'))
+        self.assertIn('main (5 samples, 100.0%)', svg)
+        self.assertIn('&lt;auth&gt;', svg)
+
+    def test_no_profiles(self):
+        # test the command fails when there is nothing to merge
+        with self.assertRaises(CommandError):
+            call_command('flamegraph', stdout=StringIO())
+
+    def test_narrow_frames_left_out(self):
+        # test frames under half a pixel are not drawn
+        svg = flame_graph_svg({'main;hot': 100000, 'main;cold': 1})
+
+        self.assertIn('hot', svg)
+        self.assertNotIn('cold', svg)
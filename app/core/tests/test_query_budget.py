@@ -0,0 +1,247 @@
+"""
+Tests for view query budgets
+"""
+from decimal import Decimal
+from unittest.mock import patch
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import (SimpleTestCase, TestCase, override_settings)
+from django.test.runner import DiscoverRunner
+from django.test.utils import CaptureQueriesContext
+from prometheus_client import REGISTRY
+from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
+from rest_framework.test import (APIClient, APIRequestFactory)
+from rest_framework.views import APIView
+
+from core.models import (Ingredient, Recipe, Tag)
+from core.test_runner import TestRunner
+from core.query_budget import (
+    QueryBudgetExceeded,
+    QueryBudgetMixin,
+    fingerprint,
+    fingerprints,
+)
+from recipe.serializers import RecipeSerializer
+from recipe.views import RecipeViewSet
+
+
+def sample(name, **labels):
+    # return the current value of a sample, 0 if not recorded yet
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class LoopView(QueryBudgetMixin, APIView):
+    # runs one query per user, the shape of an N+1 bug
+    authentication_classes = []
+    permission_classes = [AllowAny]
+    query_budget = {'get': 2}
+
+    def get(self, request):
+        users = get_user_model().objects.all()
+        return Response([
+            get_user_model().objects.filter(id=user.id).exists()
+            for user in users
+        ])
+
+
+class FingerprintTests(SimpleTestCase):
+    # tests for SQL fingerprints
+
+    def test_literals_folded(self):
+        # test numbers, strings and IN lists do not split fingerprints
+        self.assertEqual(
+            fingerprint(
+                "SELECT * FROM t WHERE a IN (%s, %s, %s) AND b = 'x' "
+                'LIMIT 21'),
+            "SELECT * FROM t WHERE a IN (...) AND b = ? LIMIT ?",
+        )
+        self.assertEqual(
+            fingerprint('SELECT "T4"."id"\n  FROM  t'),
+            'SELECT "T4"."id" FROM t',
+        )
+
+    def test_most_repeated_first(self):
+        # test the loop query comes first
+        statements = ['SELECT 1', 'SELECT a IN (%s)', 'SELECT a IN (%s, %s)']
+
+        self.assertEqual(
+            fingerprints(statements),
+            [('SELECT a IN (...)', 2), ('SELECT ?', 1)],
+        )
+
+
+class TestRunnerTests(SimpleTestCase):
+    # tests for the project test runner
+
+    @override_settings(QUERY_BUDGET_STRICT=False)
+    def test_strict_budgets_restored_after_run(self):
+        # test the runner only makes budgets strict while tests run
+        runner = TestRunner()
+
+        with patch.object(DiscoverRunner, 'setup_test_environment'), \
+                patch.object(DiscoverRunner, 'teardown_test_environment'):
+            runner.setup_test_environment()
+            self.assertTrue(settings.QUERY_BUDGET_STRICT)
+            runner.teardown_test_environment()
+
+        self.assertFalse(settings.QUERY_BUDGET_STRICT)
+
+
+class QueryBudgetTests(TestCase):
+    # tests for enforcing query budgets
+
+    def setUp(self):
+        for n in range(3):
+            get_user_model().objects.create_user(
+                email=f'user{n}@example.com', password='test123')
+
+    def _get(self):
+        return LoopView.as_view()(APIRequestFactory().get('/'))
+
+    @override_settings(QUERY_BUDGET_STRICT=True)
+    def test_within_budget(self):
+        # test a request within its budget passes
+        with patch.object(LoopView, 'query_budget', {'get': 4}):
+            res = self._get()
+
+        self.assertEqual(res.status_code, 200)
+
+    @override_settings(QUERY_BUDGET_STRICT=True)
+    def test_over_budget_raises_when_strict(self):
+        # test tests fail with the repeated query named
+        with self.assertRaises(QueryBudgetExceeded) as context:
+            self._get()
+
+        message = str(context.exception)
+        self.assertIn('get ran 4 queries, budget 2', message)
+        self.assertIn('3 x SELECT', message)
+
+    @override_settings(QUERY_BUDGET_STRICT=False)
+    def test_over_budget_logged_and_counted(self):
+        # test production keeps serving, logs and counts the violation
+        labels = {'route': '<unmatched>', 'action': 'get'}
+        count = sample('http_query_budget_exceeded_total', **labels)
+
+        with self.assertLogs('core.query_budget', 'WARNING') as logs:
+            res = self._get()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('3 x SELECT', logs.output[0])
+        self.assertEqual(
+            sample('http_query_budget_exceeded_total', **labels), count + 1)
+
+
+class RecipeQueryBudgetTests(TestCase):
+    # tests for the recipe API budgets
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='user@example.com', password='test123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        for n in range(5):
+            recipe = Recipe.objects.create(
+                user=self.user, title=f'Recipe {n}', time_minutes=5,
+                price=Decimal('1.00'))
+            recipe.tags.create(user=self.user, name=f'Tag {n}')
+
+    @override_settings(QUERY_BUDGET_STRICT=True)
+    def test_n_plus_one_fails(self):
+        # test losing the prefetch of the list goes over budget
+        get_queryset = RecipeViewSet.get_queryset
+
+        def without_prefetch(view):
+            return get_queryset(view).prefetch_related(None)
+
+        with patch.object(RecipeViewSet, 'get_queryset', without_prefetch):
+            with self.assertRaises(QueryBudgetExceeded) as context:
+                self.client.get('/api/recipe/recipes/')
+
+        self.assertIn('recipe:recipe-list list', str(context.exception))
+
+    @override_settings(QUERY_BUDGET_STRICT=True)
+    def test_recipe_list_within_budget(self):
+        # test the list stays within budget however many recipes it has
+        res = self.client.get('/api/recipe/recipes/')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(res.data), 5)
+
+
+class RecipeWriteBudgetTests(TestCase):
+    # tests that the recipe write budgets are exact and hold at any size
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='user@example.com', password='test123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.recipe = Recipe.objects.create(
+            user=self.user, title='Soup', time_minutes=5,
+            price=Decimal('1.00'))
+        self.recipe.tags.create(user=self.user, name='Current')
+        self.recipe.ingredients.create(user=self.user, name='Current')
+
+    def _payload(self, count, prefix):
+        # count existing and count new tags and ingredients, none current
+        names = [f'{prefix} {n}' for n in range(2 * count)]
+        for name in names[:count]:
+            Tag.objects.create(user=self.user, name=name)
+            Ingredient.objects.create(user=self.user, name=name)
+        return {
+            'title': f'Recipe {count}',
+            'time_minutes': 10,
+            'price': '2.00',
+            'tags': [{'name': name} for name in names],
+            'ingredients': [{'name': name} for name in names],
+        }
+
+    def _write(self, action, payload):
+        # run a write action and return the number of queries it made
+        detail = f'/api/recipe/recipes/{self.recipe.id}/'
+        method, url = {
+            'create': ('post', '/api/recipe/recipes/'),
+            'update': ('put', detail),
+            'partial_update': ('patch', detail),
+        }[action]
+        with CaptureQueriesContext(connection) as context:
+            res = getattr(self.client, method)(url, payload, format='json')
+        self.assertLess(res.status_code, 300)
+        return len(context.captured_queries)
+
+    def test_write_budgets_are_exact(self):
+        # test the budgets leave no room for an extra query
+        for action in ('create', 'update', 'partial_update'):
+            with self.subTest(action):
+                self.assertEqual(
+                    self._write(action, self._payload(2, action)),
+                    RecipeViewSet.query_budget[action],
+                )
+
+    @override_settings(QUERY_BUDGET_STRICT=True)
+    def test_write_budgets_hold_as_relations_grow(self):
+        # test many tags and ingredients stay within the same budget
+        for action in ('create', 'update', 'partial_update'):
+            with self.subTest(action):
+                self._write(action, self._payload(25, action))
+
+    @override_settings(QUERY_BUDGET_STRICT=True)
+    def test_per_name_lookup_fails(self):
+        # test looking up tags and ingredients one by one goes over budget
+        def get_or_create_each(serializer, model, items):
+            return [
+                model.objects.get_or_create(
+                    user=self.user, name=item['name'])[0]
+                for item in items
+            ]
+
+        with patch.object(
+                RecipeSerializer, '_get_or_create_attrs',
+                get_or_create_each):
+            with self.assertRaises(QueryBudgetExceeded) as context:
+                self._write('create', self._payload(3, 'create'))
+
+        self.assertIn('recipe:recipe-list create', str(context.exception))
@@ -0,0 +1,136 @@
+"""
+tests for the seed_data command
+"""
+import random
+from collections import Counter
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import (SimpleTestCase, TestCase)
+
+from core.management.commands.seed_data import (
+    TAG_NAMES,
+    Seeder,
+    copy_value,
+    recipes_per_user,
+)
+from core.models import (Ingredient, Recipe, Tag)
+from recipe.search import search_fields
+
+
+def seed(*args):
+    # run the command on the test database in this process
+    call_command('seed_data', *args, stdout=StringIO())
+
+
+def snapshot():
+    # return the seeded data without its ids
+    return [
+        (recipe.user.email, recipe.title, recipe.price,
+         sorted(tag.name for tag in recipe.tags.all()),
+         sorted(ingredient.name for ingredient in recipe.ingredients.all()))
+        for recipe in Recipe.objects.order_by('id').select_related(
+            'user').prefetch_related('tags', 'ingredients')
+    ]
+
+
+class SeedDataCommandTests(TestCase):
+    # tests for seeding benchmark data
+
+    def test_seed_recipes_across_users(self):
+        # test recipes are spread over users with their relations
+        seed('--recipes', '50', '--users', '4', '--batch-size', '20')
+
+        users = get_user_model().objects.order_by('id')
+        self.assertEqual(
+            [user.email for user in users],
+            [f'seed{n}@example.com' for n in range(1, 5)],
+        )
+        self.assertTrue(users[0].check_password('benchmark'))
+        self.assertEqual(Recipe.objects.count(), 50)
+        for recipe in Recipe.objects.all():
+            self.assertIn(recipe.tags.count(), range(1, 4))
+            self.assertIn(recipe.ingredients.count(), range(3, 9))
+            self.assertEqual(
+                recipe.search_document,
+                search_fields(recipe)['search_document'],
+            )
+            self.assertEqual(
+                {tag.user_id for tag in recipe.tags.all()}, {recipe.user_id})
+
+    def test_recipes_per_user_follow_power_law(self):
+        # test a few users own most of the recipes
+        counts = recipes_per_user(10000, 100, random.Random(0))
+
+        self.assertEqual(sum(counts), 10000)
+        counts.sort(reverse=True)
+        self.assertGreater(sum(counts[:20]), sum(counts[20:]))
+
+    def test_tag_popularity_is_zipfian(self):
+        # test popular names are used far more than the tail
+        seed('--recipes', '2000', '--users', '10')
+
+        uses = Counter(
+            Recipe.tags.through.objects.values_list('tag__name', flat=True))
+        self.assertEqual(uses.most_common(1)[0][0], TAG_NAMES[0])
+        self.assertGreater(
+            uses[TAG_NAMES[0]], 5 * min(uses.values()))
+
+    def test_seed_is_deterministic(self):
+        # test the same seed creates the same data
+        seed('--recipes', '30', '--users', '3', '--seed', '7')
+        first = snapshot()
+        get_user_model().objects.all().delete()
+
+        seed('--recipes', '30', '--users', '3', '--seed', '7')
+
+        self.assertEqual(snapshot(), first)
+
+    @patch('core.management.commands.seed_data.CHUNK_RECIPES', 10)
+    def test_seed_does_not_depend_on_chunk_order(self):
+        # test chunks give the same data in whatever order workers run them
+        seed('--recipes', '40', '--users', '8', '--seed', '3')
+        first = snapshot()
+        get_user_model().objects.all().delete()
+        tasks = Seeder._tasks
+
+        with patch.object(
+                Seeder, '_tasks',
+                lambda seeder, users: tasks(seeder, users)[::-1]):
+            seed('--recipes', '40', '--users', '8', '--seed', '3')
+
+        self.assertEqual(snapshot(), first)
+
+    def test_seed_refuses_seeded_database(self):
+        # test seeding twice is an error
+        seed('--recipes', '5')
+
+        with self.assertRaises(CommandError):
+            seed('--recipes', '5')
+
+    def test_seed_leaves_ids_for_new_rows(self):
+        # test rows created after seeding get fresh ids
+        seed('--recipes', '5')
+        user = get_user_model().objects.get(email='seed1@example.com')
+
+        tag = Tag.objects.create(user=user, name='After seeding')
+        ingredient = Ingredient.objects.create(user=user, name='After')
+
+        self.assertFalse(
+            Tag.objects.filter(id__gt=tag.id).exists())
+        self.assertFalse(
+            Ingredient.objects.filter(id__gt=ingredient.id).exists())
+
+
+class CopyValueTests(SimpleTestCase):
+    # tests for encoding values for COPY
+
+    def test_copy_value(self):
+        # test NULL and the characters COPY treats specially
+        self.assertEqual(copy_value(None), '\\N')
+        self.assertEqual(copy_value(12), '12')
+        self.assertEqual(
+            copy_value('a\tb\nc\\d\re'), 'a\\tb\\nc\\\\d\\re')
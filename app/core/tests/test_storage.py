@@ -0,0 +1,125 @@
+"""
+Tests for recipe image and static file storage
+"""
+import gzip
+import hashlib
+import os
+import shutil
+import tempfile
+
+from django.core.files.base import ContentFile
+from django.test import (SimpleTestCase, override_settings)
+
+from core.storage import (
+    CompressedManifestStaticFilesStorage,
+    RecipeImageStorage,
+)
+
+
+class RecipeImageStorageTests(SimpleTestCase):
+    # tests for content addressed image names
+
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.storage = RecipeImageStorage(location=self.location)
+
+    def tearDown(self):
+        shutil.rmtree(self.location, ignore_errors=True)
+
+    def test_names_files_by_content_hash(self):
+        # test the stored name is the SHA-256 of the bytes
+        digest = hashlib.sha256(b'image bytes').hexdigest()
+
+        name = self.storage.save(
+            'uploads/recipe/a.JPG', ContentFile(b'image bytes'))
+
+        self.assertEqual(
+            name, f'uploads/recipe/{digest[:2]}/{digest}.jpg')
+
+    def test_identical_content_is_written_once(self):
+        # test saving the same bytes twice reuses the first file
+        first = self.storage.save('uploads/recipe/a.jpg', ContentFile(b'x'))
+        path = self.storage.path(first)
+        os.utime(path, (0, 0))
+
+        second = self.storage.save('uploads/recipe/b.jpg', ContentFile(b'x'))
+
+        self.assertEqual(first, second)
+        self.assertEqual(len(os.listdir(os.path.dirname(path))), 1)
+        # the shared blob counts as recently used again
+        self.assertGreater(os.path.getmtime(path), 0)
+
+    def test_different_content_gets_different_names(self):
+        # test different bytes are stored separately
+        first = self.storage.save('uploads/recipe/a.jpg', ContentFile(b'x'))
+        second = self.storage.save('uploads/recipe/a.jpg', ContentFile(b'y'))
+
+        self.assertNotEqual(first, second)
+
+    @override_settings(RECIPE_IMAGE_STORAGE='uuid')
+    def test_uuid_mode_keeps_upload_names(self):
+        # test the content hash is skipped in uuid mode
+        first = self.storage.save('uploads/recipe/a.jpg', ContentFile(b'x'))
+        second = self.storage.save('uploads/recipe/b.jpg', ContentFile(b'x'))
+
+        self.assertEqual(
+            (first, second), ('uploads/recipe/a.jpg', 'uploads/recipe/b.jpg'))
+
+
+class CompressedManifestStaticFilesStorageTests(SimpleTestCase):
+    # tests for hashed and pre-compressed static files
+
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.storage = CompressedManifestStaticFilesStorage(
+            location=self.location, base_url='/static/')
+
+    def tearDown(self):
+        shutil.rmtree(self.location, ignore_errors=True)
+
+    def _collect(self, files):
+        # save files and post process them the way collectstatic does
+        for name, content in files.items():
+            self.storage.save(name, ContentFile(content))
+        paths = {name: (self.storage, name) for name in files}
+        processed = list(self.storage.post_process(paths))
+        self.storage.save_manifest()
+        return {name: hashed for name, hashed, _ in processed}
+
+    def test_hashed_files_get_gzip_copies(self):
+        # test the final hashed name of a file gets a gzip copy
+        css = b'body { color: black; }\n' * 40
+        hashed = self._collect({
+            'css/app.css': b'@import url("base.css");\n' + css,
+            'css/base.css': css,
+        })
+
+        for name in ('css/app.css', 'css/base.css'):
+            path = self.storage.path(hashed[name])
+            with open(path, 'rb') as file, gzip.open(path + '.gz') as gz:
+                self.assertEqual(gz.read(), file.read())
+
+    def test_small_and_binary_files_not_compressed(self):
+        # test compression is skipped where it gains nothing
+        hashed = self._collect({
+            'css/tiny.css': b'a{}',
+            'img/logo.png': b'\x89PNG' * 200,
+        })
+
+        for name in hashed.values():
+            self.assertFalse(os.path.exists(self.storage.path(name + '.gz')))
+
+    def test_url_without_manifest(self):
+        # test plain names are used before collectstatic has run
+        self.assertEqual(
+            self.storage.url('css/app.css'), '/static/css/app.css')
+
+    def test_url_uses_manifest(self):
+        # test collected files are referenced by their hashed name
+        hashed = self._collect({'js/app.js': b'console.log(1);'})
+
+        storage = CompressedManifestStaticFilesStorage(
+            location=self.location, base_url='/static/')
+
+        self.assertEqual(
+            storage.url('js/app.js'), f'/static/{hashed["js/app.js"]}')
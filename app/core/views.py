@@ -0,0 +1,21 @@
+"""
+views for operating the service
+"""
+
+from drf_spectacular.utils import (extend_schema, OpenApiTypes)
+from rest_framework import permissions
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from core.backends.pool import pool_stats
+from user.authentication import CachedTokenAuthentication
+
+
+class PoolStatsView(APIView):
+    # connection pool metrics of the process serving the request
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [permissions.IsAdminUser]
+
+    @extend_schema(responses=OpenApiTypes.OBJECT)
+    def get(self, request):
+        return Response(pool_stats())
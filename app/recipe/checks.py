@@ -0,0 +1,128 @@
+"""
+EXPLAIN checks for the hot recipe API queries
+
+Run with `python manage.py check --deploy --tag query_plans --database
+default`. Each list query the API serves is planned with sequential scans
+and sorts discouraged; if the plan still needs either, no index matches
+the query shape. The check is deploy only, so wait_for_db, migrate and
+runserver never plan queries.
+"""
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.checks import (Error, register)
+from django.db import (connections, router, transaction)
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from core.health import unapplied_migrations
+from core.models import Recipe
+
+
+SQLITE_SORTS = ('USE TEMP B-TREE FOR ORDER BY',)
+POSTGRES_SORTS = ('Sort', 'Incremental Sort')
+
+
+def hot_queries():
+    # return (name, viewset, query params) for the queries to check
+    from recipe.views import (IngredientViewSet, RecipeViewSet, TagViewSet)
+
+    return [
+        ('recipe list', RecipeViewSet, {}),
+        ('recipes by tag', RecipeViewSet, {'tags': '1,2'}),
+        ('recipes with all tags', RecipeViewSet,
+         {'tags': '1,2', 'match': 'all'}),
+        ('recipes by ingredient', RecipeViewSet, {'ingredients': '1'}),
+        ('tag list', TagViewSet, {}),
+        ('assigned tags', TagViewSet, {'assigned_only': '1'}),
+        ('ingredient list', IngredientViewSet, {}),
+        ('assigned ingredients', IngredientViewSet, {'assigned_only': '1'}),
+    ]
+
+
+def list_queryset(viewset, params, user):
+    # return the first page query a list request would run
+    request = Request(APIRequestFactory().get('/', params))
+    request.user = user
+    view = viewset(
+        request=request, action='list', args=(), kwargs={}, format_kwarg=None)
+    paginator = view.paginator
+    ordering = paginator.ordering
+    if isinstance(ordering, str):
+        ordering = [ordering]
+
+    return view.get_queryset().order_by(*ordering)[:paginator.page_size + 1]
+
+
+def _postgres_problems(plan):
+    # walk an EXPLAIN (FORMAT JSON) plan tree
+    problems = []
+    nodes = [plan[0]['Plan']]
+    while nodes:
+        node = nodes.pop()
+        if node['Node Type'] == 'Seq Scan':
+            problems.append(f'sequential scan on {node["Relation Name"]}')
+        elif node['Node Type'] in POSTGRES_SORTS:
+            problems.append(f'sort on {", ".join(node["Sort Key"])}')
+        nodes.extend(node.get('Plans', []))
+
+    return problems
+
+
+def _sqlite_problems(rows):
+    # read EXPLAIN QUERY PLAN rows of (id, parent, notused, detail)
+    problems = []
+    for row in rows:
+        detail = row[-1]
+        if detail.startswith('SCAN ') and not detail.startswith(
+                ('SCAN CONSTANT', 'SCAN (subquery')):
+            problems.append(f'sequential scan: {detail}')
+        elif detail.startswith(SQLITE_SORTS):
+            problems.append(f'sort: {detail}')
+
+    return problems
+
+
+def plan_problems(queryset, using=None):
+    # return why the plan for a queryset needs a full scan or a sort
+    using = using or router.db_for_read(queryset.model)
+    connection = connections[using]
+    sql, params = queryset.query.sql_with_params()
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('SET LOCAL enable_sort = off')
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return _postgres_problems(plan)
+        if connection.vendor == 'sqlite':
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return _sqlite_problems(cursor.fetchall())
+
+    return []
+
+
+@register('query_plans', deploy=True)
+def check_query_plans(app_configs=None, databases=None, **kwargs):
+    # fail when a hot query is not served by an index
+    errors = []
+    user = get_user_model()(pk=0)
+    for using in databases or []:
+        if not router.allow_migrate_model(using, Recipe):
+            continue
+        if unapplied_migrations(using):
+            # plans are only meaningful once the schema is up to date
+            continue
+        for name, viewset, params in hot_queries():
+            queryset = list_queryset(viewset, params, user)
+            for problem in plan_problems(queryset, using):
+                errors.append(Error(
+                    f'The {name} query needs a {problem}.',
+                    hint='Add an index matching its filter and ordering.',
+                    obj=viewset.__name__,
+                    id='recipe.E001',
+                ))
+
+    return errors
@@ -0,0 +1,133 @@
+"""
+conditional GET support for recipe APIs
+
+The ETag carries the user's data version and is the validator to rely on.
+Last-Modified only has whole seconds, so it is left out until the second
+of the last change has passed; a later write always lands in a later
+second and If-Modified-Since can not hide it.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.cache import (get_conditional_response, patch_vary_headers)
+from django.utils.http import http_date
+from rest_framework.permissions import SAFE_METHODS
+
+from user.authentication import invalidate_users
+
+
+# users whose data changed in the current bump scope, None outside one
+_changed_users = ContextVar('changed_users', default=None)
+
+
+def bump_data_versions(user_ids):
+    # mark the users' recipes, tags or ingredients as changed
+    get_user_model().objects.filter(pk__in=user_ids).update(
+        data_version=F('data_version') + 1,
+        data_updated_at=timezone.now(),
+    )
+    # cached users carry the old version; drop them now and again on
+    # commit, in case a request cached the old row in between
+    invalidate_users(user_ids)
+    transaction.on_commit(lambda: invalidate_users(user_ids))
+
+
+def bump_data_version(user):
+    bump_data_versions([user.pk])
+
+
+def data_changed(user_id):
+    # bump now, or once when the current bump scope exits
+    changed = _changed_users.get()
+    if changed is None:
+        bump_data_versions([user_id])
+    else:
+        changed.add(user_id)
+
+
+@contextmanager
+def bump_scope():
+    # collect the changes of a block, e.g. a request, into one bump per user
+    token = _changed_users.set(set())
+    try:
+        yield
+    finally:
+        changed = _changed_users.get()
+        _changed_users.reset(token)
+        if changed:
+            bump_data_versions(sorted(changed))
+
+
+class NotModified(Exception):
+    # raised to skip the handler when the client copy is still fresh
+
+    def __init__(self, response):
+        super().__init__()
+        self.response = response
+
+
+class ConditionalGetMixin:
+    # answer If-None-Match / If-Modified-Since from the user data version
+    conditional_actions = ('list', 'retrieve')
+
+    def _validators(self, request):
+        # return the etag and last modified timestamp for the user data
+        user = request.user
+        etag = f'W/"{user.pk}-{user.data_version}"'
+        last_modified = None
+        if user.data_updated_at is not None:
+            last_modified = int(user.data_updated_at.timestamp())
+            if last_modified >= int(timezone.now().timestamp()):
+                # another write may still land in this second
+                last_modified = None
+
+        return etag, last_modified
+
+    def _is_conditional(self, request):
+        return (
+            request.method in ('GET', 'HEAD') and
+            self.action in self.conditional_actions and
+            request.user.is_authenticated
+        )
+
+    def dispatch(self, request, *args, **kwargs):
+        # model signals report changes, bump each user once per request
+        with bump_scope():
+            return super().dispatch(request, *args, **kwargs)
+
+    def initial(self, request, *args, **kwargs):
+        # runs after authentication and permission checks, before any query
+        super().initial(request, *args, **kwargs)
+        if self._is_conditional(request):
+            etag, last_modified = self._validators(request)
+            response = get_conditional_response(
+                request, etag=etag, last_modified=last_modified)
+            if response is not None:
+                raise NotModified(response)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return exc.response
+
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(
+            request, response, *args, **kwargs)
+        if request.method not in SAFE_METHODS:
+            # bulk writes send no model signals
+            if response.status_code < 400 and request.user.is_authenticated:
+                data_changed(request.user.pk)
+        elif self._is_conditional(request):
+            if response.status_code in (200, 304):
+                etag, last_modified = self._validators(request)
+                response['ETag'] = etag
+                if last_modified is not None:
+                    response['Last-Modified'] = http_date(last_modified)
+            patch_vary_headers(response, ['Accept', 'Authorization'])
+
+        return response
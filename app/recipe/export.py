@@ -0,0 +1,118 @@
+"""
+streaming export of a user's recipes
+"""
+import csv
+import json
+
+from rest_framework.renderers import BaseRenderer
+
+from core.models import Recipe
+
+
+EXPORT_CHUNK_SIZE = 500
+EXPORT_FIELDS = [
+    'id', 'title', 'description', 'time_minutes', 'price', 'link',
+    'tags', 'ingredients', 'updated_at',
+]
+# separates tag and ingredient names inside one CSV cell
+CSV_NAME_SEPARATOR = '|'
+
+
+def _names_by_recipe(through, field_name, ids, using):
+    # return {recipe id: [name, ...]} for one relation of a chunk of recipes
+    names = {}
+    rows = through.objects.using(using).filter(recipe_id__in=ids).order_by(
+        f'{field_name}__name').values_list('recipe_id', f'{field_name}__name')
+    for recipe_id, name in rows:
+        names.setdefault(recipe_id, []).append(name)
+
+    return names
+
+
+def export_chunks(queryset, chunk_size=None):
+    # yield lists of plain recipe dicts, reading chunk_size rows at a time;
+    # keyset paging keeps no cursor or transaction open between chunks
+    chunk_size = chunk_size or EXPORT_CHUNK_SIZE
+    queryset = queryset.prefetch_related(None).order_by('id').values(
+        'id', 'title', 'description', 'time_minutes', 'price', 'link',
+        'updated_at',
+    )
+    last_id = 0
+    while True:
+        chunk = list(queryset.filter(id__gt=last_id)[:chunk_size])
+        if not chunk:
+            return
+
+        ids = [row['id'] for row in chunk]
+        tags = _names_by_recipe(Recipe.tags.through, 'tag', ids, queryset.db)
+        ingredients = _names_by_recipe(
+            Recipe.ingredients.through, 'ingredient', ids, queryset.db)
+        for row in chunk:
+            row['price'] = str(row['price'])
+            row['updated_at'] = row['updated_at'].isoformat()
+            row['tags'] = tags.get(row['id'], [])
+            row['ingredients'] = ingredients.get(row['id'], [])
+        yield chunk
+        last_id = ids[-1]
+
+
+def ndjson_stream(queryset, chunk_size=None):
+    # yield one JSON document per line, a chunk at a time
+    for chunk in export_chunks(queryset, chunk_size):
+        yield ''.join(
+            json.dumps({field: row[field] for field in EXPORT_FIELDS}) + '\n'
+            for row in chunk
+        )
+
+
+class _Echo:
+    # file-like object that hands back what csv.writer writes
+
+    def write(self, value):
+        return value
+
+
+def csv_stream(queryset, chunk_size=None):
+    # yield a header line, then the rows of each chunk
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for chunk in export_chunks(queryset, chunk_size):
+        for row in chunk:
+            row['tags'] = CSV_NAME_SEPARATOR.join(row['tags'])
+            row['ingredients'] = CSV_NAME_SEPARATOR.join(row['ingredients'])
+        yield ''.join(
+            writer.writerow([row[field] for field in EXPORT_FIELDS])
+            for row in chunk
+        )
+
+
+class NDJSONRenderer(BaseRenderer):
+    # negotiates ?format=ndjson; exports bypass it, errors use it
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return (json.dumps(data) + '\n').encode()
+
+
+class CSVRenderer(BaseRenderer):
+    # negotiates ?format=csv; exports bypass it, errors use it
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if not isinstance(data, dict):
+            data = {'detail': data}
+        writer = csv.writer(_Echo())
+        return (
+            writer.writerow(list(data)) +
+            writer.writerow([str(value) for value in data.values()])
+        ).encode()
+
+
+EXPORT_STREAMS = {
+    'ndjson': ndjson_stream,
+    'csv': csv_stream,
+}
@@ -0,0 +1,171 @@
+"""
+background processing of uploaded recipe images
+
+Uploads are stored as they arrive and queued on the recipe row. The
+process_images command claims queued recipes, renders derivatives in a pool
+of worker processes and records the results.
+"""
+import hashlib
+import io
+import os
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from PIL import (Image, ImageOps)
+
+from core.models import Recipe
+from core.storage import recipe_image_storage
+from recipe.conditional import bump_data_version
+
+
+# fixed renditions of every image, by name and width, in each format
+DERIVATIVE_SIZES = (('thumbnail', 320), ('medium', 640), ('large', 1280))
+DERIVATIVE_FORMATS = (
+    ('jpeg', 'JPEG', '.jpg', {'quality': 85, 'optimize': True}),
+    ('webp', 'WEBP', '.webp', {'quality': 80, 'method': 4}),
+)
+DERIVATIVE_DIR = os.path.join('uploads', 'recipe', 'derivatives')
+# a recipe stuck in processing this long is assumed lost with its worker
+STALE_AFTER = timedelta(minutes=10)
+
+
+def derivative_name(source_name, width, extension, content):
+    # return the storage name of one derivative of an uploaded image; the
+    # name changes with the content, so nginx can serve it as immutable
+    stem = os.path.splitext(os.path.basename(source_name))[0]
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    return os.path.join(
+        DERIVATIVE_DIR, f'{stem}-{width}w.{digest}{extension}')
+
+
+def derivative_names(derivatives):
+    # return every storage name in a derivatives map
+    return {
+        name for renditions in derivatives.values()
+        for name in renditions.values()
+    }
+
+
+def derivative_for_size(derivatives, size, key='jpeg'):
+    # return the storage name of a named size, or None before processing
+    renditions = derivatives.get(key)
+    if not renditions:
+        return None
+
+    width = dict(DERIVATIVE_SIZES)[size]
+    # small sources stop at their own width
+    width = min(width, max(int(w) for w in renditions))
+    return renditions[str(width)]
+
+
+def _flatten(img):
+    # return an RGB copy, putting any transparency on a white background
+    if img.mode in ('RGBA', 'LA') or 'transparency' in img.info:
+        img = img.convert('RGBA')
+        background = Image.new('RGB', img.size, 'white')
+        background.paste(img, mask=img.getchannel('A'))
+        return background
+
+    return img.convert('RGB')
+
+
+def render_derivatives(media_root, source_name):
+    # decode an upload and write its downscaled derivatives; runs in a worker
+    # process, so it only touches files and returns
+    # {format: {width: storage name}}
+    largest = max(width for _, width in DERIVATIVE_SIZES)
+    with Image.open(os.path.join(media_root, source_name)) as img:
+        # let JPEG decode at a reduced scale when the source is much larger
+        img.draft('RGB', (largest, largest))
+        img = _flatten(ImageOps.exif_transpose(img))
+
+    # sizes never upscale, so small sources share one width
+    widths = {min(width, img.width) for _, width in DERIVATIVE_SIZES}
+    derivatives = {key: {} for key, _, _, _ in DERIVATIVE_FORMATS}
+    os.makedirs(os.path.join(media_root, DERIVATIVE_DIR), exist_ok=True)
+    # resize from the previous rendition, largest first
+    for width in sorted(widths, reverse=True):
+        height = max(1, round(img.height * width / img.width))
+        img = img.resize((width, height), Image.LANCZOS)
+        for key, fmt, extension, options in DERIVATIVE_FORMATS:
+            # a fresh RGB image carries no EXIF, ICC or comment metadata
+            buffer = io.BytesIO()
+            img.save(buffer, format=fmt, **options)
+            content = buffer.getvalue()
+            name = derivative_name(source_name, width, extension, content)
+            with open(os.path.join(media_root, name), 'wb') as file:
+                file.write(content)
+            derivatives[key][str(width)] = name
+
+    return derivatives
+
+
+def claim_pending(limit):
+    # mark up to limit queued recipes as processing and return them
+    stale = timezone.now() - STALE_AFTER
+    with transaction.atomic():
+        recipes = list(
+            Recipe.objects.filter(
+                Q(image_status=Recipe.ImageStatus.PENDING) |
+                Q(image_status=Recipe.ImageStatus.PROCESSING,
+                  updated_at__lt=stale)
+            )
+            .select_related('user')
+            .select_for_update(skip_locked=True, of=('self',))
+            .order_by('id')[:limit]
+        )
+        Recipe.objects.filter(id__in=[recipe.id for recipe in recipes]).update(
+            image_status=Recipe.ImageStatus.PROCESSING,
+            updated_at=timezone.now(),
+        )
+
+    return recipes
+
+
+def finish(recipe, derivatives):
+    # record rendered derivatives, unless the image changed in the meantime;
+    # files nothing refers to any more are left to the gc_images command
+    updated = Recipe.objects.filter(id=recipe.id, image=recipe.image.name)
+    updated = updated.update(
+        image_status=Recipe.ImageStatus.READY,
+        image_derivatives=derivatives,
+        updated_at=timezone.now(),
+    )
+    if not updated:
+        return False
+
+    bump_data_version(recipe.user)
+    return True
+
+
+def fail(recipe):
+    # mark a recipe whose image could not be processed
+    Recipe.objects.filter(id=recipe.id, image=recipe.image.name).update(
+        image_status=Recipe.ImageStatus.FAILED,
+        updated_at=timezone.now(),
+    )
+    bump_data_version(recipe.user)
+
+
+def process_recipes(executor, recipes):
+    # render derivatives for claimed recipes and return (ready, failed)
+    media_root = recipe_image_storage.location
+    futures = [
+        (recipe, executor.submit(
+            render_derivatives, media_root, recipe.image.name))
+        for recipe in recipes
+    ]
+    ready, failed = [], []
+    for recipe, future in futures:
+        try:
+            derivatives = future.result()
+        except Exception:
+            fail(recipe)
+            failed.append(recipe)
+            continue
+        if finish(recipe, derivatives):
+            ready.append(recipe)
+
+    return ready, failed
@@ -0,0 +1,164 @@
+"""
+bulk import of recipes from NDJSON
+
+Each line of the input is one recipe in the shape the recipe API accepts.
+Valid records are written in fixed-size batches, each in its own
+transaction; the line number of the last committed batch is the checkpoint
+an interrupted import resumes from.
+"""
+import json
+
+from django.db import (connections, transaction)
+
+from core.models import (Ingredient, Recipe, Tag)
+from recipe.conditional import (bump_scope, data_changed)
+from recipe.search import update_search_index
+from recipe.serializers import RecipeDetailSerializer
+
+
+IMPORT_BATCH_SIZE = 500
+# failures kept in the report; later ones are only counted
+MAX_REPORTED_FAILURES = 1000
+
+
+class RecipeImporter:
+    # import NDJSON recipes for one user
+
+    def __init__(self, user, batch_size=None, resume_from=0,
+                 on_checkpoint=None):
+        self.user = user
+        self.batch_size = batch_size or IMPORT_BATCH_SIZE
+        self.resume_from = resume_from
+        self.on_checkpoint = on_checkpoint
+        self.checkpoint = resume_from
+        self.imported = 0
+        self.failed = 0
+        self.failures = []
+        # name -> id for every tag and ingredient seen in this import
+        self.ids = {Tag: {}, Ingredient: {}}
+
+    def run(self, lines):
+        # import every line after the checkpoint and return the report
+        batch = []
+        line_number = 0
+        for line_number, line in enumerate(lines, start=1):
+            if line_number <= self.resume_from:
+                continue
+            data = self._validate(line_number, line)
+            if data is not None:
+                batch.append(data)
+            if len(batch) >= self.batch_size:
+                self._flush(batch, line_number)
+                batch = []
+
+        if line_number > self.checkpoint:
+            self._flush(batch, line_number)
+
+        return self.report()
+
+    def report(self):
+        return {
+            'imported': self.imported,
+            'failed': self.failed,
+            'failures': self.failures,
+            'checkpoint': self.checkpoint,
+        }
+
+    def _fail(self, line_number, errors):
+        self.failed += 1
+        if len(self.failures) < MAX_REPORTED_FAILURES:
+            self.failures.append({'line': line_number, 'errors': errors})
+
+    def _validate(self, line_number, line):
+        # return validated data for one line, or None if it failed
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', errors='replace')
+        if not line.strip():
+            return None
+        try:
+            record = json.loads(line)
+        except ValueError as exc:
+            self._fail(line_number, {'non_field_errors': [str(exc)]})
+            return None
+        if not isinstance(record, dict):
+            self._fail(line_number, {
+                'non_field_errors': ['Expected a JSON object.']})
+            return None
+
+        serializer = RecipeDetailSerializer(data=record)
+        if not serializer.is_valid():
+            self._fail(line_number, serializer.errors)
+            return None
+
+        return serializer.validated_data
+
+    def _resolve(self, model, names):
+        # fill the name map for names not seen yet in this import
+        ids = self.ids[model]
+        missing = {name for name in names if name not in ids}
+        if not missing:
+            return
+
+        existing = model.objects.filter(user=self.user, name__in=missing)
+        ids.update(existing.values_list('name', 'id'))
+        new = missing - set(ids)
+        if new:
+            model.objects.bulk_create(
+                [model(user=self.user, name=name) for name in new],
+                ignore_conflicts=True,
+            )
+            created = model.objects.filter(user=self.user, name__in=new)
+            ids.update(created.values_list('name', 'id'))
+
+    def _insert(self, recipes):
+        # insert recipes, batched where the database returns ids
+        connection = connections[Recipe.objects.db]
+        if connection.features.can_return_rows_from_bulk_insert:
+            Recipe.objects.bulk_create(recipes)
+        else:
+            for recipe in recipes:
+                recipe.save()
+
+    def _flush(self, batch, line_number):
+        # write one batch and move the checkpoint past it
+        if batch:
+            # one version bump per batch, however many recipes it saves
+            with transaction.atomic(), bump_scope():
+                self._write(batch)
+            self.imported += len(batch)
+
+        self.checkpoint = line_number
+        if self.on_checkpoint is not None:
+            self.on_checkpoint(self.checkpoint)
+
+    def _write(self, batch):
+        relations = (('tags', Tag), ('ingredients', Ingredient))
+        for field_name, model in relations:
+            self._resolve(model, {
+                attr['name']
+                for data in batch for attr in data.get(field_name, [])
+            })
+
+        recipes = []
+        for data in batch:
+            fields = {
+                attr: value for attr, value in data.items()
+                if attr not in ('tags', 'ingredients')
+            }
+            recipes.append(Recipe(user=self.user, **fields))
+        self._insert(recipes)
+
+        for field_name, model in relations:
+            through = getattr(Recipe, field_name).through
+            fk_name = f'{model.__name__.lower()}_id'
+            ids = self.ids[model]
+            through.objects.bulk_create([
+                through(recipe_id=recipe.id, **{fk_name: obj_id})
+                for recipe, data in zip(recipes, batch)
+                for obj_id in {
+                    ids[attr['name']] for attr in data.get(field_name, [])
+                }
+            ])
+
+        update_search_index(recipes)
+        data_changed(self.user.pk)
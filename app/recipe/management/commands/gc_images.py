@@ -0,0 +1,149 @@
+"""
+Django command to delete recipe images that no recipe uses
+"""
+import os
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from core.models import (ImageBlob, Recipe)
+from core.storage import recipe_image_storage
+from recipe.images import (DERIVATIVE_DIR, derivative_names)
+
+
+UPLOAD_DIR = os.path.join('uploads', 'recipe')
+
+
+def _stem(name):
+    # return the upload a derivative file was rendered from
+    return os.path.basename(name).rsplit('-', 1)[0]
+
+
+class Command(BaseCommand):
+    help = 'Delete recipe images and derivatives no recipe refers to.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace', type=int, default=60,
+            help='Minutes a file must be unused before it is deleted.',
+        )
+        parser.add_argument(
+            '--sweep', action='store_true',
+            help='Also walk the upload directory for untracked files.',
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='List the files that would be deleted.',
+        )
+
+    def handle(self, *args, **options):
+        # entry point for command
+        self.storage = recipe_image_storage
+        self.dry_run = options['dry_run']
+        self.cutoff = timezone.now() - timedelta(minutes=options['grace'])
+        self.derivatives = self._derivatives_by_stem()
+
+        deleted = self._collect_blobs()
+        if options['sweep']:
+            deleted += self._sweep()
+
+        verb = 'Would delete' if self.dry_run else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {deleted} files'))
+
+    def _derivatives_by_stem(self):
+        # map each upload stem to its derivative file names
+        try:
+            _, files = self.storage.listdir(DERIVATIVE_DIR)
+        except FileNotFoundError:
+            files = []
+        by_stem = {}
+        for file in files:
+            name = os.path.join(DERIVATIVE_DIR, file)
+            by_stem.setdefault(_stem(name), []).append(name)
+
+        return by_stem
+
+    def _is_recent(self, name):
+        # uploads of the same bytes refresh the blob's modified time
+        try:
+            return self.storage.get_modified_time(name) >= self.cutoff
+        except FileNotFoundError:
+            return False
+
+    def _delete(self, names):
+        for name in names:
+            self.stdout.write(name)
+            if not self.dry_run:
+                self.storage.delete(name)
+
+        return len(names)
+
+    def _collect_blobs(self):
+        # delete blobs whose reference count dropped to zero
+        deleted = 0
+        blobs = ImageBlob.objects.filter(
+            references=0, updated_at__lt=self.cutoff)
+        for blob in blobs.iterator():
+            # the files go while the row is locked and known unused, so an
+            # upload retaining the blob waits and then writes it back
+            with transaction.atomic():
+                locked = ImageBlob.objects.select_for_update().filter(
+                    pk=blob.pk, references=0).exists()
+                if not locked or self._is_recent(blob.name):
+                    continue
+                references = Recipe.objects.filter(image=blob.name).count()
+                if references:
+                    # the image was set without going through the upload API
+                    ImageBlob.objects.filter(pk=blob.pk).update(
+                        references=references)
+                    continue
+                if not self.dry_run:
+                    ImageBlob.objects.filter(pk=blob.pk).delete()
+
+                stem = os.path.splitext(os.path.basename(blob.name))[0]
+                deleted += self._delete(
+                    [blob.name] + self.derivatives.pop(stem, []))
+
+        return deleted
+
+    def _walk(self, path):
+        # yield every file name below a storage directory
+        try:
+            dirs, files = self.storage.listdir(path)
+        except FileNotFoundError:
+            return
+        for file in files:
+            yield os.path.join(path, file)
+        for directory in dirs:
+            directory = os.path.join(path, directory)
+            if directory != DERIVATIVE_DIR:
+                yield from self._walk(directory)
+
+    def _sweep(self):
+        # delete files on disk that no recipe row refers to
+        recipes = Recipe.objects.exclude(image='').exclude(image__isnull=True)
+        images = set(recipes.values_list('image', flat=True).iterator())
+        rendered = set()
+        for derivatives in recipes.values_list(
+                'image_derivatives', flat=True).iterator():
+            rendered |= derivative_names(derivatives)
+        stems = {os.path.splitext(os.path.basename(n))[0] for n in images}
+
+        orphans = [
+            name for name in self._walk(UPLOAD_DIR)
+            if name not in images and not self._is_recent(name)
+        ]
+        if not self.dry_run:
+            ImageBlob.objects.filter(name__in=orphans).delete()
+        orphans += [
+            name
+            for stem, names in self.derivatives.items()
+            for name in names
+            # derivatives of a queued image are recorded once processed
+            if stem not in stems and name not in rendered and
+            not self._is_recent(name)
+        ]
+
+        return self._delete(orphans)
@@ -0,0 +1,72 @@
+"""
+Django command to import recipes for a user from an NDJSON file
+"""
+import json
+import os
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import (BaseCommand, CommandError)
+
+from recipe.importer import RecipeImporter
+
+
+class Command(BaseCommand):
+    help = 'Import recipes from an NDJSON file, one recipe per line.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='NDJSON file, or - for stdin.')
+        parser.add_argument(
+            '--email', required=True,
+            help='Email of the user the recipes belong to.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=None,
+            help='Recipes written per transaction.',
+        )
+        parser.add_argument(
+            '--checkpoint-file',
+            help='File recording the last committed line; an existing '
+                 'checkpoint resumes the import after that line.',
+        )
+
+    def handle(self, *args, **options):
+        # entry point for command
+        try:
+            user = get_user_model().objects.get(email=options['email'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f'No user with email {options["email"]}')
+
+        checkpoint_file = options['checkpoint_file']
+        resume_from = 0
+        if checkpoint_file and os.path.exists(checkpoint_file):
+            with open(checkpoint_file) as file:
+                resume_from = int(file.read().strip() or 0)
+            self.stdout.write(f'Resuming after line {resume_from}...')
+
+        def save_checkpoint(line_number):
+            self.stdout.write(f'Committed through line {line_number}')
+            if checkpoint_file:
+                # replace the file in one step so a crash never truncates it
+                with open(f'{checkpoint_file}.tmp', 'w') as file:
+                    file.write(str(line_number))
+                os.replace(f'{checkpoint_file}.tmp', checkpoint_file)
+
+        importer = RecipeImporter(
+            user,
+            batch_size=options['batch_size'],
+            resume_from=resume_from,
+            on_checkpoint=save_checkpoint,
+        )
+        if options['path'] == '-':
+            report = importer.run(sys.stdin.buffer)
+        else:
+            with open(options['path'], 'rb') as file:
+                report = importer.run(file)
+
+        for failure in report['failures']:
+            self.stderr.write(json.dumps(failure))
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {report["imported"]} recipes, '
+            f'{report["failed"]} failed'
+        ))
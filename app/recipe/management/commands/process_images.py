@@ -0,0 +1,55 @@
+"""
+Django command to render derivatives for uploaded recipe images
+"""
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from recipe.images import (claim_pending, process_recipes)
+
+
+class Command(BaseCommand):
+    help = 'Process queued recipe images in a pool of worker processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Number of worker processes.',
+        )
+        parser.add_argument(
+            '--interval', type=float, default=2,
+            help='Seconds to wait when the queue is empty.',
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Exit once the queue is empty.',
+        )
+
+    def handle(self, *args, **options):
+        # entry point for command
+        workers = max(1, options['workers'])
+        # keep the batch a little larger than the pool so it never idles
+        batch_size = workers * 2
+        # forked workers must not share the parent's database connections
+        connections.close_all()
+        self.stdout.write(f'Processing images with {workers} workers...')
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            while True:
+                recipes = claim_pending(batch_size)
+                if not recipes:
+                    if options['once']:
+                        break
+                    time.sleep(options['interval'])
+                    continue
+
+                ready, failed = process_recipes(executor, recipes)
+                for recipe in failed:
+                    self.stderr.write(
+                        f'Could not process image for recipe {recipe.id}')
+                self.stdout.write(
+                    f'Processed {len(ready)} images, {len(failed)} failed')
+
+        self.stdout.write(self.style.SUCCESS('Image queue empty'))
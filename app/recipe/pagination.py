@@ -0,0 +1,40 @@
+"""
+pagination for recipe APIs
+"""
+
+from rest_framework.pagination import CursorPagination
+
+
+class OptionalCursorPagination(CursorPagination):
+    # keyset pagination, only used when the client asks for a page
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # return the full list unless a cursor or page size is given
+        params = request.query_params
+        if (self.cursor_query_param not in params and
+                self.page_size_query_param not in params):
+            return None
+
+        return super().paginate_queryset(queryset, request, view)
+
+
+class RecipeCursorPagination(OptionalCursorPagination):
+    # seek recipes by descending id, or search results by descending rank
+    ordering = '-id'
+    search_ordering = ('-rank', '-id')
+
+    def get_ordering(self, request, queryset, view):
+        # paging by id alone would drop the search ranking; rank ties are
+        # paged by id through the cursor offset
+        if 'rank' in queryset.query.annotations:
+            return self.search_ordering
+
+        return super().get_ordering(request, queryset, view)
+
+
+class RecipeAttrCursorPagination(OptionalCursorPagination):
+    # seek tags and ingredients by descending name
+    ordering = '-name'
@@ -0,0 +1,36 @@
+"""
+replica reads for the recipe APIs
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.permissions import SAFE_METHODS
+
+from core.routers import (read_scope, use_replica)
+
+
+def wrote_recently(user):
+    # true while a replica may not have the user's last write yet
+    if not user.is_authenticated:
+        return False
+    if user.data_updated_at is None:
+        return False
+
+    window = timedelta(seconds=settings.REPLICA_STICKY_SECONDS)
+    return timezone.now() - user.data_updated_at < window
+
+
+class ReplicaReadMixin:
+    # serve safe requests from a replica unless the user just wrote
+
+    def dispatch(self, request, *args, **kwargs):
+        with read_scope():
+            return super().dispatch(request, *args, **kwargs)
+
+    def initial(self, request, *args, **kwargs):
+        # authentication and conditional checks still read the primary
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS and not wrote_recently(
+                request.user):
+            use_replica()
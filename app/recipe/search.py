@@ -0,0 +1,119 @@
+"""
+full text search for recipes
+"""
+
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+)
+from django.db import (connections, router)
+from django.db.models import (
+    Case,
+    F,
+    FloatField,
+    IntegerField,
+    Q,
+    Value,
+    When,
+)
+from django.db.models.functions import Cast
+from django.db.models import prefetch_related_objects
+
+from core.models import Recipe
+
+
+SEARCH_CONFIG = 'english'
+MAX_SEARCH_TERMS = 10
+# recipes loaded and written at a time when a tag or ingredient changes
+REINDEX_BATCH_SIZE = 500
+# recipe fields that feed the search data, with the tags and ingredients
+SEARCH_SOURCE_FIELDS = ('title', 'description')
+
+
+def _uses_postgres(using):
+    # check if the database can store and query tsvectors
+    return connections[using].vendor == 'postgresql'
+
+
+def search_fields(recipe, using=None):
+    # return the stored search data for a recipe with its relations loaded
+    using = using or router.db_for_write(Recipe, instance=recipe)
+    names = ' '.join(
+        [tag.name for tag in recipe.tags.all()] +
+        [ingredient.name for ingredient in recipe.ingredients.all()]
+    )
+    fields = {
+        'search_document': ' '.join(
+            [recipe.title, names, recipe.description]).lower(),
+    }
+    if _uses_postgres(using):
+        fields['search_vector'] = (
+            SearchVector(
+                Value(recipe.title), weight='A', config=SEARCH_CONFIG) +
+            SearchVector(Value(names), weight='B', config=SEARCH_CONFIG) +
+            SearchVector(
+                Value(recipe.description), weight='C', config=SEARCH_CONFIG)
+        )
+
+    return fields
+
+
+def update_search_index(recipes):
+    # recompute the stored search data for the given recipes
+    recipes = list(recipes)
+    if not recipes:
+        return
+
+    using = router.db_for_write(Recipe, instance=recipes[0])
+    prefetch_related_objects(recipes, 'tags', 'ingredients')
+    fields = set()
+    for recipe in recipes:
+        for attr, value in search_fields(recipe, using).items():
+            setattr(recipe, attr, value)
+            fields.add(attr)
+
+    Recipe.objects.using(using).bulk_update(recipes, sorted(fields))
+
+
+def reindex_recipes(queryset):
+    # update_search_index for many recipes, a bounded batch at a time
+    queryset = queryset.only('id', *SEARCH_SOURCE_FIELDS).order_by('id')
+    last_id = 0
+    while True:
+        recipes = list(
+            queryset.filter(id__gt=last_id)[:REINDEX_BATCH_SIZE])
+        update_search_index(recipes)
+        if len(recipes) < REINDEX_BATCH_SIZE:
+            break
+        last_id = recipes[-1].id
+
+
+def search_recipes(queryset, query):
+    # filter a recipe queryset by a search query, best matches first
+    if _uses_postgres(queryset.db):
+        search_query = SearchQuery(
+            query, config=SEARCH_CONFIG, search_type='websearch')
+        # double precision, so the rank survives the round trip through
+        # a pagination cursor
+        return queryset.filter(search_vector=search_query).annotate(
+            rank=Cast(
+                SearchRank(F('search_vector'), search_query), FloatField()),
+        ).order_by('-rank', '-id')
+
+    # fallback for other databases: match every term in the stored
+    # document and rank title matches above the rest
+    terms = query.lower().split()[:MAX_SEARCH_TERMS]
+    if not terms:
+        return queryset.none()
+
+    rank = Value(0)
+    for term in terms:
+        queryset = queryset.filter(search_document__contains=term)
+        rank = rank + Case(
+            When(Q(title__icontains=term), then=Value(2)),
+            default=Value(1),
+            output_field=IntegerField(),
+        )
+
+    return queryset.annotate(rank=rank).order_by('-rank', '-id')
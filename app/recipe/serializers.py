@@ -2,12 +2,37 @@
 serializers for recipe APIs
 """
 
-from rest_framework import serializers
+from django.core.files.storage import default_storage
+from django.db import (connections, transaction)
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import (serializers, status)
 
-from core.models import (Recipe, Tag, Ingredient)
+from core.models import (ImageBlob, Recipe, Tag, Ingredient)
+from recipe.images import derivative_for_size
+from recipe.search import (SEARCH_SOURCE_FIELDS, update_search_index)
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class RecipeAttrSerializer(serializers.ModelSerializer):
+    # base serializer for recipe attributes
+
+    def validate_name(self, value):
+        # names are unique per user, so a rename can not take an existing one
+        if self.instance is not None:
+            exists = self.Meta.model.objects.filter(
+                user=self.instance.user,
+                name=value,
+            ).exclude(id=self.instance.id).exists()
+            if exists:
+                name = self.Meta.model.__name__
+                raise serializers.ValidationError(
+                    f'{name} with this name already exists.'
+                )
+
+        return value
+
+
+class IngredientSerializer(RecipeAttrSerializer):
     # serializer for ingredients
 
     class Meta:
@@ -15,7 +40,7 @@ class IngredientSerializer(serializers.ModelSerializer):
         fields = ['id', 'name']
         read_only_fields = ['id']
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(RecipeAttrSerializer):
     # serializer for tags
 
     class Meta:
@@ -28,32 +53,81 @@ class RecipeSerializer(serializers.ModelSerializer):
     # serializer for recipes
     ingredients = IngredientSerializer(many=True, required=False)
     tags = TagSerializer(many=True, required=False)
+    thumbnail = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
-        fields = ['id', 'title', 'time_minutes', 'price', 'link', 'tags', 'ingredients']
+        fields = [
+            'id', 'title', 'time_minutes', 'price', 'link', 'tags',
+            'ingredients', 'thumbnail',
+        ]
         read_only_fields = ['id']
 
-    def _get_or_create_tags(self, tags, recipe):
-        # handle getting or creating tags
+    def _media_url(self, name):
+        # return an absolute url for a stored file, like ImageField does
+        url = default_storage.url(name)
+        request = self.context.get('request')
+        if request is not None:
+            url = request.build_absolute_uri(url)
+
+        return url
+
+    def get_thumbnail(self, obj):
+        # return the thumbnail url once the image is processed
+        if obj.image_status != Recipe.ImageStatus.READY:
+            return None
+
+        name = derivative_for_size(obj.image_derivatives, 'thumbnail')
+        return self._media_url(name) if name else None
+
+    def _get_or_create_attrs(self, model, items):
+        # fetch existing tags or ingredients by name and bulk insert the rest
         auth_user = self.context['request'].user
-        for tag in tags:
-            tag_obj, created = Tag.objects.get_or_create(
-                user=auth_user,
-                **tag
+        names = list(dict.fromkeys(item['name'] for item in items))
+        if not names:
+            return []
+
+        objs = {
+            obj.name: obj
+            for obj in model.objects.filter(user=auth_user, name__in=names)
+        }
+        missing = [name for name in names if name not in objs]
+        if missing:
+            # concurrent requests may insert the same names, so let the
+            # unique constraint decide and read back whatever won
+            model.objects.bulk_create(
+                [model(user=auth_user, name=name) for name in missing],
+                ignore_conflicts=True,
             )
-            recipe.tags.add(tag_obj)
+            created = model.objects.filter(user=auth_user, name__in=missing)
+            objs.update((obj.name, obj) for obj in created)
+
+        return [objs[name] for name in names]
+
+    def _get_or_create_tags(self, tags, recipe):
+        # handle getting or creating tags
+        recipe.tags.add(*self._get_or_create_attrs(Tag, tags))
 
     def _get_or_create_ingredients(self, ingredients, recipe):
         # handle getting or creating ingredients
-        auth_user = self.context['request'].user
-        for ingredient in ingredients:
-            ingredient_obj, created = Ingredient.objects.get_or_create(
-                user=auth_user,
-                **ingredient
-            )
-            recipe.ingredients.add(ingredient_obj)  
+        recipe.ingredients.add(
+            *self._get_or_create_attrs(Ingredient, ingredients)
+        )
+
+    def _set_attrs(self, manager, model, items):
+        # sync a recipe relation, only inserting and deleting changed rows;
+        # return whether it changed
+        wanted = {obj.id for obj in self._get_or_create_attrs(model, items)}
+        current = {obj.id for obj in manager.all()}
+        # remove() and add() drop the prefetch cache even when empty
+        if current - wanted:
+            manager.remove(*(current - wanted))
+        if wanted - current:
+            manager.add(*(wanted - current))
+
+        return wanted != current
 
+    @transaction.atomic
     def create(self, validated_data):
         # create a recipe
         tags = validated_data.pop('tags', [])
@@ -61,36 +135,59 @@ class RecipeSerializer(serializers.ModelSerializer):
         recipe = Recipe.objects.create(**validated_data)
         self._get_or_create_tags(tags, recipe)
         self._get_or_create_ingredients(ingredients, recipe)
+        update_search_index([recipe])
 
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        # update recipe
+        # update recipe, reindexing it only when its search data changed
         tags = validated_data.pop('tags', None)
         ingredients = validated_data.pop('ingredients', None)
+        reindex = any(
+            getattr(instance, field) != validated_data[field]
+            for field in SEARCH_SOURCE_FIELDS if field in validated_data
+        )
         if tags is not None:
-            instance.tags.clear()
-            self._get_or_create_tags(tags, instance)
+            reindex |= self._set_attrs(instance.tags, Tag, tags)
 
         if ingredients is not None:
-            instance.ingredients.clear()
-            self._get_or_create_ingredients(ingredients, instance)
+            reindex |= self._set_attrs(
+                instance.ingredients, Ingredient, ingredients)
 
         for attr, value in validated_data.items():
             setattr(instance, attr, value)
 
-
-        
         instance.save()
+        if reindex:
+            update_search_index([instance])
         return instance
 
 
-
 class RecipeDetailSerializer(RecipeSerializer):
     # recipe detail serializer based on recipe serializer
+    image_srcset = serializers.SerializerMethodField()
 
     class Meta(RecipeSerializer.Meta):
-        fields = RecipeSerializer.Meta.fields + ['description', 'image']
+        fields = RecipeSerializer.Meta.fields + [
+            'description', 'image', 'image_status', 'image_srcset',
+        ]
+        # images are only set through the upload endpoint
+        read_only_fields = RecipeSerializer.Meta.read_only_fields + ['image']
+
+    def get_image_srcset(self, obj):
+        # return a srcset string per format once the image is processed
+        if obj.image_status != Recipe.ImageStatus.READY:
+            return {}
+
+        return {
+            key: ', '.join(
+                f'{self._media_url(name)} {width}w'
+                for width, name in sorted(
+                    renditions.items(), key=lambda item: int(item[0]))
+            )
+            for key, renditions in obj.image_derivatives.items()
+        }
 
 
 class RecipeImageSerializer(serializers.ModelSerializer):
@@ -98,9 +195,253 @@ class RecipeImageSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Recipe
-        fields = ['id', 'image']
+        fields = ['id', 'image', 'image_status']
         read_only_fields = ['id']
         extra_kwargs = {'image': {'required': 'True'}}
 
+    @transaction.atomic
+    def update(self, instance, validated_data):
+        # store the upload as is and queue it for the process_images command
+        previous = instance.image.name
+        if instance.image_status == Recipe.ImageStatus.READY:
+            processed = {previous: instance.image_derivatives}
+        else:
+            processed = {}
+        instance.image_status = Recipe.ImageStatus.PENDING
+        instance.image_derivatives = {}
+        instance = super().update(instance, validated_data)
+
+        name = instance.image.name
+        if name != previous:
+            ImageBlob.objects.retain(name)
+            # gc_images may have deleted a shared file before retain
+            # locked its blob
+            instance.image.storage.restore(name, validated_data['image'])
+            if previous:
+                ImageBlob.objects.release(previous)
+            # identical bytes may already be processed for another recipe
+            processed[name] = Recipe.objects.filter(
+                image=name, image_status=Recipe.ImageStatus.READY,
+            ).values_list('image_derivatives', flat=True).first()
+
+        if processed.get(name):
+            instance.image_status = Recipe.ImageStatus.READY
+            instance.image_derivatives = processed[name]
+            Recipe.objects.filter(id=instance.id).update(
+                image_status=instance.image_status,
+                image_derivatives=instance.image_derivatives,
+            )
+
+        return instance
+
+
+class RecipeBatchSerializer(serializers.Serializer):
+    # serializer for applying many recipe operations in one request
+    MAX_OPERATIONS = 100
+
+    operations = serializers.ListField(
+        child=serializers.DictField(),
+        allow_empty=False,
+        max_length=MAX_OPERATIONS,
+    )
+    atomic = serializers.BooleanField(default=True)
+
+    def _parse_id(self, operation):
+        # return the recipe id of an operation, or None if it is invalid
+        try:
+            return int(operation.get('id'))
+        except (TypeError, ValueError):
+            return None
+
+    def _validate_operation(self, operation, recipes, seen):
+        # validate a single operation against the user's recipes
+        op = operation.get('op')
+        if op not in ('create', 'update', 'delete'):
+            return {'op': op, 'status': status.HTTP_400_BAD_REQUEST,
+                    'errors': {'op': ['Must be create, update or delete.']}}
+
+        recipe = None
+        if op != 'create':
+            recipe_id = self._parse_id(operation)
+            if recipe_id is None:
+                return {'op': op, 'status': status.HTTP_400_BAD_REQUEST,
+                        'errors': {'id': ['A valid integer is required.']}}
+            if recipe_id in seen:
+                return {'op': op, 'id': recipe_id,
+                        'status': status.HTTP_400_BAD_REQUEST,
+                        'errors': {'id': ['Recipe appears more than once.']}}
+            seen.add(recipe_id)
+            recipe = recipes.get(recipe_id)
+            if recipe is None:
+                return {'op': op, 'id': recipe_id,
+                        'status': status.HTTP_404_NOT_FOUND,
+                        'errors': {'id': ['Not found.']}}
+
+        if op == 'delete':
+            return {'op': op, 'id': recipe.id,
+                    'status': status.HTTP_204_NO_CONTENT}
+
+        serializer = RecipeDetailSerializer(
+            recipe,
+            data=operation.get('data', {}),
+            partial=op == 'update',
+            context=self.context,
+        )
+        if not serializer.is_valid():
+            return {'op': op, 'id': recipe and recipe.id,
+                    'status': status.HTTP_400_BAD_REQUEST,
+                    'errors': serializer.errors}
+
+        return {'op': op, 'id': recipe and recipe.id, 'recipe': recipe,
+                'serializer': serializer,
+                'status': (status.HTTP_201_CREATED if op == 'create'
+                           else status.HTTP_200_OK)}
+
+    def validate(self, attrs):
+        # validate every operation in one pass, keeping per item results
+        auth_user = self.context['request'].user
+        recipe_ids = [
+            self._parse_id(operation) for operation in attrs['operations']
+            if operation.get('op') in ('update', 'delete')
+        ]
+        recipes = Recipe.objects.filter(
+            user=auth_user,
+        ).prefetch_related('tags', 'ingredients').in_bulk(
+            [recipe_id for recipe_id in recipe_ids if recipe_id is not None]
+        )
+
+        seen = set()
+        attrs['operations'] = [
+            self._validate_operation(operation, recipes, seen)
+            for operation in attrs['operations']
+        ]
+        return attrs
+
+    def _resolve_attrs(self, model, field_name, items):
+        # get or create every tag or ingredient named in the batch at once
+        names = [
+            attr['name']
+            for item in items
+            for attr in item['serializer'].validated_data.get(field_name, [])
+        ]
+        objs = items[0]['serializer']._get_or_create_attrs(
+            model, [{'name': name} for name in names])
+
+        return {obj.name: obj for obj in objs}
+
+    def _sync_relation(self, field_name, model, items):
+        # write the through table rows for every recipe in the batch
+        items = [
+            item for item in items
+            if field_name in item['serializer'].validated_data
+        ]
+        if not items:
+            return
+
+        objs = self._resolve_attrs(model, field_name, items)
+        through = getattr(Recipe, field_name).through
+        fk_name = f'{model.__name__.lower()}_id'
+        stale = Q()
+        rows = []
+        for item in items:
+            recipe = item['recipe']
+            wanted = {
+                objs[attr['name']].id
+                for attr in item['serializer'].validated_data[field_name]
+            }
+            current = set()
+            if item['op'] == 'update':
+                current = {
+                    obj.id for obj in getattr(recipe, field_name).all()
+                }
+            if current - wanted:
+                stale |= Q(recipe_id=recipe.id,
+                           **{f'{fk_name}__in': current - wanted})
+            rows.extend(
+                through(recipe_id=recipe.id, **{fk_name: obj_id})
+                for obj_id in wanted - current
+            )
+
+        if stale:
+            through.objects.filter(stale).delete()
+        through.objects.bulk_create(rows, ignore_conflicts=True)
+        for item in items:
+            # the prefetched relation loaded during validation is stale now
+            getattr(item['recipe'], '_prefetched_objects_cache', {}).pop(
+                field_name, None)
+
+    def _create_recipes(self, items):
+        # insert new recipes, batched where the database returns ids
+        auth_user = self.context['request'].user
+        for item in items:
+            data = dict(item['serializer'].validated_data)
+            data.pop('tags', None)
+            data.pop('ingredients', None)
+            item['recipe'] = Recipe(user=auth_user, **data)
+
+        recipes = [item['recipe'] for item in items]
+        connection = connections[Recipe.objects.db]
+        if connection.features.can_return_rows_from_bulk_insert:
+            Recipe.objects.bulk_create(recipes)
+        else:
+            for recipe in recipes:
+                recipe.save()
+
+        for item in items:
+            item['id'] = item['recipe'].id
+
+    def _update_recipes(self, items):
+        # write changed recipe fields with a single bulk update
+        fields = set()
+        for item in items:
+            for attr, value in item['serializer'].validated_data.items():
+                if attr not in ('tags', 'ingredients'):
+                    setattr(item['recipe'], attr, value)
+                    fields.add(attr)
+
+        if fields:
+            # bulk_update does not apply auto_now
+            now = timezone.now()
+            for item in items:
+                item['recipe'].updated_at = now
+            Recipe.objects.bulk_update(
+                [item['recipe'] for item in items],
+                sorted(fields | {'updated_at'}),
+            )
+
+    def create(self, validated_data):
+        # apply the valid operations in a single transaction
+        operations = validated_data['operations']
+        if validated_data['atomic'] and any(
+                'errors' in item for item in operations):
+            for item in operations:
+                if 'errors' not in item:
+                    item['status'] = status.HTTP_424_FAILED_DEPENDENCY
+        else:
+            valid = [item for item in operations if 'errors' not in item]
+            creates = [item for item in valid if item['op'] == 'create']
+            updates = [item for item in valid if item['op'] == 'update']
+            deletes = [item for item in valid if item['op'] == 'delete']
 
+            with transaction.atomic():
+                if deletes:
+                    Recipe.objects.filter(
+                        user=self.context['request'].user,
+                        id__in=[item['id'] for item in deletes],
+                    ).delete()
+                if creates:
+                    self._create_recipes(creates)
+                if updates:
+                    self._update_recipes(updates)
+                # bulk writes skip m2m_changed, like the rest of this path
+                self._sync_relation('tags', Tag, creates + updates)
+                self._sync_relation(
+                    'ingredients', Ingredient, creates + updates)
+                update_search_index(
+                    item['recipe'] for item in creates + updates)
 
+        return [
+            {key: item[key] for key in ('op', 'id', 'status', 'errors')
+             if key in item}
+            for item in operations
+        ]
@@ -0,0 +1,32 @@
+"""
+Signal handlers for recipe APIs
+"""
+
+from django.db.models.signals import (m2m_changed, post_delete, post_save)
+from django.dispatch import receiver
+
+from core.models import (ImageBlob, Ingredient, Recipe, Tag)
+from recipe.conditional import data_changed
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    # the image is removed by gc_images once no recipe uses it
+    if instance.image:
+        ImageBlob.objects.release(instance.image.name)
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+@receiver([post_save, post_delete], sender=Tag)
+@receiver([post_save, post_delete], sender=Ingredient)
+def data_saved(sender, instance, **kwargs):
+    # writes from the admin, shell and commands invalidate etags too
+    data_changed(instance.user_id)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def links_changed(sender, instance, action, **kwargs):
+    # instance is the recipe, or the tag or ingredient for reverse access
+    if action.startswith('post_'):
+        data_changed(instance.user_id)
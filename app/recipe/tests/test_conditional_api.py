@@ -0,0 +1,192 @@
+"""
+tests for conditional GET on recipe APIs
+"""
+from datetime import timedelta
+from decimal import Decimal
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.models import (Ingredient, Recipe, Tag)
+
+
+RECIPE_URL = reverse('recipe:recipe-list')
+TAGS_URL = reverse('recipe:tag-list')
+
+
+def detail_url(recipe_id):
+    # create and return a recipe detail url
+    return reverse('recipe:recipe-detail', args=[recipe_id])
+
+
+def tag_detail_url(tag_id):
+    # create and return a tag detail url
+    return reverse('recipe:tag-detail', args=[tag_id])
+
+
+class ConditionalGetApiTests(TestCase):
+    # tests for answering unchanged requests with 304
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='user@example.com', password='test123')
+        token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.recipe = Recipe.objects.create(
+            user=self.user,
+            title='Sample recipe',
+            time_minutes=5,
+            price=Decimal('1.00'),
+        )
+        self.tag = Tag.objects.create(user=self.user, name='Breakfast')
+        self.recipe.tags.add(self.tag)
+
+    def test_list_not_modified_skips_query(self):
+        # test a matching etag returns 304 without any query
+        res = self.client.get(RECIPE_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        etag = res['ETag']
+
+        with self.assertNumQueries(0):
+            res = self.client.get(RECIPE_URL, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(res.content, b'')
+
+    def test_write_changes_etag(self):
+        # test writing a recipe invalidates the previous etag
+        etag = self.client.get(detail_url(self.recipe.id))['ETag']
+
+        self.client.patch(detail_url(self.recipe.id), {'title': 'New'})
+        res = self.client.get(
+            detail_url(self.recipe.id), HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['title'], 'New')
+        self.assertNotEqual(res['ETag'], etag)
+
+    def test_tag_rename_changes_recipe_etag(self):
+        # test renaming a tag invalidates recipe responses that embed it
+        etag = self.client.get(RECIPE_URL)['ETag']
+
+        self.client.patch(tag_detail_url(self.tag.id), {'name': 'Brunch'})
+        res = self.client.get(RECIPE_URL, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data[0]['tags'][0]['name'], 'Brunch')
+
+    def test_if_modified_since(self):
+        # test last modified is honoured once the second of a write passed
+        self.client.patch(detail_url(self.recipe.id), {'title': 'New'})
+        later = timezone.now() + timedelta(seconds=1)
+        with patch('recipe.conditional.timezone.now', return_value=later):
+            last_modified = self.client.get(TAGS_URL)['Last-Modified']
+            res = self.client.get(
+                TAGS_URL, HTTP_IF_MODIFIED_SINCE=last_modified)
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_no_last_modified_within_second_of_write(self):
+        # test a second write in the same second can not be hidden
+        self.client.patch(detail_url(self.recipe.id), {'title': 'New'})
+        self.user.refresh_from_db()
+        now = self.user.data_updated_at
+        with patch('recipe.conditional.timezone.now', return_value=now):
+            res = self.client.get(TAGS_URL)
+            last_modified = http_date(int(now.timestamp()))
+            self.client.patch(detail_url(self.recipe.id), {'title': 'Newer'})
+            stale = self.client.get(
+                RECIPE_URL, HTTP_IF_MODIFIED_SINCE=last_modified)
+
+        self.assertNotIn('Last-Modified', res)
+        self.assertEqual(stale.status_code, status.HTTP_200_OK)
+        self.assertEqual(stale.data[0]['title'], 'Newer')
+
+    def test_failed_write_keeps_etag(self):
+        # test a rejected write does not invalidate cached responses
+        etag = self.client.get(RECIPE_URL)['ETag']
+
+        self.client.patch(detail_url(self.recipe.id), {'time_minutes': 'x'})
+        res = self.client.get(RECIPE_URL, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_etag_is_per_user(self):
+        # test another user's etag does not match
+        etag = self.client.get(RECIPE_URL)['ETag']
+        other = get_user_model().objects.create_user(
+            email='other@example.com', password='test123')
+        client = APIClient()
+        client.force_authenticate(other)
+
+        res = client.get(RECIPE_URL, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+
+class DataVersionSignalTests(TestCase):
+    # tests for bumping the data version outside the API
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='user@example.com', password='test123')
+        self.recipe = Recipe.objects.create(
+            user=self.user,
+            title='Sample recipe',
+            time_minutes=5,
+            price=Decimal('1.00'),
+        )
+
+    def _version(self):
+        self.user.refresh_from_db()
+        return self.user.data_version
+
+    def test_model_saves_and_deletes_bump(self):
+        # test admin or shell edits of each model change the version
+        version = self._version()
+
+        self.recipe.title = 'Changed'
+        self.recipe.save()
+        self.assertEqual(self._version(), version + 1)
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        self.assertEqual(self._version(), version + 2)
+        Ingredient.objects.create(user=self.user, name='Salt').delete()
+        self.assertEqual(self._version(), version + 4)
+        tag.delete()
+        self.assertEqual(self._version(), version + 5)
+
+    def test_relation_changes_bump(self):
+        # test adding and clearing tags from either side changes the version
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        version = self._version()
+
+        self.recipe.tags.add(tag)
+        self.assertEqual(self._version(), version + 1)
+        tag.recipe_set.clear()
+        self.assertEqual(self._version(), version + 2)
+
+    def test_api_write_bumps_once(self):
+        # test the signals of one request are folded into one bump
+        client = APIClient()
+        client.force_authenticate(self.user)
+        version = self._version()
+
+        res = client.post(RECIPE_URL, {
+            'title': 'Soup',
+            'time_minutes': 5,
+            'price': '1.00',
+            'tags': [{'name': 'Dinner'}, {'name': 'Quick'}],
+            'ingredients': [{'name': 'Salt'}],
+        }, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self._version(), version + 1)
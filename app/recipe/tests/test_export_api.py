@@ -0,0 +1,167 @@
+"""
+tests for the recipe export API
+"""
+import csv
+import io
+import json
+import tracemalloc
+from decimal import Decimal
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import (Ingredient, Recipe, Tag)
+
+
+EXPORT_URL = reverse('recipe:recipe-export')
+
+
+def create_user(email='user@example.com', password='test123'):
+    # create and return a sample user
+    return get_user_model().objects.create_user(email=email, password=password)
+
+
+def create_recipes(user, count):
+    # bulk create recipes, each with two tags and one ingredient
+    Recipe.objects.bulk_create([
+        Recipe(
+            user=user,
+            title=f'Recipe {i}',
+            description='A' * 200,
+            time_minutes=i,
+            price=Decimal('1.50'),
+        )
+        for i in range(count)
+    ])
+    recipes = list(Recipe.objects.filter(user=user).order_by('id'))
+    tags = [
+        Tag.objects.get_or_create(user=user, name='Dinner')[0],
+        Tag.objects.get_or_create(user=user, name='Quick')[0],
+    ]
+    salt = Ingredient.objects.get_or_create(user=user, name='Salt')[0]
+    Recipe.tags.through.objects.bulk_create([
+        Recipe.tags.through(recipe_id=recipe.id, tag_id=tag.id)
+        for recipe in recipes for tag in tags
+    ])
+    Recipe.ingredients.through.objects.bulk_create([
+        Recipe.ingredients.through(
+            recipe_id=recipe.id, ingredient_id=salt.id)
+        for recipe in recipes
+    ])
+    return recipes
+
+
+def read(res):
+    # consume a streaming response and return its text
+    return b''.join(res.streaming_content).decode()
+
+
+class PublicExportApiTests(TestCase):
+    # tests for unauthenticated export requests
+
+    def test_auth_required(self):
+        # test auth is required to export
+        res = APIClient().get(EXPORT_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PrivateExportApiTests(TestCase):
+    # tests for exporting recipes
+
+    def setUp(self):
+        self.user = create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_export_ndjson(self):
+        # test every recipe is one JSON line with its names
+        recipes = create_recipes(self.user, 3)
+
+        res = self.client.get(EXPORT_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res.streaming)
+        self.assertEqual(res['Content-Type'], 'application/x-ndjson')
+        self.assertIn('recipes.ndjson', res['Content-Disposition'])
+        lines = [json.loads(line) for line in read(res).splitlines()]
+        self.assertEqual([line['id'] for line in lines],
+                         [recipe.id for recipe in recipes])
+        self.assertEqual(lines[0]['tags'], ['Dinner', 'Quick'])
+        self.assertEqual(lines[0]['ingredients'], ['Salt'])
+        self.assertEqual(lines[0]['price'], '1.50')
+
+    def test_export_csv(self):
+        # test the CSV export has a header and one row per recipe
+        create_recipes(self.user, 2)
+
+        res = self.client.get(EXPORT_URL, {'format': 'csv'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res['Content-Type'].startswith('text/csv'))
+        rows = list(csv.DictReader(io.StringIO(read(res))))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0]['title'], 'Recipe 0')
+        self.assertEqual(rows[0]['tags'], 'Dinner|Quick')
+
+    def test_export_limited_to_user(self):
+        # test other users' recipes are not exported
+        create_recipes(create_user(email='other@example.com'), 2)
+
+        res = self.client.get(EXPORT_URL)
+
+        self.assertEqual(read(res), '')
+
+    def test_export_applies_filters(self):
+        # test the list filters narrow the export
+        recipes = create_recipes(self.user, 2)
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        recipes[1].tags.add(tag)
+
+        res = self.client.get(EXPORT_URL, {'tags': str(tag.id)})
+
+        lines = [json.loads(line) for line in read(res).splitlines()]
+        self.assertEqual([line['id'] for line in lines], [recipes[1].id])
+
+    def test_export_reads_in_chunks(self):
+        # test each chunk costs a fixed number of queries
+        create_recipes(self.user, 5)
+
+        with patch('recipe.export.EXPORT_CHUNK_SIZE', 2):
+            res = self.client.get(EXPORT_URL)
+            # 3 chunks of recipes, tags and ingredients, then an empty read
+            with self.assertNumQueries(10):
+                lines = read(res).splitlines()
+
+        self.assertEqual(len(lines), 5)
+
+    def _peak_memory(self, count):
+        # return peak memory allocated while streaming an export
+        Recipe.objects.filter(user=self.user).delete()
+        create_recipes(self.user, count)
+        with patch('recipe.export.EXPORT_CHUNK_SIZE', 100):
+            res = self.client.get(EXPORT_URL)
+            tracemalloc.start()
+            try:
+                lines = 0
+                for part in res.streaming_content:
+                    lines += part.count(b'\n')
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+
+        self.assertEqual(lines, count)
+        return peak
+
+    def test_export_memory_is_flat(self):
+        # test peak memory does not grow with the number of recipes
+        small = self._peak_memory(300)
+        large = self._peak_memory(3000)
+
+        # ten times the recipes may cost a little more, never ten times more
+        self.assertLess(large, small * 2)
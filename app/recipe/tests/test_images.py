@@ -0,0 +1,493 @@
+"""
+tests for background recipe image processing
+"""
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import patch
+
+from PIL import Image
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import (TestCase, TransactionTestCase, override_settings)
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.models import (ImageBlob, ImageBlobManager, Recipe)
+from core.storage import recipe_image_storage
+from recipe.images import (
+    DERIVATIVE_FORMATS,
+    claim_pending,
+    derivative_for_size,
+    derivative_names,
+    process_recipes,
+    render_derivatives,
+)
+
+
+# EXIF tag for orientation, 6 means the camera was rotated 90 degrees
+ORIENTATION = 0x0112
+
+RECIPE_URL = reverse('recipe:recipe-list')
+
+
+def detail_url(recipe_id):
+    # create and return a recipe detail url
+    return reverse('recipe:recipe-detail', args=[recipe_id])
+
+
+def image_upload_url(recipe_id):
+    # create and return a image upload url
+    return reverse('recipe:recipe-upload-image', args=[recipe_id])
+
+
+def create_user(email='user@example.com', password='test123'):
+    # create and return a sample user
+    return get_user_model().objects.create_user(email=email, password=password)
+
+
+def create_recipe(user, **params):
+    # create and return a sample recipe
+    default = {
+        'title': 'Sample recipe',
+        'time_minutes': 10,
+        'price': Decimal('5.00'),
+    }
+    default.update(params)
+    return Recipe.objects.create(user=user, **default)
+
+
+def image_content(size=(2000, 1000), orientation=None, fmt='JPEG',
+                  color='red'):
+    # return an encoded image, optionally tagged with an EXIF orientation
+    img = Image.new('RGB', size, color)
+    exif = Image.Exif()
+    if orientation is not None:
+        exif[ORIENTATION] = orientation
+    content = ContentFile(b'', name=f'photo.{fmt.lower()}')
+    img.save(content, format=fmt, exif=exif.tobytes())
+    content.seek(0)
+    return content
+
+
+class ImageTestMixin:
+    # run each test against an empty media root
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.user = create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def _queued_recipe(self, content=None):
+        # return a recipe with an uploaded image waiting for processing
+        recipe = create_recipe(self.user)
+        recipe.image.save('photo.jpg', content or image_content())
+        recipe.image_status = Recipe.ImageStatus.PENDING
+        recipe.save()
+        return recipe
+
+    def _upload(self, recipe, content):
+        # upload an image through the API and return the updated recipe
+        res = self.client.post(
+            image_upload_url(recipe.id),
+            {'image': content},
+            format='multipart',
+        )
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        recipe.refresh_from_db()
+        return recipe
+
+    def _process_all(self):
+        # process the queue on threads so the test database is shared
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            return process_recipes(executor, claim_pending(10))
+
+
+class RenderDerivativesTests(ImageTestMixin, TestCase):
+    # tests for rendering derivatives of one image
+
+    def test_renders_each_width(self):
+        # test a JPEG and a WebP are written per configured width
+        recipe = self._queued_recipe()
+
+        derivatives = render_derivatives(self.media_root, recipe.image.name)
+
+        self.assertEqual(set(derivatives), {'jpeg', 'webp'})
+        for key, renditions in derivatives.items():
+            self.assertEqual(
+                sorted(renditions, key=int), ['320', '640', '1280'])
+            for width, name in renditions.items():
+                with Image.open(os.path.join(self.media_root, name)) as img:
+                    self.assertEqual(img.format, key.upper())
+                    self.assertEqual(img.width, int(width))
+                    self.assertEqual(img.height, int(width) // 2)
+
+    def test_names_follow_content(self):
+        # test a re-render with other bytes never reuses a cached name
+        recipe = self._queued_recipe()
+        first = render_derivatives(self.media_root, recipe.image.name)
+        again = render_derivatives(self.media_root, recipe.image.name)
+
+        formats = [
+            (key, fmt, extension, dict(options, quality=50))
+            for key, fmt, extension, options in DERIVATIVE_FORMATS
+        ]
+        with patch('recipe.images.DERIVATIVE_FORMATS', formats):
+            changed = render_derivatives(self.media_root, recipe.image.name)
+
+        self.assertEqual(again, first)
+        self.assertFalse(
+            derivative_names(first) & derivative_names(changed))
+
+    def test_does_not_upscale(self):
+        # test small images are not enlarged
+        recipe = self._queued_recipe(image_content(size=(500, 250)))
+
+        derivatives = render_derivatives(self.media_root, recipe.image.name)
+
+        self.assertEqual(sorted(derivatives['jpeg'], key=int), ['320', '500'])
+        self.assertEqual(
+            derivative_for_size(derivatives, 'large'),
+            derivatives['jpeg']['500'],
+        )
+
+    def test_applies_orientation_and_strips_metadata(self):
+        # test the EXIF orientation is applied and no EXIF is kept
+        recipe = self._queued_recipe(image_content(orientation=6))
+
+        derivatives = render_derivatives(self.media_root, recipe.image.name)
+
+        path = os.path.join(self.media_root, derivatives['jpeg']['320'])
+        with Image.open(path) as img:
+            self.assertEqual(img.size, (320, 640))
+            self.assertEqual(len(img.getexif()), 0)
+            self.assertNotIn('exif', img.info)
+
+    def test_flattens_transparency(self):
+        # test images with alpha are converted for JPEG output
+        content = ContentFile(b'')
+        Image.new('RGBA', (400, 400), (0, 0, 0, 0)).save(content, 'PNG')
+        content.seek(0)
+        recipe = create_recipe(self.user)
+        recipe.image.save('photo.png', content)
+
+        derivatives = render_derivatives(self.media_root, recipe.image.name)
+
+        path = os.path.join(self.media_root, derivatives['jpeg']['320'])
+        with Image.open(path) as img:
+            self.assertEqual(img.mode, 'RGB')
+            self.assertEqual(img.getpixel((0, 0)), (255, 255, 255))
+
+
+class ImagePipelineTests(ImageTestMixin, TestCase):
+    # tests for queueing and recording processed images
+
+    def test_upload_returns_before_processing(self):
+        # test uploads are accepted and queued without derivatives
+        recipe = create_recipe(self.user)
+
+        res = self.client.post(
+            image_upload_url(recipe.id),
+            {'image': image_content()},
+            format='multipart',
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(res.data['image_status'], 'pending')
+        res = self.client.get(detail_url(recipe.id))
+        self.assertEqual(res.data['image_status'], 'pending')
+        self.assertEqual(res.data['image_srcset'], {})
+        self.assertIsNone(res.data['thumbnail'])
+
+    def test_processed_image_exposes_srcset(self):
+        # test detail responses list every rendition once processed
+        recipe = self._queued_recipe()
+
+        ready, failed = self._process_all()
+
+        self.assertEqual((len(ready), failed), (1, []))
+        recipe.refresh_from_db()
+        res = self.client.get(detail_url(recipe.id))
+        self.assertEqual(res.data['image_status'], 'ready')
+        self.assertEqual(set(res.data['image_srcset']), {'jpeg', 'webp'})
+        expected = ', '.join(
+            f'http://testserver/static/media/{name} {width}w'
+            for width, name in (
+                ('320', recipe.image_derivatives['webp']['320']),
+                ('640', recipe.image_derivatives['webp']['640']),
+                ('1280', recipe.image_derivatives['webp']['1280']),
+            )
+        )
+        self.assertEqual(res.data['image_srcset']['webp'], expected)
+
+    def test_list_includes_thumbnail(self):
+        # test list responses link the smallest JPEG rendition
+        recipe = self._queued_recipe()
+        create_recipe(self.user)
+        self._process_all()
+
+        res = self.client.get(RECIPE_URL)
+
+        recipe.refresh_from_db()
+        thumbnails = {item['id']: item['thumbnail'] for item in res.data}
+        self.assertEqual(
+            thumbnails[recipe.id],
+            'http://testserver/static/media/' +
+            recipe.image_derivatives['jpeg']['320'],
+        )
+        self.assertEqual(list(thumbnails.values()).count(None), 1)
+
+    def test_processing_changes_etag(self):
+        # test clients holding an etag see the processed image
+        token = Token.objects.create(user=self.user)
+        self.client.force_authenticate(None)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        recipe = self._queued_recipe()
+        etag = self.client.get(detail_url(recipe.id))['ETag']
+
+        self._process_all()
+
+        res = self.client.get(detail_url(recipe.id), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_claimed_recipes_are_not_claimed_twice(self):
+        # test a recipe being processed is left to its worker
+        self._queued_recipe()
+
+        self.assertEqual(len(claim_pending(10)), 1)
+        self.assertEqual(claim_pending(10), [])
+
+    def test_stale_claims_are_retried(self):
+        # test recipes left in processing by a lost worker are claimed again
+        recipe = self._queued_recipe()
+        claim_pending(10)
+        Recipe.objects.filter(id=recipe.id).update(
+            updated_at=timezone.now() - timedelta(hours=1))
+
+        self.assertEqual([r.id for r in claim_pending(10)], [recipe.id])
+
+    def test_replaced_image_is_not_overwritten(self):
+        # test results for an image replaced during processing are dropped
+        recipe = self._queued_recipe()
+        claimed = claim_pending(10)
+        recipe.image.save('other.jpg', image_content(color='blue'))
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            ready, failed = process_recipes(executor, claimed)
+
+        recipe.refresh_from_db()
+        self.assertEqual((ready, failed), ([], []))
+        self.assertEqual(recipe.image_derivatives, {})
+
+    def test_reupload_clears_derivatives(self):
+        # test a new image is not shown with the old image's derivatives
+        recipe = self._queued_recipe()
+        self._process_all()
+
+        self.client.post(
+            image_upload_url(recipe.id),
+            {'image': image_content(color='blue')},
+            format='multipart',
+        )
+
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.image_status, 'pending')
+        self.assertEqual(recipe.image_derivatives, {})
+
+    def test_unreadable_image_fails(self):
+        # test images that can not be decoded are marked as failed
+        recipe = self._queued_recipe(ContentFile(b'not an image'))
+
+        ready, failed = self._process_all()
+
+        recipe.refresh_from_db()
+        self.assertEqual((ready, [r.id for r in failed]), ([], [recipe.id]))
+        self.assertEqual(recipe.image_status, 'failed')
+
+
+class ProcessImagesCommandTests(ImageTestMixin, TransactionTestCase):
+    # tests for the process_images command
+
+    def test_process_images_once(self):
+        # test the command drains the queue with worker processes
+        recipe = self._queued_recipe()
+
+        call_command('process_images', '--once', '--workers', '1')
+
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.image_status, 'ready')
+        for name in derivative_names(recipe.image_derivatives):
+            self.assertTrue(
+                os.path.exists(os.path.join(self.media_root, name)))
+
+
+class ImageStorageTests(ImageTestMixin, TestCase):
+    # tests for sharing and counting stored images
+
+    def test_same_photo_is_stored_once(self):
+        # test uploading identical bytes to two recipes shares one blob
+        first = self._upload(create_recipe(self.user), image_content())
+        second = self._upload(create_recipe(self.user), image_content())
+
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(
+            ImageBlob.objects.get(name=first.image.name).references, 2)
+        upload_dir = os.path.dirname(first.image.path)
+        self.assertEqual(len(os.listdir(upload_dir)), 1)
+
+    def test_processed_blob_is_reused(self):
+        # test a shared blob that is already processed is ready right away
+        first = self._upload(create_recipe(self.user), image_content())
+        self._process_all()
+        first.refresh_from_db()
+
+        second = self._upload(create_recipe(self.user), image_content())
+
+        self.assertEqual(second.image_status, 'ready')
+        self.assertEqual(second.image_derivatives, first.image_derivatives)
+
+    def test_replacing_image_releases_blob(self):
+        # test the old blob loses a reference when the image is replaced
+        recipe = self._upload(create_recipe(self.user), image_content())
+        old = recipe.image.name
+
+        recipe = self._upload(recipe, image_content(color='blue'))
+
+        self.assertEqual(ImageBlob.objects.get(name=old).references, 0)
+        self.assertEqual(
+            ImageBlob.objects.get(name=recipe.image.name).references, 1)
+
+    def test_deleting_recipe_releases_blob(self):
+        # test deleting a recipe drops its reference
+        recipe = self._upload(create_recipe(self.user), image_content())
+
+        self.client.delete(detail_url(recipe.id))
+
+        self.assertEqual(
+            ImageBlob.objects.get(name=recipe.image.name).references, 0)
+
+    def test_upload_restores_blob_collected_before_retain(self):
+        # test a shared file gc_images deletes between the upload and
+        # retain is written back once the upload holds the blob row
+        recipe = self._upload(create_recipe(self.user), image_content())
+        self.client.delete(detail_url(recipe.id))
+        retain = ImageBlobManager.retain
+
+        def collect_then_retain(manager, name):
+            ImageBlob.objects.filter(name=name).delete()
+            recipe_image_storage.delete(name)
+            retain(manager, name)
+
+        with patch.object(ImageBlobManager, 'retain', collect_then_retain):
+            second = self._upload(create_recipe(self.user), image_content())
+
+        self.assertEqual(second.image.name, recipe.image.name)
+        self.assertTrue(os.path.exists(second.image.path))
+        self.assertEqual(ImageBlob.objects.get().references, 1)
+
+
+class GcImagesCommandTests(ImageTestMixin, TestCase):
+    # tests for the gc_images command
+
+    def _gc(self, *args):
+        out = StringIO()
+        call_command('gc_images', *args, stdout=out)
+        return out.getvalue()
+
+    def _files(self):
+        # return every file below the media root
+        return {
+            os.path.relpath(os.path.join(root, file), self.media_root)
+            for root, _, files in os.walk(self.media_root)
+            for file in files
+        }
+
+    def test_gc_removes_unreferenced_blob_and_derivatives(self):
+        # test a replaced image and its derivatives are deleted
+        recipe = self._upload(create_recipe(self.user), image_content())
+        self._process_all()
+        self._upload(recipe, image_content(color='blue'))
+        recipe.refresh_from_db()
+        old = ImageBlob.objects.get(references=0).name
+
+        self._gc('--grace', '0')
+
+        self.assertEqual(self._files(), {recipe.image.name})
+        self.assertFalse(ImageBlob.objects.filter(name=old).exists())
+
+    def test_gc_keeps_shared_blob(self):
+        # test a blob still used by another recipe is kept
+        first = self._upload(create_recipe(self.user), image_content())
+        self._upload(create_recipe(self.user), image_content())
+
+        self.client.delete(detail_url(first.id))
+        self._gc('--grace', '0')
+
+        self.assertEqual(self._files(), {first.image.name})
+
+    def test_gc_waits_for_grace_period(self):
+        # test recently released blobs are kept
+        recipe = self._upload(create_recipe(self.user), image_content())
+        self.client.delete(detail_url(recipe.id))
+
+        self._gc()
+
+        self.assertEqual(self._files(), {recipe.image.name})
+
+    def test_gc_fixes_drifted_counts(self):
+        # test a zero count is corrected when a recipe still uses the blob
+        recipe = self._upload(create_recipe(self.user), image_content())
+        ImageBlob.objects.update(references=0)
+
+        self._gc('--grace', '0')
+
+        self.assertEqual(self._files(), {recipe.image.name})
+        self.assertEqual(ImageBlob.objects.get().references, 1)
+
+    def test_gc_dry_run(self):
+        # test a dry run lists files without deleting them
+        recipe = self._upload(create_recipe(self.user), image_content())
+        self.client.delete(detail_url(recipe.id))
+
+        out = self._gc('--grace', '0', '--dry-run')
+
+        self.assertIn(recipe.image.name, out)
+        self.assertEqual(self._files(), {recipe.image.name})
+        self.assertTrue(ImageBlob.objects.exists())
+
+    def test_gc_sweep_removes_untracked_files(self):
+        # test files without a blob or recipe are found by a sweep
+        recipe = self._upload(create_recipe(self.user), image_content())
+        self._process_all()
+        stray = create_recipe(self.user)
+        stray.image.save('stray.jpg', image_content(color='green'))
+        render_derivatives(self.media_root, stray.image.name)
+        Recipe.objects.filter(id=stray.id).delete()
+        recipe.refresh_from_db()
+
+        self._gc('--grace', '0')
+        self.assertIn(stray.image.name, self._files())
+
+        self._gc('--grace', '0', '--sweep')
+
+        self.assertEqual(
+            self._files(),
+            {recipe.image.name} | derivative_names(recipe.image_derivatives),
+        )
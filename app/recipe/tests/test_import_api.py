@@ -0,0 +1,258 @@
+"""
+tests for importing recipes from NDJSON
+"""
+import json
+import os
+import tempfile
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import (DatabaseError, connection)
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import (Ingredient, Recipe, Tag)
+from recipe.importer import RecipeImporter
+
+
+IMPORT_URL = reverse('recipe:recipe-import-recipes')
+
+
+def create_user(email='user@example.com', password='test123'):
+    # create and return a sample user
+    return get_user_model().objects.create_user(email=email, password=password)
+
+
+def recipe_line(title='Imported', **params):
+    # return one NDJSON line for a recipe
+    record = {
+        'title': title,
+        'time_minutes': 10,
+        'price': '2.50',
+        'tags': [{'name': 'Dinner'}],
+        'ingredients': [{'name': 'Salt'}, {'name': 'Pepper'}],
+    }
+    record.update(params)
+    return json.dumps(record) + '\n'
+
+
+class PublicImportApiTests(TestCase):
+    # tests for unauthenticated import requests
+
+    def test_auth_required(self):
+        # test auth is required to import
+        res = APIClient().post(
+            IMPORT_URL, recipe_line(), content_type='application/x-ndjson')
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PrivateImportApiTests(TestCase):
+    # tests for importing recipes
+
+    def setUp(self):
+        self.user = create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _import(self, body, **params):
+        url = IMPORT_URL
+        if params:
+            url += '?' + '&'.join(f'{k}={v}' for k, v in params.items())
+        return self.client.post(
+            url, body, content_type='application/x-ndjson')
+
+    def test_empty_body_rejected(self):
+        # test an empty body is an error, not an import of nothing
+        res = self._import('')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_body_without_length_rejected(self):
+        # test a chunked upload is refused instead of reading as empty
+        res = self.client.post(
+            IMPORT_URL,
+            recipe_line(),
+            content_type='application/x-ndjson',
+            CONTENT_LENGTH='',
+            HTTP_TRANSFER_ENCODING='chunked',
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_411_LENGTH_REQUIRED)
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_import_recipes(self):
+        # test each line becomes a recipe with its tags and ingredients
+        body = recipe_line('Soup') + recipe_line('Stew')
+
+        res = self._import(body)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['imported'], 2)
+        self.assertEqual(res.data['failed'], 0)
+        self.assertEqual(res.data['checkpoint'], 2)
+        recipes = Recipe.objects.filter(user=self.user).order_by('id')
+        self.assertEqual([r.title for r in recipes], ['Soup', 'Stew'])
+        for recipe in recipes:
+            self.assertEqual(
+                sorted(i.name for i in recipe.ingredients.all()),
+                ['Pepper', 'Salt'],
+            )
+            self.assertIn('dinner', recipe.search_document)
+
+    def test_import_reuses_existing_names(self):
+        # test names resolve to the user's existing tags
+        tag = Tag.objects.create(user=self.user, name='Dinner')
+
+        self._import(recipe_line() * 3)
+
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(tag.recipe_set.count(), 3)
+        self.assertEqual(
+            Ingredient.objects.filter(user=self.user).count(), 2)
+
+    def test_import_reports_failed_lines(self):
+        # test invalid lines are reported and valid ones still imported
+        body = (
+            recipe_line('Good') +
+            '{not json\n' +
+            json.dumps({'title': 'No time'}) + '\n' +
+            '\n' +
+            recipe_line('Also good')
+        )
+
+        res = self._import(body)
+
+        self.assertEqual(res.data['imported'], 2)
+        self.assertEqual(res.data['failed'], 2)
+        failures = {f['line']: f['errors'] for f in res.data['failures']}
+        self.assertEqual(set(failures), {2, 3})
+        self.assertIn('time_minutes', failures[3])
+        self.assertEqual(res.data['checkpoint'], 5)
+
+    def test_import_resumes_from_checkpoint(self):
+        # test lines up to resume_from are skipped
+        body = recipe_line('One') + recipe_line('Two') + recipe_line('Three')
+
+        res = self._import(body, resume_from=2)
+
+        self.assertEqual(res.data['imported'], 1)
+        self.assertEqual(
+            list(Recipe.objects.values_list('title', flat=True)), ['Three'])
+
+    def test_import_bad_resume_from(self):
+        # test a non integer checkpoint is rejected
+        res = self._import(recipe_line(), resume_from='x')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_import_writes_in_batches(self):
+        # test a checkpoint is recorded after every full batch
+        checkpoints = []
+        importer = RecipeImporter(
+            self.user, batch_size=2, on_checkpoint=checkpoints.append)
+
+        report = importer.run([recipe_line()] * 5)
+
+        self.assertEqual(report['imported'], 5)
+        self.assertEqual(checkpoints, [2, 4, 5])
+
+    def _count_queries(self, count):
+        # return the queries used to import count recipes in one batch
+        importer = RecipeImporter(self.user, batch_size=100)
+        with CaptureQueriesContext(connection) as context:
+            importer.run([recipe_line()] * count)
+        return len(context.captured_queries)
+
+    def test_import_batch_queries_do_not_grow(self):
+        # test a batch costs the same queries for few or many recipes
+        self._count_queries(1)
+
+        few = self._count_queries(5)
+        many = self._count_queries(50)
+
+        if connection.features.can_return_rows_from_bulk_insert:
+            self.assertEqual(many, few)
+        else:
+            # without returned ids recipes are saved one at a time
+            self.assertEqual(many - few, 45)
+
+    def test_import_stops_at_database_error(self):
+        # test a failed batch leaves earlier batches committed
+        calls = []
+        original = RecipeImporter._write
+
+        def write(importer, batch):
+            calls.append(len(batch))
+            if len(calls) == 2:
+                raise DatabaseError('connection lost')
+            return original(importer, batch)
+
+        with patch('recipe.importer.IMPORT_BATCH_SIZE', 2), \
+                patch.object(RecipeImporter, '_write', write):
+            res = self._import(recipe_line() * 5)
+
+        self.assertEqual(
+            res.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertEqual(res.data['checkpoint'], 2)
+        self.assertEqual(Recipe.objects.count(), 2)
+
+
+class ImportRecipesCommandTests(TestCase):
+    # tests for the import_recipes command
+
+    def setUp(self):
+        self.user = create_user()
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'recipes.ndjson')
+        self.checkpoint = os.path.join(self.dir.name, 'checkpoint')
+        with open(self.path, 'w') as file:
+            file.write(''.join(recipe_line(f'Recipe {i}') for i in range(5)))
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _call(self):
+        call_command(
+            'import_recipes', self.path,
+            '--email', self.user.email,
+            '--batch-size', '2',
+            '--checkpoint-file', self.checkpoint,
+            stdout=StringIO(), stderr=StringIO(),
+        )
+
+    def test_import_recipes_command(self):
+        # test the command imports the file and records its checkpoint
+        self._call()
+
+        self.assertEqual(Recipe.objects.filter(user=self.user).count(), 5)
+        with open(self.checkpoint) as file:
+            self.assertEqual(file.read(), '5')
+
+    def test_import_resumes_after_interruption(self):
+        # test a rerun continues after the last committed batch
+        original = RecipeImporter._write
+        calls = []
+
+        def write(importer, batch):
+            calls.append(len(batch))
+            if len(calls) == 2:
+                raise DatabaseError('connection lost')
+            return original(importer, batch)
+
+        with patch.object(RecipeImporter, '_write', write):
+            with self.assertRaises(DatabaseError):
+                self._call()
+        self.assertEqual(Recipe.objects.count(), 2)
+
+        self._call()
+
+        titles = sorted(Recipe.objects.values_list('title', flat=True))
+        self.assertEqual(titles, [f'Recipe {i}' for i in range(5)])
@@ -0,0 +1,56 @@
+"""
+tests for the query plan checks
+"""
+from django.contrib.auth import get_user_model
+from django.core.checks.registry import registry
+from django.db import connection
+from django.test import TestCase
+
+from core.models import Recipe
+from recipe.checks import (check_query_plans, plan_problems)
+
+
+class QueryPlanCheckTests(TestCase):
+    # tests for the EXPLAIN based index check
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='user@example.com', password='test123')
+
+    def test_hot_queries_use_indexes(self):
+        # test every hot list query is served by an index
+        errors = check_query_plans(databases=['default'])
+
+        self.assertEqual(errors, [])
+
+    def test_check_skipped_without_databases(self):
+        # test plans are only checked when a database is given
+        self.assertEqual(check_query_plans(), [])
+
+    def test_check_is_deploy_only(self):
+        # test wait_for_db and migrate, which run the database checks,
+        # never plan queries
+        self.assertNotIn(check_query_plans, registry.get_checks())
+        self.assertIn(
+            check_query_plans,
+            registry.get_checks(include_deployment_checks=True),
+        )
+
+    def test_unindexed_filter_is_reported(self):
+        # test a filter with no matching index needs a scan
+        if connection.vendor not in ('postgresql', 'sqlite'):
+            self.skipTest('EXPLAIN is not checked on this database')
+
+        problems = plan_problems(Recipe.objects.filter(title='Soup'))
+
+        self.assertEqual(len(problems), 1)
+        self.assertIn('scan', problems[0])
+
+    def test_unindexed_ordering_is_reported(self):
+        # test an ordering no index provides needs a sort
+        if connection.vendor not in ('postgresql', 'sqlite'):
+            self.skipTest('EXPLAIN is not checked on this database')
+
+        queryset = Recipe.objects.filter(user=self.user).order_by('title')
+
+        self.assertIn('sort', ' '.join(plan_problems(queryset)))
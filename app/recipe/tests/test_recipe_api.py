@@ -3,13 +3,17 @@ Test for recipe API
 """
 
 from decimal import Decimal
+from unittest.mock import patch
 import tempfile
 import os
 
 from PIL import Image
 
 from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models.signals import m2m_changed
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 
@@ -22,6 +26,7 @@ from recipe.serializers import (RecipeSerializer, RecipeDetailSerializer)
 
 
 RECIPE_URL = reverse('recipe:recipe-list')
+BATCH_URL = reverse('recipe:recipe-batch')
 
 
 def detail_url(recipe_id):
@@ -249,6 +254,22 @@ class PrivateRecipeAPITests(TestCase):
             ).exists()
             self.assertTrue(exists)
 
+    def test_create_recipe_with_duplicate_tag_names(self):
+        # test repeated tag names in a payload create a single tag
+        payload = {
+            'title': 'Pongal',
+            'time_minutes': 87,
+            'price': Decimal('5.66'),
+            'tags': [{'name': 'Indian'}, {'name': 'Indian'}],
+        }
+        res = self.client.post(RECIPE_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        recipe = Recipe.objects.get(id=res.data['id'])
+        self.assertEqual(recipe.tags.count(), 1)
+        self.assertEqual(
+            Tag.objects.filter(user=self.user, name='Indian').count(), 1)
+
     def test_create_tag_on_update(self):
         # test for updating tags with recipe api
         recipe = create_recipe(user=self.user)
@@ -431,6 +452,383 @@ class PrivateRecipeAPITests(TestCase):
         self.assertIn(serializer2.data, res.data)
         self.assertNotIn(serializer3.data, res.data)       
 
+    def test_filter_by_tags_match_all(self):
+        # test match=all only returns recipes with every tag
+        recipe1 = create_recipe(user=self.user, title='Fried Rice')
+        recipe2 = create_recipe(user=self.user, title='Kimchi Soup')
+        tag1 = Tag.objects.create(user=self.user, name='Rice')
+        tag2 = Tag.objects.create(user=self.user, name='Spicy')
+        recipe1.tags.add(tag1, tag2)
+        recipe2.tags.add(tag2)
+
+        params = {'tags': f'{tag1.id},{tag2.id}', 'match': 'all'}
+        res = self.client.get(RECIPE_URL, params)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([recipe['id'] for recipe in res.data], [recipe1.id])
+
+    def test_filter_by_tags_no_duplicates(self):
+        # test a recipe matching several tags is listed once
+        recipe = create_recipe(user=self.user)
+        tag1 = Tag.objects.create(user=self.user, name='Rice')
+        tag2 = Tag.objects.create(user=self.user, name='Spicy')
+        recipe.tags.add(tag1, tag2)
+
+        res = self.client.get(RECIPE_URL, {'tags': f'{tag1.id},{tag2.id}'})
+
+        self.assertEqual([recipe['id'] for recipe in res.data], [recipe.id])
+
+    def test_filter_invalid_params_error(self):
+        # test bad filter values are rejected instead of failing
+        too_many = ','.join(str(i) for i in range(1, 52))
+        for params in [
+            {'tags': '1,abc'},
+            {'ingredients': '1,,2'},
+            {'tags': too_many},
+            {'tags': '1', 'match': 'some'},
+        ]:
+            res = self.client.get(RECIPE_URL, params)
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_paginated_with_cursor(self):
+        # test paging through recipes with a cursor
+        for i in range(5):
+            create_recipe(user=self.user, title=f'Recipe {i}')
+
+        res = self.client.get(RECIPE_URL, {'page_size': 2})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        recipes = Recipe.objects.filter(user=self.user).order_by('-id')
+        serializer = RecipeSerializer(recipes[:2], many=True)
+        self.assertEqual(res.data['results'], serializer.data)
+        self.assertIsNone(res.data['previous'])
+
+        res = self.client.get(res.data['next'])
+
+        serializer = RecipeSerializer(recipes[2:4], many=True)
+        self.assertEqual(res.data['results'], serializer.data)
+        self.assertIsNotNone(res.data['previous'])
+
+        res = self.client.get(res.data['next'])
+
+        serializer = RecipeSerializer(recipes[4:], many=True)
+        self.assertEqual(res.data['results'], serializer.data)
+        self.assertIsNone(res.data['next'])
+
+    def test_list_page_size_capped(self):
+        # test the page size can not exceed the maximum
+        create_recipe(user=self.user)
+        create_recipe(user=self.user)
+
+        with patch(
+            'recipe.pagination.RecipeCursorPagination.max_page_size', 1
+        ):
+            res = self.client.get(RECIPE_URL, {'page_size': 50})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data['results']), 1)
+        self.assertIsNotNone(res.data['next'])
+
+
+class RecipeQueryCountTests(TestCase):
+    # tests that recipe endpoints do not run queries per related row
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(email='user@example.com', password='test123')
+        self.client.force_authenticate(self.user)
+
+    def _create_tagged_recipe(self, count):
+        # create a recipe with count tags and ingredients
+        recipe = create_recipe(user=self.user)
+        for i in range(count):
+            recipe.tags.add(
+                Tag.objects.create(user=self.user, name=f'Tag {recipe.id} {i}')
+            )
+            recipe.ingredients.add(
+                Ingredient.objects.create(
+                    user=self.user,
+                    name=f'Ingredient {recipe.id} {i}',
+                )
+            )
+        return recipe
+
+    def _count_queries(self, method, url, data=None):
+        # run a request and return the number of queries it made
+        with CaptureQueriesContext(connection) as context:
+            res = getattr(self.client, method)(url, data, format='json')
+        self.assertLess(res.status_code, 300)
+        return len(context.captured_queries)
+
+    def test_list_query_count_constant(self):
+        # test listing recipes does not query per recipe
+        self._create_tagged_recipe(2)
+        small = self._count_queries('get', RECIPE_URL)
+
+        for _ in range(5):
+            self._create_tagged_recipe(4)
+        large = self._count_queries('get', RECIPE_URL)
+
+        self.assertEqual(small, large)
+        self.assertEqual(large, 3)
+
+    def test_retrieve_query_count_constant(self):
+        # test retrieving a recipe does not query per tag or ingredient
+        small = self._count_queries(
+            'get', detail_url(self._create_tagged_recipe(1).id))
+        large = self._count_queries(
+            'get', detail_url(self._create_tagged_recipe(10).id))
+
+        self.assertEqual(small, large)
+        self.assertEqual(large, 3)
+
+    def test_create_query_count(self):
+        # test creating a recipe with new and existing tags and ingredients
+        # runs the same fixed queries however many it sends
+        def payload(count, prefix):
+            names = [f'{prefix} old {i}' for i in range(count)] + [
+                f'{prefix} new {i}' for i in range(count)]
+            for name in names[:count]:
+                Tag.objects.create(user=self.user, name=name)
+                Ingredient.objects.create(user=self.user, name=name)
+            return {
+                'title': 'Sample recipe',
+                'time_minutes': 30,
+                'price': Decimal('4.65'),
+                'tags': [{'name': name} for name in names],
+                'ingredients': [{'name': name} for name in names],
+            }
+
+        counts = [
+            self._count_queries('post', RECIPE_URL, payload(count, count))
+            for count in (2, 5, 20)
+        ]
+
+        self.assertEqual(counts, [counts[0]] * 3)
+        self.assertEqual(counts[0], 17)
+        recipe = Recipe.objects.latest('id')
+        self.assertEqual(recipe.tags.count(), 40)
+        self.assertEqual(recipe.ingredients.count(), 40)
+
+    def test_create_with_tags_query_count_constant(self):
+        # test creating tags and ingredients is batched
+        def payload(count, prefix):
+            return {
+                'title': 'Sample recipe',
+                'time_minutes': 30,
+                'price': Decimal('4.65'),
+                'tags': [{'name': f'{prefix} tag {i}'} for i in range(count)],
+                'ingredients': [
+                    {'name': f'{prefix} ingredient {i}'} for i in range(count)
+                ],
+            }
+
+        small = self._count_queries('post', RECIPE_URL, payload(1, 'a'))
+        large = self._count_queries('post', RECIPE_URL, payload(30, 'b'))
+
+        self.assertEqual(small, large)
+
+    def test_update_query_count_constant(self):
+        # test updating a recipe does not query per tag or ingredient
+        payload = {'title': 'New title'}
+        small = self._count_queries(
+            'patch', detail_url(self._create_tagged_recipe(1).id), payload)
+        large = self._count_queries(
+            'patch', detail_url(self._create_tagged_recipe(10).id), payload)
+
+        self.assertEqual(small, large)
+
+
+class RecipeRelationUpdateTests(TestCase):
+    # tests that updates only write the tag rows that changed
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(email='user@example.com', password='test123')
+        self.client.force_authenticate(self.user)
+        self.recipe = create_recipe(user=self.user)
+        self.breakfast = Tag.objects.create(user=self.user, name='Breakfast')
+        self.lunch = Tag.objects.create(user=self.user, name='Lunch')
+        self.recipe.tags.add(self.breakfast, self.lunch)
+        self.signals = []
+        m2m_changed.connect(self._on_m2m_changed, sender=Recipe.tags.through)
+
+    def tearDown(self):
+        m2m_changed.disconnect(
+            self._on_m2m_changed, sender=Recipe.tags.through)
+
+    def _on_m2m_changed(self, action, pk_set, **kwargs):
+        self.signals.append((action, pk_set))
+
+    def _through_rows(self):
+        # return the (row id, tag id) pairs linking the recipe to tags
+        return set(
+            Recipe.tags.through.objects.filter(
+                recipe=self.recipe
+            ).values_list('id', 'tag_id')
+        )
+
+    def _patch_tags(self, names, num_queries):
+        # update the recipe tags by name within a query budget
+        payload = {'tags': [{'name': name} for name in names]}
+        with self.assertNumQueries(num_queries):
+            res = self.client.patch(
+                detail_url(self.recipe.id), payload, format='json')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_noop_update_writes_nothing(self):
+        # test sending the current tags touches neither the through table
+        # nor the search data
+        before = self._through_rows()
+
+        self._patch_tags(['Breakfast', 'Lunch'], 10)
+
+        self.assertEqual(self._through_rows(), before)
+        self.assertEqual(self.signals, [])
+
+    def test_additive_update_inserts_only_new(self):
+        # test adding a tag keeps the existing through rows
+        before = self._through_rows()
+        dinner = Tag.objects.create(user=self.user, name='Dinner')
+
+        self._patch_tags(['Breakfast', 'Lunch', 'Dinner'], 14)
+
+        after = self._through_rows()
+        self.assertTrue(before < after)
+        self.assertEqual({tag_id for _, tag_id in after - before},
+                         {dinner.id})
+        self.assertEqual(
+            [action for action, _ in self.signals], ['pre_add', 'post_add'])
+
+    def test_subtractive_update_deletes_only_removed(self):
+        # test removing a tag deletes a single through row
+        before = self._through_rows()
+
+        self._patch_tags(['Breakfast'], 13)
+
+        after = self._through_rows()
+        self.assertTrue(after < before)
+        self.assertEqual({tag_id for _, tag_id in before - after},
+                         {self.lunch.id})
+        self.assertEqual(self.signals, [
+            ('pre_remove', {self.lunch.id}),
+            ('post_remove', {self.lunch.id}),
+        ])
+
+
+class RecipeBatchAPITests(TestCase):
+    # tests for the recipe batch API
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(email='user@example.com', password='test123')
+        self.client.force_authenticate(self.user)
+
+    def test_batch_create_update_delete(self):
+        # test applying mixed operations in one request
+        recipe1 = create_recipe(user=self.user, title='Old title')
+        recipe1.tags.add(Tag.objects.create(user=self.user, name='Old'))
+        recipe2 = create_recipe(user=self.user)
+        payload = {'operations': [
+            {'op': 'create', 'data': {
+                'title': 'Pancakes',
+                'time_minutes': 10,
+                'price': '2.50',
+                'tags': [{'name': 'Breakfast'}, {'name': 'Sweet'}],
+                'ingredients': [{'name': 'Flour'}],
+            }},
+            {'op': 'update', 'id': recipe1.id, 'data': {
+                'title': 'New title',
+                'tags': [{'name': 'Breakfast'}],
+            }},
+            {'op': 'delete', 'id': recipe2.id},
+        ]}
+
+        res = self.client.post(BATCH_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        statuses = [result['status'] for result in res.data['results']]
+        self.assertEqual(statuses, [201, 200, 204])
+        created = Recipe.objects.get(id=res.data['results'][0]['id'])
+        self.assertEqual(created.user, self.user)
+        self.assertEqual(
+            sorted(tag.name for tag in created.tags.all()),
+            ['Breakfast', 'Sweet'],
+        )
+        self.assertEqual(created.ingredients.get().name, 'Flour')
+        recipe1.refresh_from_db()
+        self.assertEqual(recipe1.title, 'New title')
+        self.assertEqual(
+            [tag.name for tag in recipe1.tags.all()], ['Breakfast'])
+        self.assertFalse(Recipe.objects.filter(id=recipe2.id).exists())
+        self.assertEqual(
+            Tag.objects.filter(user=self.user, name='Breakfast').count(), 1)
+
+    def test_batch_atomic_rolls_back_on_error(self):
+        # test nothing is applied when one operation is invalid
+        recipe = create_recipe(user=self.user)
+        payload = {'operations': [
+            {'op': 'create', 'data': {
+                'title': 'Pancakes', 'time_minutes': 10, 'price': '2.50'}},
+            {'op': 'update', 'id': recipe.id, 'data': {'time_minutes': 'x'}},
+        ]}
+
+        res = self.client.post(BATCH_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        results = res.data['results']
+        self.assertEqual(results[0]['status'], 424)
+        self.assertEqual(results[1]['status'], 400)
+        self.assertIn('time_minutes', results[1]['errors'])
+        self.assertEqual(Recipe.objects.filter(user=self.user).count(), 1)
+
+    def test_batch_partial_applies_valid_operations(self):
+        # test partial mode applies the operations that are valid
+        other_user = create_user(email='other@example.com', password='pass123')
+        other_recipe = create_recipe(user=other_user)
+        payload = {'atomic': False, 'operations': [
+            {'op': 'create', 'data': {
+                'title': 'Pancakes', 'time_minutes': 10, 'price': '2.50'}},
+            {'op': 'create', 'data': {'title': 'Missing fields'}},
+            {'op': 'delete', 'id': other_recipe.id},
+            {'op': 'rename', 'id': other_recipe.id},
+        ]}
+
+        res = self.client.post(BATCH_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        statuses = [result['status'] for result in res.data['results']]
+        self.assertEqual(statuses, [201, 400, 404, 400])
+        self.assertEqual(
+            list(Recipe.objects.filter(user=self.user).values_list(
+                'title', flat=True)),
+            ['Pancakes'],
+        )
+        self.assertTrue(Recipe.objects.filter(id=other_recipe.id).exists())
+
+    def test_batch_duplicate_id_rejected(self):
+        # test the same recipe can only appear once per batch
+        recipe = create_recipe(user=self.user)
+        payload = {'operations': [
+            {'op': 'update', 'id': recipe.id, 'data': {'title': 'New'}},
+            {'op': 'delete', 'id': recipe.id},
+        ]}
+
+        res = self.client.post(BATCH_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data['results'][1]['status'], 400)
+        self.assertTrue(Recipe.objects.filter(id=recipe.id).exists())
+
+    def test_batch_size_limited(self):
+        # test a batch can not exceed the maximum number of operations
+        payload = {'operations': [{'op': 'delete', 'id': 1}] * 101}
+
+        res = self.client.post(BATCH_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
 
 class ImageUploadTests(TestCase):
     # tests for uploading image API
@@ -458,8 +856,10 @@ class ImageUploadTests(TestCase):
             res = self.client.post(url, payload, format='multipart')
 
             self.recipe.refresh_from_db()
-            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
             self.assertIn('image', res.data)
+            self.assertEqual(res.data['image_status'], 'pending')
+            self.assertEqual(self.recipe.image_status, 'pending')
             self.assertTrue(os.path.exists(self.recipe.image.path))
 
     def test_upload_image_bad_request(self):
@@ -0,0 +1,161 @@
+"""
+tests for routing recipe API reads to replicas
+"""
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import connections
+from django.test import (TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.models import (Recipe, Tag)
+from core.routers import (read_scope, use_replica)
+from user.authentication import invalidate_user
+
+
+RECIPES_URL = reverse('recipe:recipe-list')
+TAGS_URL = reverse('recipe:tag-list')
+EXPORT_URL = reverse('recipe:recipe-export')
+
+
+def recipe_queries(context):
+    # return the captured queries that read recipe data
+    return [
+        query['sql'] for query in context.captured_queries
+        if 'core_recipe' in query['sql'] or 'core_tag' in query['sql']
+    ]
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTests(TransactionTestCase):
+    # tests using a second alias for the same test database as a replica
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        connections.databases['replica'] = dict(
+            connections['default'].settings_dict)
+
+    @classmethod
+    def tearDownClass(cls):
+        connections['replica'].close()
+        del connections['replica']
+        del connections.databases['replica']
+        super().tearDownClass()
+
+    def setUp(self):
+        caches['auth'].clear()
+        self.user = get_user_model().objects.create_user(
+            email='user@example.com', password='test123')
+        Recipe.objects.create(
+            user=self.user, title='Soup', time_minutes=5, price='1.00')
+        Tag.objects.create(user=self.user, name='Dinner')
+        self.client = APIClient()
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def _set_last_write(self, seconds_ago):
+        get_user_model().objects.filter(pk=self.user.pk).update(
+            data_updated_at=timezone.now() - timedelta(seconds=seconds_ago))
+        # bump_data_versions drops the cached user the same way
+        invalidate_user(self.user.pk)
+
+    def _get(self, url):
+        # return the response and the recipe queries on each database
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica']) as replica:
+            res = self.client.get(url)
+            if res.streaming:
+                b''.join(res.streaming_content)
+
+        return res, recipe_queries(primary), recipe_queries(replica)
+
+    def test_reads_go_to_replica(self):
+        # test list requests read from the replica
+        self._set_last_write(60)
+
+        for url in (RECIPES_URL, TAGS_URL):
+            res, primary, replica = self._get(url)
+
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(res.data), 1)
+            self.assertEqual(primary, [])
+            self.assertNotEqual(replica, [])
+
+    def test_reads_stick_to_primary_after_write(self):
+        # test a user reads their own writes from the primary
+        self._set_last_write(60)
+        res = self.client.post(RECIPES_URL, {
+            'title': 'Stew', 'time_minutes': 30, 'price': '4.00'})
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+        res, primary, replica = self._get(RECIPES_URL)
+
+        self.assertEqual(len(res.data), 2)
+        self.assertNotEqual(primary, [])
+        self.assertEqual(replica, [])
+
+    def test_reads_return_to_replica_after_window(self):
+        # test reads move back to the replica once the window has passed
+        with override_settings(REPLICA_STICKY_SECONDS=30):
+            self._set_last_write(10)
+            _, _, replica = self._get(RECIPES_URL)
+            self.assertEqual(replica, [])
+
+            self._set_last_write(40)
+            _, _, replica = self._get(RECIPES_URL)
+            self.assertNotEqual(replica, [])
+
+    def test_writes_go_to_primary(self):
+        # test unsafe requests never touch the replica
+        self._set_last_write(60)
+        recipe = Recipe.objects.get()
+
+        with CaptureQueriesContext(connections['replica']) as replica:
+            res = self.client.patch(
+                reverse('recipe:recipe-detail', args=[recipe.id]),
+                {'title': 'Hot soup'},
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(replica.captured_queries, [])
+
+    def test_export_streams_from_replica(self):
+        # test the export stream keeps reading the replica after the view
+        self._set_last_write(60)
+
+        res, primary, replica = self._get(EXPORT_URL)
+
+        self.assertEqual(primary, [])
+        self.assertEqual(len(replica), 4)
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_no_replicas_configured(self):
+        # test everything reads the primary without replicas
+        self._set_last_write(60)
+
+        _, primary, replica = self._get(RECIPES_URL)
+
+        self.assertNotEqual(primary, [])
+        self.assertEqual(replica, [])
+
+    def test_instances_read_from_replica_save_to_primary(self):
+        # test the router writes to the primary whatever the instance source
+        with read_scope():
+            use_replica()
+            recipe = Recipe.objects.get()
+            self.assertEqual(recipe._state.db, 'replica')
+
+            with CaptureQueriesContext(connections['replica']) as replica:
+                recipe.title = 'Hot soup'
+                recipe.save()
+
+        self.assertEqual(replica.captured_queries, [])
+        self.assertEqual(Recipe.objects.get().title, 'Hot soup')
@@ -0,0 +1,221 @@
+"""
+tests for recipe search API
+"""
+from decimal import Decimal
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import (Recipe, Tag)
+from recipe.search import reindex_recipes
+
+
+RECIPE_URL = reverse('recipe:recipe-list')
+
+
+def detail_url(recipe_id):
+    # create and return a recipe detail url
+    return reverse('recipe:recipe-detail', args=[recipe_id])
+
+
+def tag_detail_url(tag_id):
+    # create and return a tag detail url
+    return reverse('recipe:tag-detail', args=[tag_id])
+
+
+def create_user(email='user@example.com', password='test123'):
+    # create and return a sample user
+    return get_user_model().objects.create_user(email=email, password=password)
+
+
+class RecipeSearchApiTests(TestCase):
+    # tests for searching recipes
+
+    def setUp(self):
+        self.user = create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _create_recipe(self, **params):
+        # create a recipe through the API so it is indexed
+        payload = {
+            'title': 'Sample recipe',
+            'time_minutes': 10,
+            'price': Decimal('5.00'),
+            'description': '',
+        }
+        payload.update(params)
+        res = self.client.post(RECIPE_URL, payload, format='json')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        return Recipe.objects.get(id=res.data['id'])
+
+    def _search(self, query):
+        # return the ids of recipes matching a query, in order
+        res = self.client.get(RECIPE_URL, {'search': query})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return [recipe['id'] for recipe in res.data]
+
+    def test_search_matches_title_description_and_names(self):
+        # test search covers the title, description, tags and ingredients
+        by_title = self._create_recipe(title='Lemon Pie')
+        by_description = self._create_recipe(description='Add lemon zest')
+        by_tag = self._create_recipe(tags=[{'name': 'Lemony'}])
+        by_ingredient = self._create_recipe(ingredients=[{'name': 'LEMON'}])
+        self._create_recipe(title='Apple Pie')
+
+        ids = self._search('lemon')
+
+        self.assertEqual(
+            set(ids),
+            {by_title.id, by_description.id, by_tag.id, by_ingredient.id},
+        )
+
+    def test_search_ranks_title_matches_first(self):
+        # test recipes matching on title are returned before others
+        by_description = self._create_recipe(description='Kimchi on the side')
+        by_title = self._create_recipe(title='Kimchi Soup')
+
+        self.assertEqual(self._search('kimchi'),
+                         [by_title.id, by_description.id])
+
+    def test_search_pages_keep_ranking(self):
+        # test paging search results follows the rank, not the id
+        by_title = self._create_recipe(title='Kimchi Soup')
+        by_description = [
+            self._create_recipe(description=f'Kimchi {n}') for n in range(3)
+        ]
+        also_title = self._create_recipe(title='Kimchi Rice')
+        ranked = self._search('kimchi')
+
+        ids = []
+        params = {'search': 'kimchi', 'page_size': 2}
+        res = self.client.get(RECIPE_URL, params)
+        while True:
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            ids += [recipe['id'] for recipe in res.data['results']]
+            if not res.data['next']:
+                break
+            res = self.client.get(res.data['next'])
+
+        self.assertEqual(ids, ranked)
+        self.assertEqual(
+            ids,
+            [also_title.id, by_title.id] +
+            [recipe.id for recipe in reversed(by_description)],
+        )
+
+    def test_reads_skip_search_columns(self):
+        # test list, search and detail reads do not load the search data
+        recipe = self._create_recipe(title='Kimchi Soup')
+
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(RECIPE_URL)
+            self._search('kimchi')
+            self.client.get(detail_url(recipe.id))
+
+        recipe_selects = [
+            query['sql'].split(' FROM ')[0]
+            for query in context.captured_queries
+            if 'FROM "core_recipe"' in query['sql']
+        ]
+        self.assertEqual(len(recipe_selects), 3)
+        for select in recipe_selects:
+            self.assertNotIn('"core_recipe"."search_document"', select)
+            self.assertNotIn('"core_recipe"."search_vector"', select)
+
+    def test_search_requires_all_terms(self):
+        # test every search term must match
+        both = self._create_recipe(title='Fried Rice', description='spicy')
+        self._create_recipe(title='Fried Chicken')
+
+        self.assertEqual(self._search('fried spicy'), [both.id])
+
+    def test_search_limited_to_user(self):
+        # test search only returns the user's recipes
+        other = create_user(email='other@example.com')
+        Recipe.objects.create(
+            user=other,
+            title='Curry',
+            time_minutes=5,
+            price=Decimal('1.00'),
+            search_document='curry',
+        )
+
+        self.assertEqual(self._search('curry'), [])
+
+    def test_update_recipe_reindexes(self):
+        # test updating a recipe refreshes its search data
+        recipe = self._create_recipe(title='Porridge')
+
+        self.client.patch(
+            detail_url(recipe.id),
+            {'title': 'Oatmeal', 'tags': [{'name': 'Breakfast'}]},
+            format='json',
+        )
+
+        self.assertEqual(self._search('porridge'), [])
+        self.assertEqual(self._search('breakfast'), [recipe.id])
+
+    def test_update_without_search_changes_skips_reindex(self):
+        # test a write that leaves the search data alone does not reindex
+        recipe = self._create_recipe(title='Porridge')
+        Recipe.objects.filter(id=recipe.id).update(search_document='stale')
+
+        self.client.patch(
+            detail_url(recipe.id), {'time_minutes': 20}, format='json')
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.search_document, 'stale')
+
+        self.client.patch(
+            detail_url(recipe.id), {'title': 'Oatmeal'}, format='json')
+        recipe.refresh_from_db()
+        self.assertIn('oatmeal', recipe.search_document)
+
+    def test_rename_tag_reindexes_recipes(self):
+        # test renaming a tag refreshes the recipes using it
+        recipe = self._create_recipe(tags=[{'name': 'Dinner'}])
+        tag = Tag.objects.get(user=self.user, name='Dinner')
+
+        self.client.patch(tag_detail_url(tag.id), {'name': 'Supper'})
+
+        self.assertEqual(self._search('dinner'), [])
+        self.assertEqual(self._search('supper'), [recipe.id])
+
+    def test_reindex_in_batches(self):
+        # test many recipes are reindexed a bounded batch at a time
+        recipes = [
+            self._create_recipe(title=f'Stew {count}',
+                                tags=[{'name': 'Dinner'}])
+            for count in range(5)
+        ]
+        Tag.objects.filter(user=self.user).update(name='Supper')
+
+        with patch('recipe.search.REINDEX_BATCH_SIZE', 2), \
+                CaptureQueriesContext(connection) as context:
+            reindex_recipes(Recipe.objects.filter(tags__name='Supper'))
+
+        writes = [
+            query for query in context.captured_queries
+            if query['sql'].startswith('UPDATE "core_recipe"')
+        ]
+        self.assertEqual(len(writes), 3)
+        self.assertEqual(
+            sorted(self._search('supper')),
+            sorted(recipe.id for recipe in recipes),
+        )
+
+    def test_delete_tag_reindexes_recipes(self):
+        # test deleting a tag removes it from the search data
+        self._create_recipe(tags=[{'name': 'Vegan'}])
+        tag = Tag.objects.get(user=self.user, name='Vegan')
+
+        self.client.delete(tag_detail_url(tag.id))
+
+        self.assertEqual(self._search('vegan'), [])
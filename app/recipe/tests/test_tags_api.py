@@ -84,6 +84,18 @@ class PrivateTagsApiTests(TestCase):
         tag.refresh_from_db()
         self.assertEqual(tag.name, payload['name'])
 
+    def test_update_tag_duplicate_name_error(self):
+        # test renaming a tag to an existing name is rejected
+        Tag.objects.create(user=self.user, name='Dessert')
+        tag = Tag.objects.create(user=self.user, name='After Dinner')
+
+        url = detail_url(tag.id)
+        res = self.client.patch(url, {'name': 'Dessert'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        tag.refresh_from_db()
+        self.assertEqual(tag.name, 'After Dinner')
+
     def test_delete_tag(self):
         # test deleting a tag
         tag = Tag.objects.create(user=self.user, name='Breakfast')
@@ -137,3 +149,19 @@ class PrivateTagsApiTests(TestCase):
 
         self.assertEqual(len(res.data), 1)
 
+    def test_list_tags_paginated(self):
+        # test paging through tags with a cursor
+        for name in ['Apple', 'Banana', 'Cherry']:
+            Tag.objects.create(user=self.user, name=name)
+
+        res = self.client.get(TAGS_URL, {'page_size': 2})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        names = [tag['name'] for tag in res.data['results']]
+        self.assertEqual(names, ['Cherry', 'Banana'])
+
+        res = self.client.get(res.data['next'])
+
+        names = [tag['name'] for tag in res.data['results']]
+        self.assertEqual(names, ['Apple'])
+        self.assertIsNone(res.data['next'])
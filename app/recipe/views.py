@@ -2,7 +2,6 @@
 views for the recipe APIs
 """
 
-from symbol import parameters
 from drf_spectacular.utils import (
     extend_schema_view,
     extend_schema,
@@ -10,14 +9,32 @@ from drf_spectacular.utils import (
     OpenApiTypes,
 )
 
+from django.db import DatabaseError
+from django.db.models import (Count, Exists, OuterRef)
+from django.http import StreamingHttpResponse
+
 from rest_framework import (viewsets, mixins, status)
 from rest_framework.decorators import action
+from rest_framework.exceptions import (ParseError, ValidationError)
 from rest_framework.response import Response
-from rest_framework.authentication import TokenAuthentication
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import (IsAuthenticated, SAFE_METHODS)
 
 from core.models import (Recipe, Tag, Ingredient)
+from core.query_budget import QueryBudgetMixin
 from recipe import serializers
+from recipe.conditional import ConditionalGetMixin
+from recipe.export import (CSVRenderer, EXPORT_STREAMS, NDJSONRenderer)
+from recipe.importer import RecipeImporter
+from recipe.routing import ReplicaReadMixin
+from recipe.search import (reindex_recipes, search_recipes)
+from recipe.pagination import (
+    RecipeCursorPagination,
+    RecipeAttrCursorPagination,
+)
+from user.authentication import CachedTokenAuthentication
+
+
+MAX_FILTER_IDS = 50
 
 
 @extend_schema_view(
@@ -32,35 +49,133 @@ from recipe import serializers
                 'ingredients',
                 OpenApiTypes.STR,
                 description='Comma separated list of IDs to filer',
-            )
+            ),
+            OpenApiParameter(
+                'match',
+                OpenApiTypes.STR,
+                enum=['any', 'all'],
+                description='Return recipes with any (default) or all of '
+                            'the given tags and ingredients',
+            ),
+            OpenApiParameter(
+                'search',
+                OpenApiTypes.STR,
+                description='Search title, description, tags and '
+                            'ingredients, best matches first',
+            ),
         ]
-    )
+    ),
+    export=extend_schema(
+        parameters=[
+            OpenApiParameter(
+                'format',
+                OpenApiTypes.STR,
+                enum=['ndjson', 'csv'],
+                description='Export format, NDJSON by default',
+            ),
+            OpenApiParameter('tags', OpenApiTypes.STR),
+            OpenApiParameter('ingredients', OpenApiTypes.STR),
+            OpenApiParameter('match', OpenApiTypes.STR, enum=['any', 'all']),
+        ],
+        responses={(200, 'application/x-ndjson'): OpenApiTypes.STR,
+                   (200, 'text/csv'): OpenApiTypes.STR},
+    ),
+    import_recipes=extend_schema(
+        parameters=[
+            OpenApiParameter(
+                'resume_from',
+                OpenApiTypes.INT,
+                description='Skip lines up to the checkpoint of an '
+                            'earlier import',
+            ),
+        ],
+        request={'application/x-ndjson': OpenApiTypes.STR},
+        responses=OpenApiTypes.OBJECT,
+    ),
 )
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(QueryBudgetMixin,
+                    ReplicaReadMixin,
+                    ConditionalGetMixin,
+                    viewsets.ModelViewSet):
     # view for manage recipe APIs
     serializer_class = serializers.RecipeDetailSerializer
     queryset = Recipe.objects.all()
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [IsAuthenticated]
+    pagination_class = RecipeCursorPagination
+    # batch, import and export scale with their input and have no budget.
+    # Writes are measured with new and existing tags and ingredients that
+    # replace the current ones, uploads with a processed image to replace;
+    # core.tests.test_query_budget keeps the write budgets exact
+    query_budget = {
+        'list': 4,
+        'retrieve': 4,
+        'create': 17,
+        'update': 24,
+        'partial_update': 24,
+        'destroy': 8,
+        'upload_image': 13,
+    }
 
     def _params_to_ints(self, qs):
         # convert a list of strings to integers
-        return [int(str_id) for str_id in qs.split(',')]
+        try:
+            ids = {int(str_id) for str_id in qs.split(',')}
+        except ValueError:
+            raise ValidationError(
+                'Expected a comma separated list of integer IDs.')
+        if len(ids) > MAX_FILTER_IDS:
+            raise ValidationError(
+                f'At most {MAX_FILTER_IDS} IDs can be used to filter.')
+
+        return ids
+
+    def _filter_related(self, queryset, through, field_name, ids, match):
+        # keep recipes linked to any or all ids, using a semi-join
+        links = through.objects.filter(
+            recipe_id=OuterRef('pk'),
+            **{f'{field_name}__in': ids},
+        )
+        if match == 'all':
+            links = links.values('recipe_id').annotate(
+                matched=Count('*'),
+            ).filter(matched=len(ids))
+
+        return queryset.filter(Exists(links))
 
     def get_queryset(self):
         # retrieve recipes for authenticated user
         tags = self.request.query_params.get('tags')
         ingredients = self.request.query_params.get('ingredients')
+        match = self.request.query_params.get('match', 'any')
+        if match not in ('any', 'all'):
+            raise ValidationError({'match': 'Must be any or all.'})
+
         queryset = self.queryset
         if tags:
-            tag_ids = self._params_to_ints(tags)
-            queryset = queryset.filter(tags__id__in=tag_ids)
+            queryset = self._filter_related(
+                queryset, Recipe.tags.through, 'tag_id',
+                self._params_to_ints(tags), match,
+            )
         if ingredients:
-            ingredient_ids = self._params_to_ints(ingredients)
-            queryset = queryset.filter(ingredients__id__in=ingredient_ids)
+            queryset = self._filter_related(
+                queryset, Recipe.ingredients.through, 'ingredient_id',
+                self._params_to_ints(ingredients), match,
+            )
+
+        queryset = queryset.filter(
+            user=self.request.user
+        ).order_by('-id').prefetch_related('tags', 'ingredients')
+        if self.request.method in SAFE_METHODS:
+            # search filters and ranks in SQL, responses never show the
+            # stored search data
+            queryset = queryset.defer('search_document', 'search_vector')
+        search = self.request.query_params.get('search')
+        if search and self.action == 'list':
+            queryset = search_recipes(queryset, search)
 
-        return queryset.filter(user=self.request.user).order_by('-id').distinct()
+        return queryset
 
     def get_serializer_class(self):
         # return the serializer class fro request
@@ -68,6 +183,8 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return serializers.RecipeSerializer
         elif self.action == 'upload_image':
             return serializers.RecipeImageSerializer
+        elif self.action == 'batch':
+            return serializers.RecipeBatchSerializer
 
         return self.serializer_class
 
@@ -75,15 +192,78 @@ class RecipeViewSet(viewsets.ModelViewSet):
         # create a new recipe
         serializer.save(user=self.request.user)
 
+    @action(methods=['POST'], detail=False)
+    def batch(self, request):
+        # create, update and delete many recipes in one transaction
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = serializer.save()
+
+        failed = any('errors' in result for result in results)
+        if failed and serializer.validated_data['atomic']:
+            return Response(
+                {'results': results}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
+    @action(
+        methods=['GET'],
+        detail=False,
+        renderer_classes=[NDJSONRenderer, CSVRenderer],
+        pagination_class=None,
+    )
+    def export(self, request):
+        # stream every matching recipe with its tag and ingredient names
+        fmt = request.accepted_renderer.format
+        queryset = self.get_queryset()
+        # the stream is read after the view returns, so pin the database
+        response = StreamingHttpResponse(
+            EXPORT_STREAMS[fmt](queryset.using(queryset.db)),
+            content_type=request.accepted_renderer.media_type,
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="recipes.{fmt}"')
+        return response
+
+    @action(methods=['POST'], detail=False, url_path='import')
+    def import_recipes(self, request):
+        # create recipes from an NDJSON body, read line by line
+        try:
+            resume_from = int(request.query_params.get('resume_from', 0))
+        except ValueError:
+            raise ValidationError({'resume_from': 'Must be an integer.'})
+
+        if request.stream is None:
+            # DRF only reads bodies with a Content-Length; a chunked upload
+            # would otherwise import nothing and still succeed
+            if 'HTTP_TRANSFER_ENCODING' in request.META:
+                return Response(
+                    {'detail': 'A Content-Length header is required.'},
+                    status=status.HTTP_411_LENGTH_REQUIRED,
+                )
+            raise ParseError('The request body is empty.')
+
+        importer = RecipeImporter(request.user, resume_from=resume_from)
+        try:
+            report = importer.run(request.stream)
+        except DatabaseError:
+            # batches before the checkpoint are committed
+            report = importer.report()
+            report['detail'] = 'Import stopped, resume from the checkpoint.'
+            return Response(
+                report, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        return Response(report, status=status.HTTP_200_OK)
+
     @action(methods=['POST'], detail=True, url_path='upload-image')
     def upload_image(self, request, pk=None):
-        # upload an image to recipe
+        # upload an image to recipe, derivatives are rendered in the background
         recipe = self.get_object()
         serializer = self.get_serializer(recipe, data=request.data)
 
         if serializer.is_valid():
             serializer.save()
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -99,31 +279,60 @@ class RecipeViewSet(viewsets.ModelViewSet):
         ]
     )
 )
-class BaseRecipeAttrViewSet(mixins.DestroyModelMixin,
+class BaseRecipeAttrViewSet(QueryBudgetMixin,
+                            ReplicaReadMixin,
+                            ConditionalGetMixin,
+                            mixins.DestroyModelMixin,
                             mixins.UpdateModelMixin, 
                             mixins.ListModelMixin, 
                             viewsets.GenericViewSet):
     # base viewset for recipe attribute
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [IsAuthenticated]
+    pagination_class = RecipeAttrCursorPagination
+    query_budget = {
+        'list': 2,
+        'update': 10,
+        'partial_update': 10,
+        'destroy': 9,
+    }
 
     def get_queryset(self):
         # filter queryset to authenticated user
         assigned_only = bool(int(self.request.query_params.get('assigned_only', 0)))
         queryset = self.queryset
         if assigned_only:
-            queryset = queryset.filter(recipe__isnull=False)
+            through = getattr(Recipe, self.recipe_field).through
+            field_name = self.queryset.model._meta.model_name
+            queryset = queryset.filter(Exists(
+                through.objects.filter(**{field_name: OuterRef('pk')})
+            ))
+
+        return queryset.filter(user=self.request.user).order_by('-name')
+
+    def perform_update(self, serializer):
+        # renaming changes the search data of every recipe using it
+        name = serializer.instance.name
+        instance = serializer.save()
+        if instance.name != name:
+            reindex_recipes(instance.recipe_set.all())
 
-        return queryset.filter(user=self.request.user).order_by('-name').distinct()
+    def perform_destroy(self, instance):
+        # reindex the recipes that lose this tag or ingredient
+        recipe_ids = list(instance.recipe_set.values_list('id', flat=True))
+        instance.delete()
+        reindex_recipes(Recipe.objects.filter(id__in=recipe_ids))
 
 
 class TagViewSet(BaseRecipeAttrViewSet):
     # manage tags in database
     serializer_class = serializers.TagSerializer
     queryset = Tag.objects.all()
+    recipe_field = 'tags'
 
 
 class IngredientViewSet(BaseRecipeAttrViewSet):
     # manage ingredients in the database
     serializer_class = serializers.IngredientSerializer
     queryset = Ingredient.objects.all()
+    recipe_field = 'ingredients'
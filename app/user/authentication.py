@@ -0,0 +1,84 @@
+"""
+Cached token authentication
+
+The cache maps a hashed token key to the user id, and the user id to the
+user's fields other than the password, so a warm token authenticates
+without a query. The password hash never sits in the cache; it is loaded
+from the database the first time a request reads it. User saves and data
+version bumps drop the cached fields.
+"""
+import hashlib
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+
+# user fields that are loaded on access instead of cached
+UNCACHED_USER_FIELDS = frozenset(['password'])
+
+
+def auth_cache():
+    return caches['auth']
+
+
+def token_cache_key(key):
+    # never store raw token keys in the cache
+    return 'auth:token:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+def user_cache_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def cached_fields(user):
+    # the user's loaded field values in model order, without the password
+    return (user._state.db, {
+        field.attname: getattr(user, field.attname)
+        for field in user._meta.concrete_fields
+        if field.attname not in UNCACHED_USER_FIELDS
+        and field.attname in user.__dict__
+    })
+
+
+def user_from_cache(cached):
+    # build the user from cached fields; the others load on access
+    db, fields = cached
+    return get_user_model().from_db(db, list(fields), list(fields.values()))
+
+
+def invalidate_token(key):
+    # drop a cached token so the next request hits the database
+    auth_cache().delete(token_cache_key(key))
+
+
+def invalidate_users(user_ids):
+    # drop the cached fields of users, their tokens load them again
+    auth_cache().delete_many([user_cache_key(pk) for pk in user_ids])
+
+
+def invalidate_user(user_id):
+    invalidate_users([user_id])
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    # token authentication that serves warm tokens from the cache
+
+    def authenticate_credentials(self, key):
+        cache = auth_cache()
+        cache_key = token_cache_key(key)
+        user_id = cache.get(cache_key)
+        if user_id is not None:
+            cached = cache.get(user_cache_key(user_id))
+            if cached is not None:
+                # only active users are cached, saves drop the entry
+                user = user_from_cache(cached)
+                return (user, Token(key=key, user=user))
+
+        user, token = super().authenticate_credentials(key)
+        cache.set_many({
+            cache_key: user.pk,
+            user_cache_key(user.pk): cached_fields(user),
+        })
+        return (user, token)
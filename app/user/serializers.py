@@ -18,15 +18,19 @@ class UserSerializer(serializers.ModelSerializer):
         return get_user_model().objects.create_user(**validated_data)
 
     def update(self, instance, validated_data):
-        # update user information and encrypted password
+        # update user information and encrypted password; only the sent
+        # columns are saved, the instance may be older than the row
         password = validated_data.pop('password', None)
-        user = super().update(instance, validated_data)
-
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        fields = list(validated_data)
         if password:
-            user.set_password(password)
-            user.save()
+            instance.set_password(password)
+            fields.append('password')
+        if fields:
+            instance.save(update_fields=fields)
 
-        return user
+        return instance
 
 
 class AuthTokenSerializer(serializers.Serializer):
@@ -0,0 +1,28 @@
+"""
+Signal handlers for user API
+"""
+
+from django.contrib.auth import get_user_model
+from django.db.models.signals import (post_save, post_delete)
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from user.authentication import (invalidate_token, invalidate_user)
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    # revoke a deleted token right away
+    invalidate_token(instance.key)
+
+
+@receiver(post_save, sender=get_user_model())
+def user_saved(sender, instance, created, **kwargs):
+    # password or active flag may have changed, so re-check the token
+    if not created:
+        invalidate_user(instance.pk)
+
+
+@receiver(post_delete, sender=get_user_model())
+def user_deleted(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
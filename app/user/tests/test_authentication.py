@@ -0,0 +1,153 @@
+"""
+Tests for cached token authentication
+"""
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from recipe.conditional import bump_data_version
+from user.authentication import (
+    CachedTokenAuthentication,
+    token_cache_key,
+    user_cache_key,
+)
+
+
+ME_URL = reverse('user:me')
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    # tests for caching token lookups
+
+    def setUp(self):
+        caches['auth'].clear()
+        self.user = get_user_model().objects.create_user(
+            email='test@example.com',
+            password='test123',
+            name='Test Name',
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_warm_token_runs_no_queries(self):
+        # test a cached token authenticates without touching the database
+        self.client.get(ME_URL)
+
+        with self.assertNumQueries(0):
+            res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['name'], 'Test Name')
+
+    def test_cached_user_fields(self):
+        # test the cache holds the user fields but never the password hash
+        self.client.get(ME_URL)
+
+        user_id = caches['auth'].get(token_cache_key(self.token.key))
+        db, fields = caches['auth'].get(user_cache_key(user_id))
+
+        self.assertEqual(user_id, self.user.pk)
+        self.assertEqual(fields['email'], 'test@example.com')
+        self.assertEqual(fields['data_version'], self.user.data_version)
+        self.assertIn('data_updated_at', fields)
+        self.assertNotIn('password', fields)
+
+    def test_cached_user_loads_password_on_access(self):
+        # test the password hash is read from the database when needed
+        self.client.get(ME_URL)
+        user, _ = CachedTokenAuthentication().authenticate_credentials(
+            self.token.key)
+
+        with self.assertNumQueries(1):
+            self.assertTrue(user.check_password('test123'))
+
+    def test_data_version_bump_refreshes_user(self):
+        # test a write drops the cached user so its new version is seen
+        self.client.get(ME_URL)
+
+        bump_data_version(self.user)
+        user, _ = CachedTokenAuthentication().authenticate_credentials(
+            self.token.key)
+
+        self.assertEqual(user.data_version, self.user.data_version + 1)
+        self.assertIsNotNone(user.data_updated_at)
+
+    def test_user_update_refreshes_user(self):
+        # test saving the user drops the cached fields
+        self.client.get(ME_URL)
+
+        self.user.name = 'Changed'
+        self.user.save()
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.data['name'], 'Changed')
+
+    def test_deleted_user_rejected(self):
+        # test a cached token of a deleted user is rejected
+        self.client.get(ME_URL)
+
+        get_user_model().objects.filter(pk=self.user.pk).delete()
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deleted_token_rejected(self):
+        # test deleting a token revokes it immediately
+        self.client.get(ME_URL)
+
+        self.token.delete()
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deactivated_user_rejected(self):
+        # test deactivating a user revokes the cached token
+        self.client.get(ME_URL)
+
+        self.user.is_active = False
+        self.user.save()
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_password_change_invalidates_cache(self):
+        # test updating the password through the API drops the cache entry
+        self.client.get(ME_URL)
+
+        res = self.client.patch(ME_URL, {'password': 'newpassword123'})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        with self.assertNumQueries(1):
+            self.client.get(ME_URL)
+
+    def test_invalid_token_rejected(self):
+        # test unknown tokens are not cached as valid
+        self.client.credentials(HTTP_AUTHORIZATION='Token invalid')
+
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_update_keeps_newer_data_version(self):
+        # test a cached user does not write its old data version back
+        self.client.get(ME_URL)
+        self.client.post(RECIPES_URL, {
+            'title': 'Soup', 'time_minutes': 5, 'price': '1.00'})
+        self.user.refresh_from_db()
+        version = self.user.data_version
+
+        res = self.client.patch(ME_URL, {'name': 'New Name'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.name, 'New Name')
+        self.assertEqual(self.user.data_version, version)
+        self.assertGreater(version, 0)
@@ -2,9 +2,10 @@
 views for the user API
 """
 
-from rest_framework import generics, authentication, permissions
+from rest_framework import generics, permissions
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.settings import api_settings
+from user.authentication import CachedTokenAuthentication
 from user.serializers import (UserSerializer, AuthTokenSerializer)
 
 
@@ -21,7 +22,7 @@ class CreateTokenView(ObtainAuthToken):
 class ManagerUserView(generics.RetrieveUpdateAPIView):
     # manage the authenticated user
     serializer_class = UserSerializer
-    authentication_classes = [authentication.TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [permissions.IsAuthenticated]
 
     def get_object(self):
@@ -0,0 +1,401 @@
+"""
+Load test of the recipe API: throughput, latency and queries per request
+
+Seed the database at one of the benchmark scales (1k, 100k or 1m recipes),
+then run every scenario for a fixed time at each concurrency level:
+
+    docker-compose run --rm app python manage.py seed_data --scale 100k
+    python benchmarks/api_load.py --concurrency 1 16 64 \\
+        --output results-100k.json
+
+Throughput and latency percentiles are measured by the clients. Queries
+per request are the difference of the server's http_db_queries histogram
+on /metrics before and after each scenario, so the server should not
+serve other traffic during a run.
+
+To gate a change on performance, run the same scale against a saved
+result:
+
+    python benchmarks/api_load.py --baseline results-100k.json
+
+The exit status is 1 when a tracked metric of any scenario got worse than
+in the baseline by more than --threshold percent.
+
+Only the standard library is used so it runs from any machine.
+"""
+import argparse
+import http.client
+import json
+import random
+import re
+import statistics
+import struct
+import sys
+import threading
+import time
+import uuid
+import zlib
+from datetime import (datetime, timezone)
+from urllib.parse import urlsplit
+
+from slow_clients import percentile
+
+
+RECIPES_PATH = '/api/recipe/recipes/'
+TAGS_PATH = '/api/recipe/tags/'
+INGREDIENTS_PATH = '/api/recipe/ingredients/'
+TOKEN_PATH = '/api/user/token/'
+METRICS_PATH = '/metrics'
+PAGE_SIZE = 20
+# ids collected per account for detail, filter and upload requests
+SAMPLE_SIZE = 100
+
+# metric -> True if a higher value is better
+TRACKED = {
+    'throughput_rps': True,
+    'latency_ms.p50': False,
+    'latency_ms.p95': False,
+    'latency_ms.p99': False,
+    'queries_per_request': False,
+}
+METRIC_LINE = re.compile(
+    r'^http_db_queries_(sum|count)\{([^}]*)\} (\S+)$', re.MULTILINE)
+ROUTE_LABEL = re.compile(r'route="([^"]*)"')
+
+
+def png(width=64, height=64):
+    # return a valid grey PNG image of the given size
+    def chunk(kind, data):
+        body = kind + data
+        return (struct.pack('>I', len(data)) + body +
+                struct.pack('>I', zlib.crc32(body)))
+
+    rows = b''.join(b'\x00' + b'\x80' * width for _ in range(height))
+    return (
+        b'\x89PNG\r\n\x1a\n' +
+        chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0)) +
+        chunk(b'IDAT', zlib.compress(rows)) +
+        chunk(b'IEND', b'')
+    )
+
+
+class Client:
+    # one keep-alive connection, reopened when the server closes it
+
+    def __init__(self, url):
+        url = urlsplit(url)
+        self.host, self.port = url.hostname, url.port or 80
+        self.connection = None
+
+    def request(self, method, path, body=None, headers=None):
+        # send a request and return the status code and body
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(
+                    self.host, self.port, timeout=60)
+            try:
+                self.connection.request(
+                    method, path, body=body, headers=headers or {})
+                response = self.connection.getresponse()
+                return response.status, response.read()
+            except (http.client.HTTPException, OSError):
+                self.connection.close()
+                self.connection = None
+                if attempt:
+                    raise
+
+    def json(self, method, path, data=None, token=None):
+        headers = {'Accept': 'application/json'}
+        if token:
+            headers['Authorization'] = f'Token {token}'
+        body = None
+        if data is not None:
+            body = json.dumps(data)
+            headers['Content-Type'] = 'application/json'
+        status, content = self.request(method, path, body, headers)
+        if status >= 400:
+            raise RuntimeError(f'{method} {path} returned {status}')
+        return json.loads(content) if content else None
+
+
+def login(client, email, password):
+    # return an account with its token and sample ids to request
+    token = client.json('POST', TOKEN_PATH, {
+        'email': email, 'password': password})['token']
+
+    def ids(path):
+        page = client.json(
+            'GET', f'{path}?page_size={SAMPLE_SIZE}', token=token)
+        return [item['id'] for item in page['results']]
+
+    return {
+        'email': email,
+        'token': token,
+        'recipes': ids(RECIPES_PATH),
+        'tags': ids(TAGS_PATH),
+        'ingredients': ids(INGREDIENTS_PATH),
+    }
+
+
+def auth(account, **headers):
+    headers['Authorization'] = f'Token {account["token"]}'
+    return headers
+
+
+def recipe_list(account, rng, args):
+    return 'GET', f'{RECIPES_PATH}?page_size={PAGE_SIZE}', None, auth(account)
+
+
+def recipe_filter(account, rng, args):
+    tags = rng.sample(account['tags'], min(2, len(account['tags'])))
+    path = (f'{RECIPES_PATH}?page_size={PAGE_SIZE}'
+            f'&tags={",".join(map(str, tags))}')
+    return 'GET', path, None, auth(account)
+
+
+def recipe_detail(account, rng, args):
+    recipe_id = rng.choice(account['recipes'])
+    return 'GET', f'{RECIPES_PATH}{recipe_id}/', None, auth(account)
+
+
+def recipe_create(account, rng, args):
+    body = json.dumps({
+        'title': f'Load test {rng.randrange(10 ** 6)}',
+        'time_minutes': rng.randint(5, 120),
+        'price': '4.50',
+        'tags': [{'name': 'Load test'}],
+        'ingredients': [{'name': 'Salt'}, {'name': 'Pepper'}],
+    })
+    headers = auth(account, **{'Content-Type': 'application/json'})
+    return 'POST', RECIPES_PATH, body, headers
+
+
+def tag_list(account, rng, args):
+    return 'GET', f'{TAGS_PATH}?page_size={PAGE_SIZE}', None, auth(account)
+
+
+def ingredient_list(account, rng, args):
+    path = f'{INGREDIENTS_PATH}?page_size={PAGE_SIZE}'
+    return 'GET', path, None, auth(account)
+
+
+def token(account, rng, args):
+    body = json.dumps({'email': account['email'], 'password': args.password})
+    return 'POST', TOKEN_PATH, body, {'Content-Type': 'application/json'}
+
+
+IMAGE = png()
+
+
+def upload(account, rng, args):
+    boundary = uuid.uuid4().hex
+    body = (
+        f'--{boundary}\r\n'
+        'Content-Disposition: form-data; name="image"; '
+        'filename="load.png"\r\n'
+        'Content-Type: image/png\r\n\r\n'
+    ).encode() + IMAGE + f'\r\n--{boundary}--\r\n'.encode()
+    recipe_id = rng.choice(account['recipes'])
+    headers = auth(account, **{
+        'Content-Type': f'multipart/form-data; boundary={boundary}'})
+    return 'POST', f'{RECIPES_PATH}{recipe_id}/upload-image/', body, headers
+
+
+# name -> (request builder, route name on /metrics, account ids it needs)
+SCENARIOS = {
+    'recipe-list': (recipe_list, 'recipe:recipe-list', None),
+    'recipe-filter': (recipe_filter, 'recipe:recipe-list', 'tags'),
+    'recipe-detail': (recipe_detail, 'recipe:recipe-detail', 'recipes'),
+    'tag-list': (tag_list, 'recipe:tag-list', None),
+    'ingredient-list': (ingredient_list, 'recipe:ingredient-list', None),
+    'recipe-create': (recipe_create, 'recipe:recipe-list', None),
+    'upload': (upload, 'recipe:recipe-upload-image', 'recipes'),
+    'token': (token, 'user:token', None),
+}
+
+
+def query_totals(url):
+    # return {route: [query sum, request count]} from /metrics, or None
+    try:
+        status, content = Client(url).request('GET', METRICS_PATH)
+    except (http.client.HTTPException, OSError):
+        return None
+    if status != 200:
+        return None
+
+    totals = {}
+    for kind, labels, value in METRIC_LINE.findall(content.decode()):
+        route = ROUTE_LABEL.search(labels).group(1)
+        total = totals.setdefault(route, [0.0, 0.0])
+        total[kind == 'count'] += float(value)
+    return totals
+
+
+def worker(args, build, accounts, seed, deadline, record):
+    # issue requests back to back until the deadline
+    client = Client(args.url)
+    rng = random.Random(seed)
+    while time.monotonic() < deadline:
+        method, path, body, headers = build(rng.choice(accounts), rng, args)
+        start = time.monotonic()
+        try:
+            status, _ = client.request(method, path, body, headers)
+        except (http.client.HTTPException, OSError):
+            status = None
+        record(status, time.monotonic() - start)
+
+
+def run_scenario(args, name, accounts, concurrency):
+    build, route, needs = SCENARIOS[name]
+    if needs:
+        accounts = [account for account in accounts if account[needs]]
+    if not accounts:
+        return {'scenario': name, 'concurrency': concurrency,
+                'skipped': f'no account has {needs}'}
+
+    def run(seconds, record):
+        deadline = time.monotonic() + seconds
+        threads = [
+            threading.Thread(target=worker, args=(
+                args, build, accounts, args.seed + n, deadline, record))
+            for n in range(concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    # let caches and connections warm up before measuring
+    run(args.warmup, lambda status, seconds: None)
+
+    latencies, errors = [], []
+
+    def record(status, seconds):
+        if status is not None and status < 400:
+            latencies.append(seconds)
+        else:
+            errors.append(status)
+
+    before = query_totals(args.url)
+    started = time.monotonic()
+    run(args.duration, record)
+    elapsed = time.monotonic() - started
+    after = query_totals(args.url)
+
+    queries = None
+    if before is not None and after is not None:
+        old = before.get(route, [0.0, 0.0])
+        new = after.get(route, [0.0, 0.0])
+        if new[1] > old[1]:
+            queries = round((new[0] - old[0]) / (new[1] - old[1]), 2)
+
+    def ms(value):
+        return None if value is None else round(value * 1000, 2)
+
+    return {
+        'scenario': name,
+        'concurrency': concurrency,
+        'duration_s': round(elapsed, 2),
+        'requests': len(latencies),
+        'errors': len(errors),
+        'throughput_rps': round(len(latencies) / elapsed, 2),
+        'latency_ms': {
+            'mean': ms(statistics.mean(latencies)) if latencies else None,
+            'p50': ms(percentile(latencies, 50)),
+            'p95': ms(percentile(latencies, 95)),
+            'p99': ms(percentile(latencies, 99)),
+            'max': ms(max(latencies)) if latencies else None,
+        },
+        'queries_per_request': queries,
+    }
+
+
+def metric(result, name):
+    value = result
+    for key in name.split('.'):
+        value = value.get(key) if isinstance(value, dict) else None
+    return value
+
+
+def regressions(results, baseline, threshold):
+    # return a message for every tracked metric worse than the baseline
+    old_results = {
+        (result['scenario'], result['concurrency']): result
+        for result in baseline['results']
+    }
+    messages = []
+    for result in results:
+        old = old_results.get((result['scenario'], result['concurrency']))
+        if old is None:
+            continue
+        for name, higher_is_better in TRACKED.items():
+            before, after = metric(old, name), metric(result, name)
+            if before is None or after is None:
+                continue
+            change = after - before if not higher_is_better else before - after
+            if change <= 0:
+                continue
+            if before == 0 or change / before * 100 > threshold:
+                messages.append(
+                    f'{result["scenario"]} at concurrency '
+                    f'{result["concurrency"]}: {name} {before} -> {after}')
+    return messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument(
+        '--scenario', nargs='+', choices=list(SCENARIOS),
+        default=list(SCENARIOS))
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[16])
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--warmup', type=float, default=3)
+    parser.add_argument(
+        '--accounts', type=int, default=20,
+        help='number of seeded users to send requests as')
+    parser.add_argument('--email', default='seed{}@example.com')
+    parser.add_argument('--password', default='benchmark')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='also write the results here')
+    parser.add_argument('--baseline', help='results of an earlier run')
+    parser.add_argument(
+        '--threshold', type=float, default=10,
+        help='allowed change of a tracked metric in percent')
+    args = parser.parse_args()
+
+    client = Client(args.url)
+    accounts = [
+        login(client, args.email.format(n), args.password)
+        for n in range(1, args.accounts + 1)
+    ]
+
+    report = {
+        'url': args.url,
+        'started_at': datetime.now(timezone.utc).isoformat(),
+        'accounts': args.accounts,
+        'seed': args.seed,
+        'results': [
+            run_scenario(args, name, accounts, concurrency)
+            for name in args.scenario
+            for concurrency in args.concurrency
+        ],
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output + '\n')
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        messages = regressions(report['results'], baseline, args.threshold)
+        for message in messages:
+            print(f'regression: {message}', file=sys.stderr)
+        if messages:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Time from starting a server command to its first 200 response
+
+Starts the command, polls a URL until it answers 200 and reports the
+elapsed seconds, then stops the command. Compare the boot path before and
+after a change by running it once for each:
+
+    python benchmarks/cold_start.py --url http://127.0.0.1:9000/readyz \\
+        -- sh -c 'python manage.py migrate && uwsgi --http :9000 ...'
+
+Only the standard library is used so it runs from any machine.
+"""
+import argparse
+import json
+import os
+import shlex
+import signal
+import statistics
+import subprocess
+import time
+import urllib.error
+import urllib.request
+
+
+def first_ok(url, deadline, interval):
+    # poll url until it answers 200 and return when it did
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=interval) as response:
+                if response.status == 200:
+                    return time.monotonic()
+        except (OSError, urllib.error.URLError):
+            pass
+        time.sleep(interval)
+
+    return None
+
+
+def cold_start(args):
+    # run the command once and return seconds to the first 200, or None
+    start = time.monotonic()
+    process = subprocess.Popen(
+        args.command,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    try:
+        ready = first_ok(args.url, start + args.timeout, args.interval)
+    finally:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait()
+
+    return None if ready is None else round(ready - start, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--url', required=True)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--interval', type=float, default=0.05)
+    parser.add_argument('command', nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+    if args.command[:1] == ['--']:
+        args.command = args.command[1:]
+    if not args.command:
+        parser.error('give the server command after --')
+
+    seconds = [cold_start(args) for _ in range(args.runs)]
+    started = [s for s in seconds if s is not None]
+    print(json.dumps({
+        'command': shlex.join(args.command),
+        'runs': seconds,
+        'median': statistics.median(started) if started else None,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""
+Throughput and tail latency of the recipe API under slow clients
+
+Runs a fixed number of well behaved clients against a read endpoint while
+other connections trickle request bodies and read responses slowly, the
+way phones on bad networks do. Run it once against each deployment mode
+and compare the JSON output:
+
+    SERVER_MODE=uwsgi docker-compose -f docker-compose-deploy.yml up
+    python benchmarks/slow_clients.py --token TOKEN > uwsgi.json
+
+    SERVER_MODE=asgi docker-compose -f docker-compose-deploy.yml up
+    python benchmarks/slow_clients.py --token TOKEN > asgi.json
+
+Only the standard library is used so it runs from any machine.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from urllib.parse import urlsplit
+
+
+def percentile(values, pct):
+    # nearest rank percentile of a list of numbers
+    if not values:
+        return None
+    values = sorted(values)
+    index = max(0, min(len(values) - 1, round(pct / 100 * len(values)) - 1))
+    return values[index]
+
+
+async def fetch(host, port, path, token):
+    # send one GET and return the status code
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write((
+            f'GET {path} HTTP/1.1\r\n'
+            f'Host: {host}\r\n'
+            f'Authorization: Token {token}\r\n'
+            'Connection: close\r\n\r\n'
+        ).encode())
+        await writer.drain()
+        status_line = await reader.readline()
+        await reader.read()
+        return int(status_line.split()[1])
+    finally:
+        writer.close()
+
+
+async def fast_client(args, host, port, deadline, latencies, errors):
+    # issue requests back to back until the deadline
+    while time.monotonic() < deadline:
+        start = time.monotonic()
+        try:
+            status = await fetch(host, port, args.path, args.token)
+        except (OSError, IndexError, ValueError):
+            status = None
+        if status == 200:
+            latencies.append(time.monotonic() - start)
+        else:
+            errors.append(status)
+
+
+async def slow_upload(args, host, port, deadline):
+    # trickle a large request body a few bytes at a time
+    while time.monotonic() < deadline:
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+            writer.write((
+                f'POST {args.path} HTTP/1.1\r\n'
+                f'Host: {host}\r\n'
+                f'Authorization: Token {args.token}\r\n'
+                'Content-Type: application/json\r\n'
+                f'Content-Length: {args.upload_bytes}\r\n\r\n'
+            ).encode())
+            sent = 0
+            while sent < args.upload_bytes and time.monotonic() < deadline:
+                writer.write(b' ' * args.chunk_bytes)
+                await writer.drain()
+                sent += args.chunk_bytes
+                await asyncio.sleep(args.chunk_delay)
+            writer.close()
+        except OSError:
+            await asyncio.sleep(args.chunk_delay)
+
+
+async def slow_download(args, host, port, deadline):
+    # request a list and read the response a few bytes at a time
+    while time.monotonic() < deadline:
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+            writer.write((
+                f'GET {args.path} HTTP/1.1\r\n'
+                f'Host: {host}\r\n'
+                f'Authorization: Token {args.token}\r\n'
+                'Connection: close\r\n\r\n'
+            ).encode())
+            await writer.drain()
+            while time.monotonic() < deadline:
+                if not await reader.read(args.chunk_bytes):
+                    break
+                await asyncio.sleep(args.chunk_delay)
+            writer.close()
+        except OSError:
+            await asyncio.sleep(args.chunk_delay)
+
+
+async def run(args):
+    url = urlsplit(args.url)
+    host, port = url.hostname, url.port or 80
+    deadline = time.monotonic() + args.duration
+    latencies, errors = [], []
+
+    tasks = [
+        fast_client(args, host, port, deadline, latencies, errors)
+        for _ in range(args.clients)
+    ]
+    tasks += [
+        slow_upload(args, host, port, deadline)
+        for _ in range(args.slow_clients // 2)
+    ]
+    tasks += [
+        slow_download(args, host, port, deadline)
+        for _ in range(args.slow_clients - args.slow_clients // 2)
+    ]
+    started = time.monotonic()
+    await asyncio.gather(*tasks)
+    elapsed = time.monotonic() - started
+
+    def ms(value):
+        return None if value is None else round(value * 1000, 2)
+
+    return {
+        'url': args.url + args.path,
+        'clients': args.clients,
+        'slow_clients': args.slow_clients,
+        'duration_s': round(elapsed, 2),
+        'requests': len(latencies),
+        'errors': len(errors),
+        'throughput_rps': round(len(latencies) / elapsed, 2),
+        'latency_ms': {
+            'mean': ms(statistics.mean(latencies)) if latencies else None,
+            'p50': ms(percentile(latencies, 50)),
+            'p95': ms(percentile(latencies, 95)),
+            'p99': ms(percentile(latencies, 99)),
+            'max': ms(max(latencies)) if latencies else None,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--path', default='/api/recipe/recipes/')
+    parser.add_argument('--token', required=True)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--slow-clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--upload-bytes', type=int, default=10 * 1024 * 1024)
+    parser.add_argument('--chunk-bytes', type=int, default=64)
+    parser.add_argument('--chunk-delay', type=float, default=0.1)
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -5,6 +5,52 @@ server {
         alias /vol/static;
     }
 
+    # static files are hashed and gzipped at build time; a hashed name
+    # never changes content
+    location ~ "^/static/static/(.+\.[0-9a-f]{12}\.[a-z0-9]+)$" {
+        alias /vol/static/static/$1;
+        gzip_static on;
+        gzip_vary on;
+        add_header Cache-Control "public, max-age=31536000, immutable";
+        access_log off;
+    }
+
+    # derivative names carry a hash of their content, so they never go
+    # stale
+    location /static/media/uploads/recipe/derivatives/ {
+        alias /vol/static/media/uploads/recipe/derivatives/;
+        add_header Cache-Control "public, max-age=31536000, immutable";
+        access_log off;
+    }
+
+    # recipe imports are read line by line, so pass the body through
+    location /api/recipe/recipes/import/ {
+        uwsgi_pass              ${APP_HOST}:${APP_PORT};
+        include                 /etc/nginx/uwsgi_params;
+        uwsgi_request_buffering off;
+        uwsgi_read_timeout      600s;
+        client_max_body_size    1G;
+    }
+
+    # orchestrator probes, answered by the app without auth
+    location ~ ^/(healthz|readyz)/?$ {
+        uwsgi_pass              ${APP_HOST}:${APP_PORT};
+        include                 /etc/nginx/uwsgi_params;
+        access_log              off;
+    }
+
+    # metrics are for the scraper on the private network only
+    location ~ ^/metrics/?$ {
+        allow                   127.0.0.1;
+        allow                   10.0.0.0/8;
+        allow                   172.16.0.0/12;
+        allow                   192.168.0.0/16;
+        deny                    all;
+        uwsgi_pass              ${APP_HOST}:${APP_PORT};
+        include                 /etc/nginx/uwsgi_params;
+        access_log              off;
+    }
+
     location / {
         uwsgi_pass              ${APP_HOST}:${APP_PORT};
         include                 /etc/nginx/uwsgi_params;
@@ -0,0 +1,13 @@
+#!/bin/sh
+
+# one-shot release step, run once per deploy before the app starts
+
+set -e
+
+python manage.py wait_for_db
+python manage.py migrate --noinput
+
+# publish the static files built into the image where nginx reads them;
+# earlier hashed names stay so pages rendered by old workers still load
+mkdir -p /vol/web/static
+cp -a "$STATIC_ROOT"/. /vol/web/static/
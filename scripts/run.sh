@@ -2,8 +2,24 @@
 
 set -e
 
+# migrations and static files are handled once per deploy by release.sh
 python manage.py wait_for_db
-python manage.py collectstatic --noinput
-python manage.py migrate
 
-uwsgi --socket :9000 --workers 4 --master --enable-threads --module app.wsgi
\ No newline at end of file
+# workers write metrics here for /metrics to sum; samples of an earlier
+# run must not be counted again
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/metrics}
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
+# both servers import the app in the master before forking, so workers
+# share its memory and serve as soon as they start
+if [ "$SERVER_MODE" = "asgi" ]; then
+    gunicorn app.asgi:application \
+        --worker-class uvicorn.workers.UvicornWorker \
+        --workers 4 \
+        --preload \
+        --bind :9000
+else
+    uwsgi --socket :9000 --workers 4 --master --enable-threads --need-app \
+        --module app.wsgi
+fi